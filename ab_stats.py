@@ -0,0 +1,223 @@
+# ab_stats.py - Running per-variant statistics, confidence intervals and Welch t-tests
+import math
+from itertools import combinations
+from statistics import NormalDist
+
+# Session measurements compared across variants (columns of csci_8980_carbon_test)
+METRICS = ('co2_grams', 'energy_kwh', 'total_tokens', 'total_requests', 'duration_minutes')
+
+# Variant every other variant is compared with first (A shows no emissions)
+CONTROL_VARIANT = 'A'
+
+# Beyond this many degrees of freedom the t distribution is treated as normal
+NORMAL_DF = 1000
+
+
+class RunningStats:
+    """Count, mean and sum of squared deviations (Welford), updated one value at a time."""
+
+    __slots__ = ('n', 'mean', 'm2')
+
+    def __init__(self, n=0, mean=0.0, m2=0.0):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Combine with stats over a disjoint set of values (Chan et al.)"""
+        n = self.n + other.n
+        if other.n == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else None
+
+    @property
+    def stderr(self):
+        return math.sqrt(self.variance / self.n) if self.n > 1 else None
+
+    def interval(self, confidence=0.95):
+        """Confidence interval for the mean (Student's t), or None below two values"""
+        if self.n < 2:
+            return None
+        half = t_critical(confidence, self.n - 1) * self.stderr
+        return (self.mean - half, self.mean + half)
+
+
+class VariantStats:
+    """RunningStats per (test variant, metric); adding a session is O(1)."""
+
+    def __init__(self):
+        self.stats = {}
+
+    def add(self, test_variant, values):
+        """Add one session's measurements (a mapping with METRICS keys; None is skipped)"""
+        for metric in METRICS:
+            value = values.get(metric)
+            if value is not None:
+                key = (test_variant, metric)
+                stats = self.stats.get(key)
+                if stats is None:
+                    stats = self.stats[key] = RunningStats()
+                stats.add(float(value))
+
+    def add_rows(self, rows):
+        """Add session rows (dicts with test_variant and METRICS columns)"""
+        for row in rows:
+            self.add(row['test_variant'], row)
+        return self
+
+    def merge(self, other):
+        for key, stats in other.stats.items():
+            self.stats.setdefault(key, RunningStats()).merge(stats)
+        return self
+
+    def states(self):
+        """(test_variant, metric, n, mean, m2) tuples, sorted, for storage"""
+        return [(variant, metric, s.n, s.mean, s.m2) for (variant, metric), s in sorted(self.stats.items())]
+
+    @classmethod
+    def from_states(cls, states):
+        """Rebuild from stored (test_variant, metric, n, mean, m2) rows or dicts"""
+        engine = cls()
+        for state in states:
+            if isinstance(state, dict):
+                state = (state['test_variant'], state['metric'], state['n'], state['mean'], state['m2'])
+            variant, metric, n, mean, m2 = state
+            engine.stats[(variant, metric)] = RunningStats(int(n), float(mean), float(m2))
+        return engine
+
+    def report(self, confidence=0.95):
+        """Per-variant summaries and pairwise Welch t-tests for every metric"""
+        variants = sorted({variant for variant, _ in self.stats})
+        # Compare against the control first, then the remaining pairs
+        pairs = sorted(combinations(variants, 2), key=lambda pair: (CONTROL_VARIANT not in pair, pair))
+        report = {'confidence': confidence, 'variants': {}, 'comparisons': []}
+        for variant in variants:
+            report['variants'][variant] = {
+                metric: summarize(self.stats[(variant, metric)], confidence)
+                for metric in METRICS if (variant, metric) in self.stats
+            }
+        for a, b in pairs:
+            for metric in METRICS:
+                if (a, metric) in self.stats and (b, metric) in self.stats:
+                    test = welch_test(self.stats[(a, metric)], self.stats[(b, metric)], confidence)
+                    if test is not None:
+                        report['comparisons'].append({'metric': metric, 'variant': b, 'baseline': a, **test})
+        return report
+
+
+def summarize(stats, confidence):
+    interval = stats.interval(confidence)
+    return {
+        'n': stats.n,
+        'mean': stats.mean if stats.n else None,
+        'stddev': math.sqrt(stats.variance) if stats.variance is not None else None,
+        'ci_low': interval[0] if interval else None,
+        'ci_high': interval[1] if interval else None,
+    }
+
+
+def welch_test(baseline, other, confidence=0.95):
+    """Welch's t-test of other.mean - baseline.mean, or None without two values on each side"""
+    if baseline.n < 2 or other.n < 2:
+        return None
+    va, vb = baseline.variance / baseline.n, other.variance / other.n
+    difference = other.mean - baseline.mean
+    se = math.sqrt(va + vb)
+    if se == 0:
+        # Identical constant samples differ by exactly nothing; constant but different ones always differ
+        p_value = 1.0 if difference == 0 else 0.0
+        return {'difference': difference, 'relative_difference': _relative(difference, baseline.mean),
+                't': None, 'df': None, 'p_value': p_value, 'ci_low': difference, 'ci_high': difference,
+                'significant': p_value < 1 - confidence}
+    t = difference / se
+    df = (va + vb) ** 2 / (va ** 2 / (baseline.n - 1) + vb ** 2 / (other.n - 1))
+    p_value = 2 * t_sf(abs(t), df)
+    half = t_critical(confidence, df) * se
+    return {
+        'difference': difference,
+        'relative_difference': _relative(difference, baseline.mean),
+        't': t,
+        'df': df,
+        'p_value': p_value,
+        'ci_low': difference - half,
+        'ci_high': difference + half,
+        'significant': p_value < 1 - confidence,
+    }
+
+
+def _relative(difference, baseline_mean):
+    return difference / baseline_mean if baseline_mean else None
+
+
+def t_sf(t, df):
+    """P(T > t) for Student's t with df degrees of freedom, t >= 0"""
+    if df > NORMAL_DF:
+        return 1 - NormalDist().cdf(t)
+    return 0.5 * _betainc(df / 2, 0.5, df / (df + t * t))
+
+
+def t_critical(confidence, df):
+    """Two-sided critical value: P(|T| <= t) = confidence"""
+    if df > NORMAL_DF:
+        return NormalDist().inv_cdf(0.5 + confidence / 2)
+    tail = (1 - confidence) / 2
+    low, high = 0.0, 1.0
+    while t_sf(high, df) > tail:
+        high *= 2
+    for _ in range(100):
+        mid = (low + high) / 2
+        if t_sf(mid, df) > tail:
+            low = mid
+        else:
+            high = mid
+        if high - low < 1e-10 * high:
+            break
+    return (low + high) / 2
+
+
+def _betainc(a, b, x):
+    """Regularized incomplete beta function I_x(a, b)"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                     + a * math.log(x) + b * math.log1p(-x))
+    # The continued fraction converges quickly on this side; use the symmetry otherwise
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1 - front * _betacf(b, a, 1 - x) / b
+
+
+def _betacf(a, b, x, max_iterations=500, epsilon=1e-14):
+    """Continued fraction for the incomplete beta function (modified Lentz)"""
+    tiny = 1e-300
+    c, d = 1.0, 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, max_iterations + 1):
+        m2 = 2 * m
+        for numerator in (m * (b - m) * x / ((a + m2 - 1) * (a + m2)),
+                          -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= d * c
+        if abs(d * c - 1) < epsilon:
+            break
+    return result
@@ -0,0 +1,278 @@
+"""Async (ASGI) serving mode for the chat app.
+
+Serves the chat UI's routes from `server.app` (/, /chat, /chat/stream,
+/end_session, /test_info, /metrics), but the upstream completion call uses
+the async OpenAI client and database writes run in a worker thread, so one
+process can hold many in-flight chats:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+"""
+import os
+import time
+from contextlib import asynccontextmanager
+
+import jinja2
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.sessions import SessionMiddleware
+
+# server loads .env, so it is imported ahead of modules that read settings at import
+from server import (
+    MAX_COMPLETION_TOKENS, TEST_VARIANTS, add_turn_impact, assign_test_variant, cache_reply,
+    close_session, deployment, get_cached_reply, get_conversation, get_emissions_context,
+    admission_tokens, log, observe_completion, rate_limited_body, record_turn,
+    save_conversation, sse_event, start_conversation, startup, upstream_limiter
+)
+import metrics
+from context_window import build_prompt
+from rate_limiter import RateLimited, call_with_retries_async
+from token_manager import close_async_openai_client, get_async_openai_client
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(startup)
+    yield
+    await close_async_openai_client()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(SessionMiddleware, secret_key=os.getenv('FLASK_KEY'))
+app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, 'static')), name="static")
+
+# The templates are shared with the Flask app, so provide Flask's url_for('static', filename=...)
+templates = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(BASE_DIR, 'templates')),
+    autoescape=True
+)
+templates.globals['url_for'] = lambda endpoint, filename: f"/{endpoint}/{filename}"
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    metrics.start()
+    started = time.perf_counter()
+    status = 500
+    metrics.HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        route = route.path if route else 'unmatched'
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+        metrics.HTTP_REQUESTS.inc(route=route, status=status)
+        metrics.HTTP_IN_FLIGHT.dec()
+
+
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    request.session['test_variant'] = assign_test_variant()
+    return templates.get_template('index.html').render(test_variant=request.session['test_variant'])
+
+
+@app.post("/chat")
+async def chat(request: Request):
+    try:
+        data = await request.json()
+        user_message = data.get('message', '')
+
+        if not user_message:
+            return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+        session = request.session
+        session_id = start_conversation(session)
+
+        conversation = await run_in_threadpool(get_conversation, session_id, session.get('test_variant', 'A'))
+        messages = conversation['messages']
+        messages.append({"role": "user", "content": user_message})
+
+        prompt = build_prompt(conversation)
+        key, assistant_reply = await run_in_threadpool(get_cached_reply, prompt, conversation['cumulative_impacts'])
+
+        if assistant_reply is None:
+            tokens = admission_tokens(conversation)
+            await upstream_limiter.acquire_async(tokens)
+
+            started = time.perf_counter()
+            with metrics.UPSTREAM_IN_FLIGHT.track():
+                chat_response = await call_with_retries_async(
+                    upstream_limiter, tokens, lambda: get_async_openai_client().chat.completions.create(
+                        messages=prompt,
+                        max_completion_tokens=MAX_COMPLETION_TOKENS,
+                        model=deployment
+                    ), admitted=True)
+            upstream_seconds = time.perf_counter() - started
+            observe_completion('async', upstream_seconds, chat_response.usage)
+
+            assistant_reply = chat_response.choices[0].message.content
+            await run_in_threadpool(cache_reply, key, assistant_reply, chat_response.usage, upstream_seconds)
+            assistant_reply = assistant_reply or "No response"
+            turn_impact = add_turn_impact(conversation['cumulative_impacts'], chat_response.usage)
+            record_turn(session_id, session.get('test_variant', 'A'), 'async', turn_impact, upstream_seconds)
+
+        messages.append({"role": "assistant", "content": assistant_reply})
+        await run_in_threadpool(save_conversation, session_id, conversation)
+
+        return {
+            'response': assistant_reply,
+            'session_id': session_id,
+            'test_variant': session.get('test_variant', 'A')
+        }
+
+    except RateLimited as e:
+        log.warning("Chat refused: %s", e)
+        body = rate_limited_body(e)
+        return JSONResponse(body, status_code=429, headers={'Retry-After': str(body['retry_after'])})
+    except Exception as e:
+        metrics.ERRORS.inc(operation='chat')
+        log.error("Chat failed: %s", e)
+        return JSONResponse({'error': f'An error occurred: {str(e)}'}, status_code=500)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """Stream the assistant's reply as Server-Sent Events while it is generated"""
+    data = await request.json()
+    user_message = data.get('message', '')
+
+    if not user_message:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+    session = request.session
+    session_id = start_conversation(session)
+    test_variant = session.get('test_variant', 'A')
+    conversation = await run_in_threadpool(get_conversation, session_id, test_variant)
+    messages = conversation['messages']
+    messages.append({"role": "user", "content": user_message})
+
+    prompt = build_prompt(conversation)
+    key, cached_reply = await run_in_threadpool(get_cached_reply, prompt, conversation['cumulative_impacts'])
+    tokens = admission_tokens(conversation)
+    if cached_reply is None:
+        # Wait for budget before the response starts, while a refusal can still be a 429
+        try:
+            await upstream_limiter.acquire_async(tokens)
+        except RateLimited as e:
+            log.warning("Streaming chat refused: %s", e)
+            body = rate_limited_body(e)
+            return JSONResponse(body, status_code=429, headers={'Retry-After': str(body['retry_after'])})
+
+    async def generate():
+        try:
+            if cached_reply is not None:
+                yield sse_event({'type': 'token', 'content': cached_reply})
+                messages.append({"role": "assistant", "content": cached_reply})
+                await run_in_threadpool(save_conversation, session_id, conversation)
+                yield sse_event({'type': 'done', 'session_id': session_id, 'test_variant': test_variant})
+                return
+
+            started = time.perf_counter()
+            reply_parts = []
+            usage = None
+            with metrics.UPSTREAM_IN_FLIGHT.track():
+                stream = await call_with_retries_async(
+                    upstream_limiter, tokens, lambda: get_async_openai_client().chat.completions.create(
+                        messages=prompt,
+                        max_completion_tokens=MAX_COMPLETION_TOKENS,
+                        model=deployment,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    ), admitted=True)
+
+                async for chunk in stream:
+                    # Usage arrives on the final chunk, which has no choices
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        reply_parts.append(token)
+                        yield sse_event({'type': 'token', 'content': token})
+            upstream_seconds = time.perf_counter() - started
+            observe_completion('async_stream', upstream_seconds, usage)
+
+            await run_in_threadpool(cache_reply, key, ''.join(reply_parts), usage, upstream_seconds)
+            assistant_reply = ''.join(reply_parts) or "No response"
+            turn_impact = add_turn_impact(conversation['cumulative_impacts'], usage)
+            record_turn(session_id, test_variant, 'async_stream', turn_impact, upstream_seconds)
+            messages.append({"role": "assistant", "content": assistant_reply})
+            await run_in_threadpool(save_conversation, session_id, conversation)
+
+            yield sse_event({'type': 'done', 'session_id': session_id, 'test_variant': test_variant})
+        except RateLimited as e:
+            log.warning("Streaming chat refused: %s", e)
+            yield sse_event(dict(rate_limited_body(e), type='error'))
+        except Exception as e:
+            metrics.ERRORS.inc(operation='chat_stream')
+            log.error("Streaming chat failed: %s", e)
+            yield sse_event({'type': 'error', 'error': f'An error occurred: {str(e)}'})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.post("/end_session")
+async def end_session(request: Request):
+    try:
+        session = request.session
+        session_id = session.get('session_id')
+        test_variant = session.get('test_variant', 'A')
+        cumulative_impacts, _ = await run_in_threadpool(
+            close_session, session_id, test_variant, session.get('session_start_time')
+        )
+
+        co2_grams = cumulative_impacts['co2_grams']
+        energy_kwh = cumulative_impacts['energy_kwh']
+
+        response_data = {
+            'message': 'Session ended',
+            'test_variant': test_variant,
+            'emissions': {
+                'co2_kg': co2_grams / 1000,
+                'co2_grams': co2_grams,
+                'energy_kwh': energy_kwh,
+                'total_tokens': cumulative_impacts['total_tokens'],
+                'requests': cumulative_impacts['requests']
+            }
+        }
+
+        if test_variant == 'C' and co2_grams > 0:
+            response_data['emissions']['context'] = get_emissions_context(cumulative_impacts)
+
+        session_variant = session.get('test_variant')
+        session.clear()
+        session['test_variant'] = session_variant
+
+        return response_data
+
+    except Exception as e:
+        metrics.ERRORS.inc(operation='end_session')
+        log.error("Error ending session: %s", e)
+        return JSONResponse({'error': f'Error ending session: {str(e)}'}, status_code=500)
+
+
+@app.get("/test_info")
+async def test_info(request: Request):
+    """Get current test variant information"""
+    variant = request.session.get('test_variant', 'A')
+    return {
+        'test_variant': variant,
+        'variant_description': TEST_VARIANTS.get(variant)
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics for this worker (or all workers, with METRICS_DIR)"""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
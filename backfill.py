@@ -0,0 +1,87 @@
+"""Recompute stored emissions for every logged session.
+
+    python backfill.py            # recompute CO2/energy from total_tokens with impact.py's factors
+    python backfill.py --dry-run  # count the rows that would change
+    python backfill.py --refresh-stats  # rebuild the rollup and A/B statistics only
+
+Run after changing a model emission factor in impact.py (EPA equivalencies
+are derived on read by the csci_8980_carbon_sessions view and need no
+backfill). Rows are streamed through a server-side cursor, recomputed a
+batch at a time with NumPy, and only rows whose values changed are written
+back, in one bulk UPDATE per batch. The rollup and A/B statistics triggers
+pick up the corrections.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+import impact
+from db import (IMPACT_COLUMNS, iter_carbon_test_rows, refresh_ab_stats, refresh_carbon_test_rollup,
+                update_carbon_test_impacts)
+
+# Stored values are NUMERIC with 8-10 decimal places; smaller differences are rounding
+ATOL = 1e-8
+RTOL = 1e-6
+
+
+def column(rows, name):
+    """One column of a batch of row dicts as a float array (NULL -> nan)"""
+    return np.array([np.nan if row[name] is None else float(row[name]) for row in rows])
+
+
+def recompute(rows, model_name=impact.DEFAULT_MODEL):
+    """Corrected (id, *IMPACT_COLUMNS) tuples for the rows in a batch that changed"""
+    tokens = np.array([row['total_tokens'] for row in rows], dtype=np.int64)
+    impacts = impact.estimate_impacts(tokens, 0, model_name)
+    new = np.column_stack([impacts[name] for name in IMPACT_COLUMNS])
+
+    old = np.column_stack([column(rows, name) for name in IMPACT_COLUMNS])
+    changed = ~np.isclose(new, old, rtol=RTOL, atol=ATOL).all(axis=1)
+
+    ids = [row['id'] for row in rows]
+    return [(ids[i],) + tuple(float(value) for value in new[i]) for i in np.flatnonzero(changed)]
+
+
+def backfill(database_url, batch_size=5000, model_name=impact.DEFAULT_MODEL, dry_run=False):
+    """Recompute every row, returning (rows scanned, rows changed)"""
+    scanned = changed = 0
+    for rows in iter_carbon_test_rows(database_url, batch_size=batch_size):
+        corrections = recompute(rows, model_name)
+        if corrections and not dry_run:
+            update_carbon_test_impacts(corrections, database_url)
+        scanned += len(rows)
+        changed += len(corrections)
+    return scanned, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--model', default=impact.DEFAULT_MODEL,
+                        help='model whose emission factor applies to total_tokens')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--refresh-stats', action='store_true',
+                        help='rebuild the per-variant rollup and A/B statistics from the table, then exit')
+    args = parser.parse_args()
+
+    load_dotenv()
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        parser.error('DATABASE_URL is not set')
+
+    started = time.perf_counter()
+    if args.refresh_stats:
+        refresh_carbon_test_rollup(database_url)
+        refresh_ab_stats(database_url)
+        print(f"Rebuilt the rollup and A/B statistics in {time.perf_counter() - started:.1f}s")
+        return
+    scanned, changed = backfill(database_url, args.batch_size, args.model, args.dry_run)
+    action = 'would update' if args.dry_run else 'updated'
+    print(f"Scanned {scanned} sessions, {action} {changed} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Offline benchmarks for the chat server (run with `python -m benchmarks.<name>`)."""
@@ -0,0 +1,259 @@
+"""End-to-end throughput of server.app with no Azure quota or database server.
+
+    python -m benchmarks.bench_app --users 20 --conversations 200 --turns 4
+    python -m benchmarks.bench_app --stream --token-delay 0.01
+    python -m benchmarks.bench_app --db postgres --database-url postgresql://localhost/carbon_bench
+    python -m benchmarks.bench_app --compare benchmarks/results/<earlier run>.json
+
+Serves the app with gunicorn (gthread workers) against the stub upstream
+and a database stand-in: a SQLite file by default, a scratch Postgres
+database with --db postgres, or none. `users` simulated users each run
+conversations of `turns` messages through /, /chat (or /chat/stream) and
+/end_session. Reports p50/p95/p99 latency per endpoint, requests/sec,
+session cookie size by turn and session rows written per second, and saves
+the results as JSON under benchmarks/results/ for comparison between runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks import sqlite_standin
+from benchmarks.load_test import ROOT, free_port, wait_until_up
+from benchmarks.stub_openai import start_stub_server, stub_endpoint
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+# Relative change in a compared metric that is flagged as a regression
+REGRESSION_THRESHOLD = 0.10
+# Metrics where lower is better; everything else compared is higher-is-better
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'cookie_bytes')
+
+
+def percentiles(samples):
+    """p50/p95/p99 in milliseconds"""
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else None
+        return {'p50_ms': value, 'p95_ms': value, 'p99_ms': value}
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'p50_ms': cuts[49] * 1000, 'p95_ms': cuts[94] * 1000, 'p99_ms': cuts[98] * 1000}
+
+
+def session_cookie_bytes(client):
+    return sum(len(cookie.value) for cookie in client.cookies.jar if cookie.name == 'session')
+
+
+async def conversation(base_url, conversation_id, args, latencies, cookie_sizes):
+    """One user visit: load the page, chat for `turns` messages, end the session"""
+    chat_path = '/chat/stream' if args.stream else '/chat'
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        async def timed(endpoint, method, path, **kwargs):
+            start = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            response.raise_for_status()
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+            return response
+
+        await timed('/', 'GET', '/')
+        for turn in range(args.turns):
+            message = f"Conversation {conversation_id}, question {turn}: what should I see in New York?"
+            await timed(chat_path, 'POST', chat_path, json={'message': message})
+            cookie_sizes.setdefault(turn + 1, []).append(session_cookie_bytes(client))
+        await timed('/end_session', 'POST', '/end_session')
+
+
+async def drive(base_url, args):
+    """Run args.conversations conversations, args.users at a time"""
+    latencies, cookie_sizes, failures = {}, {}, []
+    pending = iter(range(args.conversations))
+
+    async def user():
+        for conversation_id in pending:
+            try:
+                await conversation(base_url, conversation_id, args, latencies, cookie_sizes)
+            except httpx.HTTPError as e:
+                failures.append(repr(e))
+
+    await asyncio.gather(*(user() for _ in range(args.users)))
+    return latencies, cookie_sizes, failures
+
+
+def count_sessions(args):
+    if args.db == 'sqlite':
+        return sqlite_standin.count_sessions(args.sqlite_url)
+    if args.db == 'postgres':
+        import db
+        with db.get_postgres_connection(args.database_url) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) AS n FROM csci_8980_carbon_test")
+                return cur.fetchone()['n']
+    return 0
+
+
+def wait_for_writes(args, before, expected, started):
+    """Wait for the ingest queue to land every ended session; returns (rows, seconds since start)"""
+    deadline = time.monotonic() + args.flush_timeout
+    rows = count_sessions(args) - before
+    while rows < expected and time.monotonic() < deadline:
+        time.sleep(0.1)
+        rows = count_sessions(args) - before
+    return rows, time.perf_counter() - started
+
+
+def server_env(args, stub):
+    env = dict(os.environ, AZURE_OPENAI_ENDPOINT=stub_endpoint(stub), OPENAI_API_KEY='stub-key',
+               FLASK_KEY='bench', RESPONSE_CACHE_ENABLED='true' if args.cache else 'false',
+               INGEST_FLUSH_INTERVAL=str(args.flush_interval), LOG_LEVEL='WARNING')
+    env.pop('DATABASE_URL', None)
+    env.pop('BENCH_SQLITE_URL', None)
+    if args.db == 'sqlite':
+        env['BENCH_SQLITE_URL'] = args.sqlite_url
+    elif args.db == 'postgres':
+        env['DATABASE_URL'] = args.database_url
+    return env
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    stub = start_stub_server(latency=args.latency, prompt_tokens=args.prompt_tokens,
+                             completion_tokens=args.completion_tokens, token_delay=args.token_delay)
+    port = free_port()
+    command = ['gunicorn', '-k', 'gthread', '-w', str(args.workers), '--threads', str(args.threads),
+               '-b', f'127.0.0.1:{port}', 'benchmarks.serve_app:app']
+    process = subprocess.Popen(command, cwd=ROOT, env=server_env(args, stub),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url)
+        before = count_sessions(args)
+
+        started = time.perf_counter()
+        latencies, cookie_sizes, failures = asyncio.run(drive(base_url, args))
+        elapsed = time.perf_counter() - started
+        rows, write_seconds = wait_for_writes(args, before, args.conversations - len(failures), started)
+    finally:
+        process.terminate()
+        process.wait()
+        stub.shutdown()
+
+    requests = sum(len(samples) for samples in latencies.values())
+    return {
+        'label': args.label,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('compare', 'database_url', 'sqlite_url', 'output_dir')},
+        'wall_seconds': elapsed,
+        'requests': requests,
+        'failed_conversations': len(failures),
+        'requests_per_second': requests / elapsed,
+        'endpoints': {endpoint: {'count': len(samples), **percentiles(samples)}
+                      for endpoint, samples in sorted(latencies.items())},
+        'cookie_bytes_by_turn': {turn: statistics.mean(sizes) for turn, sizes in sorted(cookie_sizes.items())},
+        'db_rows_written': rows,
+        'db_writes_per_second': rows / write_seconds if args.db != 'none' else None,
+        'upstream_peak_in_flight': stub.max_in_flight,
+    }
+
+
+def print_results(results):
+    print(f"{results['requests']} requests in {results['wall_seconds']:.2f}s "
+          f"({results['requests_per_second']:.1f} req/s), "
+          f"{results['failed_conversations']} failed conversations")
+    for endpoint, stats in results['endpoints'].items():
+        print(f"  {endpoint:<14} n={stats['count']:<6} p50 {stats['p50_ms']:8.1f} ms   "
+              f"p95 {stats['p95_ms']:8.1f} ms   p99 {stats['p99_ms']:8.1f} ms")
+    cookies = ', '.join(f"{turn}: {size:.0f}" for turn, size in results['cookie_bytes_by_turn'].items())
+    print(f"  session cookie bytes by turn: {cookies}")
+    if results['db_writes_per_second'] is not None:
+        print(f"  session rows written: {results['db_rows_written']} "
+              f"({results['db_writes_per_second']:.1f} rows/s over the run)")
+
+
+def comparable(results):
+    """Flat {metric name: value} used to compare two runs"""
+    flat = {'requests_per_second': results['requests_per_second']}
+    if results.get('db_writes_per_second') is not None:
+        flat['db_writes_per_second'] = results['db_writes_per_second']
+    for endpoint, stats in results['endpoints'].items():
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            flat[f"{endpoint} {key}"] = stats[key]
+    if results['cookie_bytes_by_turn']:
+        flat['max cookie_bytes'] = max(results['cookie_bytes_by_turn'].values())
+    return flat
+
+
+def compare(results, baseline_path):
+    """Print each metric's change against an earlier run, flagging regressions"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"vs {baseline_path} (commit {baseline.get('commit')}):")
+    old, new = comparable(baseline), comparable(results)
+    regressions = 0
+    for name, value in new.items():
+        if old.get(name) in (None, 0) or value is None:
+            continue
+        change = (value - old[name]) / old[name]
+        worse = change > REGRESSION_THRESHOLD if name.endswith(LOWER_IS_BETTER) else change < -REGRESSION_THRESHOLD
+        regressions += worse
+        print(f"  {name:<28} {old[name]:10.1f} -> {value:10.1f}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', default='default', help="name saved with the results")
+    parser.add_argument('--users', type=int, default=20, help="concurrent simulated users")
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=4, help="messages per conversation")
+    parser.add_argument('--stream', action='store_true', help="chat through /chat/stream")
+    parser.add_argument('--cache', action='store_true', help="leave the response cache on")
+    parser.add_argument('--latency', type=float, default=0.2, help="stub upstream latency in seconds")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="stub delay between streamed tokens")
+    parser.add_argument('--prompt-tokens', type=int, default=500)
+    parser.add_argument('--completion-tokens', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--db', choices=('sqlite', 'postgres', 'none'), default='sqlite')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="scratch database for --db postgres")
+    parser.add_argument('--flush-interval', type=float, default=0.5, help="INGEST_FLUSH_INTERVAL for the server")
+    parser.add_argument('--flush-timeout', type=float, default=30, help="how long to wait for session writes")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--output-dir', default=RESULTS_DIR)
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    if args.db == 'postgres' and not args.database_url:
+        parser.error('--db postgres needs --database-url or DATABASE_URL')
+
+    with tempfile.TemporaryDirectory() as scratch:
+        args.sqlite_url = sqlite_standin.SQLITE_PREFIX + os.path.join(scratch, 'sessions.db')
+        results = run(args)
+
+    print_results(results)
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{args.label}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"saved {path}")
+
+    if args.compare and compare(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Session table layout: 17 stored equivalency columns vs base measurements only.
+
+    python -m benchmarks.bench_compact --rows 200000
+    DATABASE_URL=postgresql://localhost/carbon_bench python -m benchmarks.bench_compact --rows 200000
+
+Without DATABASE_URL, reports COPY payload size and client-side row
+serialization rate. With it, also loads the rows into two scratch tables
+(dropped afterwards) and reports COPY throughput, WAL written, and table
+plus index size for each layout.
+"""
+import argparse
+import csv
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import db
+import impact
+
+# Migration 5's layout (later migrations add columns this comparison leaves out)
+COMPACT_COLUMNS = db.CARBON_TEST_COLUMNS[:10]
+# Migration 1's layout, before migration 5 dropped the derived columns
+WIDE_COLUMNS = COMPACT_COLUMNS[:7] + ['co2_kg'] + COMPACT_COLUMNS[7:] + impact.EPA_COLUMNS
+WIDE_TABLE = db.MIGRATIONS[0][2].replace('IF NOT EXISTS csci_8980_carbon_test', 'bench_wide_sessions')
+COMPACT_TABLE = """
+CREATE TABLE bench_compact_sessions (
+    id SERIAL PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL,
+    test_variant VARCHAR(10) NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    start_time TIMESTAMP,
+    end_time TIMESTAMP,
+    duration_minutes NUMERIC(6,2),
+    co2_grams NUMERIC(12,8) NOT NULL,
+    energy_kwh NUMERIC(12,10) NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    total_requests INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+INDEX = "CREATE INDEX ON {table} (created_at DESC, id DESC)"
+
+
+def synthetic_rows(count):
+    """(compact row, wide row) pairs shaped like logged sessions"""
+    now = datetime.now()
+    for i in range(count):
+        tokens = 500 + (i * 7919) % 20000
+        session = impact.estimate_impact('gpt-4o', tokens, 0)
+        co2, energy = round(session['co2_grams'], 8), round(session['energy_kwh'], 10)
+        start = (now - timedelta(minutes=i % 60)).isoformat()
+        compact = (f'bench-{i}', 'ABC'[i % 3], now.isoformat(), start, now.isoformat(), i % 60,
+                   co2, energy, tokens, 1 + i % 10)
+        equivalencies = impact.equivalencies(co2, energy)
+        wide = compact[:7] + (round(co2 / 1000, 10),) + compact[7:] + tuple(
+            round(equivalencies[column], 8) for column in impact.EPA_COLUMNS
+        )
+        yield compact, wide
+
+
+def copy_payload(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def load(database_url, table, columns, payload):
+    """COPY the payload into table, returning (seconds, WAL bytes, total relation bytes)"""
+    with db.get_postgres_connection(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_current_wal_lsn() AS lsn")
+            wal_start = cur.fetchone()['lsn']
+            start = time.perf_counter()
+            cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                            io.StringIO(payload))
+            conn.commit()
+            elapsed = time.perf_counter() - start
+            cur.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s) AS wal, "
+                        "pg_total_relation_size(%s) AS size", (wal_start, table))
+            stats = cur.fetchone()
+    return elapsed, int(stats['wal']), stats['size']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pairs = list(synthetic_rows(args.rows))
+    print(f"generated {args.rows} sessions in {time.perf_counter() - start:.1f}s")
+
+    layouts = [
+        ('wide', 'bench_wide_sessions', WIDE_TABLE, WIDE_COLUMNS, [wide for _, wide in pairs]),
+        ('compact', 'bench_compact_sessions', COMPACT_TABLE, COMPACT_COLUMNS,
+         [compact for compact, _ in pairs]),
+    ]
+    payloads = {}
+    for name, _, _, _, rows in layouts:
+        start = time.perf_counter()
+        payloads[name] = copy_payload(rows)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<8} COPY payload {len(payloads[name]) / args.rows:6.0f} B/row   "
+              f"serialize {args.rows / elapsed:10,.0f} rows/s")
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        return
+
+    try:
+        for name, table, ddl, columns, _ in layouts:
+            with db.get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(ddl)
+                    cur.execute(INDEX.format(table=table))
+                conn.commit()
+            elapsed, wal, size = load(database_url, table, columns, payloads[name])
+            print(f"{name:<8} COPY {args.rows / elapsed:10,.0f} rows/s   WAL {wal / args.rows:6.0f} B/row   "
+                  f"table+index {size / 1024 / 1024:7.1f} MiB ({size / args.rows:.0f} B/row)")
+    finally:
+        with db.get_postgres_connection(database_url) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS bench_wide_sessions, bench_compact_sessions")
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Inserts per second through db.py: pooled connections vs psycopg2.connect per call.
+
+    DATABASE_URL=postgresql://localhost/carbon_bench python -m benchmarks.bench_db_pool --rows 2000
+
+Point DATABASE_URL at a scratch local database: the benchmark writes rows to
+csci_8980_carbon_test and deletes them afterwards.
+"""
+import argparse
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extras
+
+import db
+
+BENCH_VARIANT = 'BENCH'
+
+
+def sample_session():
+    return {
+        'session_id': str(uuid.uuid4()),
+        'test_variant': BENCH_VARIANT,
+        'timestamp': '2025-01-01T00:00:00',
+        'start_time': '2025-01-01T00:00:00',
+        'end_time': '2025-01-01T00:05:00',
+        'duration_minutes': 5,
+        'environmental_impact': {'co2_grams': 0.37, 'co2_kg': 0.00037, 'energy_kwh': 0.00074,
+                                 'total_tokens': 250, 'total_requests': 1},
+        'epa_equivalencies': {},
+    }
+
+
+@contextmanager
+def unpooled_connection(database_url):
+    """The pre-pool behaviour: a new connection (TCP + auth handshake) per call."""
+    conn = psycopg2.connect(database_url, cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def time_inserts(database_url, rows):
+    start = time.perf_counter()
+    for _ in range(rows):
+        db.insert_carbon_test_session(sample_session(), database_url)
+    return rows / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    database_url = os.environ['DATABASE_URL']
+    db.init_db(database_url)
+
+    pooled_connection = db.get_postgres_connection
+    db.get_postgres_connection = unpooled_connection
+    try:
+        unpooled = time_inserts(database_url, args.rows)
+    finally:
+        db.get_postgres_connection = pooled_connection
+    pooled = time_inserts(database_url, args.rows)
+
+    print(f"unpooled  {unpooled:10.1f} inserts/s")
+    print(f"pooled    {pooled:10.1f} inserts/s   ({pooled / unpooled:.1f}x)")
+
+    with db.get_postgres_connection(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM csci_8980_carbon_test WHERE test_variant = %s", (BENCH_VARIANT,))
+        conn.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Recomputing impacts and EPA equivalencies: per-row scalar calls vs NumPy arrays.
+
+    python -m benchmarks.bench_impact --rows 1000000
+
+No database needed; token counts are synthetic.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import impact
+
+
+def scalar(tokens):
+    out = []
+    for total in tokens.tolist():
+        session = impact.estimate_impact('gpt-4o', total, 0)
+        out.append(impact.equivalencies(session['co2_grams'], session['energy_kwh']))
+    return out
+
+
+def vectorized(tokens):
+    impacts = impact.estimate_impacts(tokens, 0)
+    return impact.epa_equivalencies(impacts['co2_grams'], impacts['energy_kwh'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    tokens = np.random.default_rng(0).integers(0, 20000, args.rows)
+    for name, fn in [('scalar', scalar), ('vectorized', vectorized)]:
+        start = time.perf_counter()
+        fn(tokens)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<11} {elapsed * 1000:9.1f} ms  {args.rows / elapsed:13,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
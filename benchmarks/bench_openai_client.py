@@ -0,0 +1,76 @@
+"""Compare per-turn latency of a pooled client against per-request construction.
+
+    python -m benchmarks.bench_openai_client --turns 200 --latency 0.01
+
+The old `/chat` path built a new AzureOpenAI client (and connection pool) on
+every turn. This runs the same completion call against a local stub endpoint
+both ways and reports latency and the number of TCP connections opened.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from openai import AzureOpenAI
+
+from benchmarks.stub_openai import start_stub_server, stub_endpoint
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "What's the best type of yarn to use to crochet a sweater?"},
+]
+
+
+def run_turns(get_client, turns):
+    """Time `turns` completion calls, fetching the client through `get_client`."""
+    latencies = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        client = get_client()
+        client.chat.completions.create(messages=MESSAGES, max_completion_tokens=3000, model="o4-mini")
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(label, latencies, connections):
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label:<24} mean {statistics.mean(latencies):7.2f} ms   "
+          f"p50 {statistics.median(latencies):7.2f} ms   p95 {p95:7.2f} ms   "
+          f"connections {connections}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help="stub upstream latency in seconds")
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    endpoint = stub_endpoint(server)
+    os.environ['AZURE_OPENAI_ENDPOINT'] = endpoint
+    os.environ.setdefault('OPENAI_API_KEY', 'stub-key')
+
+    # Imported after the environment points at the stub
+    import token_manager
+
+    def per_request_client():
+        return AzureOpenAI(api_version=token_manager.API_VERSION, azure_endpoint=endpoint,
+                           api_key='stub-key')
+
+    run_turns(per_request_client, 5)
+    server.connections_opened = 0
+    per_request = run_turns(per_request_client, args.turns)
+    summarize("per-request client", per_request, server.connections_opened)
+
+    run_turns(token_manager.get_openai_client, 5)
+    server.connections_opened = 0
+    pooled = run_turns(token_manager.get_openai_client, args.turns)
+    summarize("pooled client", pooled, server.connections_opened)
+
+    token_manager.close_openai_client()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
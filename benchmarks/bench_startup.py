@@ -0,0 +1,128 @@
+"""Import time, worker boot and first-request latency of server.py.
+
+    python -m benchmarks.bench_startup --workers 4 --runs 5
+
+Measures `import server` and `import server; server.startup()` in fresh
+interpreters, then starts gunicorn two ways against the stub upstream:
+
+    lazy     gunicorn server:app            every worker runs startup() on its first request
+    preload  gunicorn (gunicorn.conf.py)    the master runs startup() once before forking
+
+and reports the time from launch to the first response, the latency of the
+first and following /chat requests, and the combined proportional set size
+(PSS, Linux only) of the master and workers once every worker has served
+traffic, which shows how much of the preloaded state the workers share.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.load_test import ROOT, free_port
+from benchmarks.stub_openai import start_stub_server, stub_endpoint
+
+IMPORTS = {
+    'import server': 'import server',
+    'import + startup()': 'import server; server.startup()',
+}
+
+
+def import_seconds(statement, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', statement], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def first_response(base_url, started, timeout=60):
+    """Seconds from launch until the server answers"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/test_info", timeout=timeout)
+            return time.perf_counter() - started
+        except httpx.TransportError:
+            time.sleep(0.01)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+def chat_seconds(base_url):
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        start = time.perf_counter()
+        client.post('/chat', json={'message': 'Plan a weekend in New York.'}).raise_for_status()
+        return time.perf_counter() - start
+
+
+def process_tree_pss_kb(pid):
+    """PSS of a process and its children in kB, or None where /proc doesn't report it"""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+        total = 0
+        for each in pids:
+            with open(f"/proc/{each}/smaps_rollup") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        return total
+    except (OSError, StopIteration):
+        return None
+
+
+def run_server(command, env, args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(command + ['-b', f'127.0.0.1:{port}', '-w', str(args.workers)], cwd=ROOT,
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = first_response(base_url, started)
+        first_chat = chat_seconds(base_url)
+        # Enough requests that every worker (most likely) has served one and run startup()
+        later_chats = [chat_seconds(base_url) for _ in range(args.workers * 4)]
+        pss = process_tree_pss_kb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+    return ready, first_chat, statistics.median(later_chats), pss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05, help="stub upstream latency in seconds")
+    args = parser.parse_args()
+
+    stub = start_stub_server(latency=args.latency)
+    env = dict(os.environ, AZURE_OPENAI_ENDPOINT=stub_endpoint(stub), OPENAI_API_KEY='stub-key',
+               FLASK_KEY='bench', RESPONSE_CACHE_ENABLED='false', RUN_MIGRATIONS_ON_STARTUP='false',
+               LOG_LEVEL='WARNING')
+    env.pop('DATABASE_URL', None)
+
+    for label, statement in IMPORTS.items():
+        seconds = [import_seconds(statement, env) for _ in range(args.runs)]
+        print(f"{label:<20} median {statistics.median(seconds) * 1000:7.0f} ms (interpreter included)")
+
+    with tempfile.NamedTemporaryFile('w', suffix='.py') as no_config:
+        servers = {
+            'lazy': ['gunicorn', '-c', no_config.name, 'server:app'],
+            'preload': ['gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py')],
+        }
+        for label, command in servers.items():
+            results = [run_server(command, env, args) for _ in range(args.runs)]
+            ready, first_chat, later_chat, pss = (statistics.median(values) if None not in values else None
+                                                  for values in zip(*results))
+            memory = f"{pss / 1024:6.0f} MB" if pss is not None else 'n/a'
+            print(f"{label:<8} {args.workers} workers: first response {ready * 1000:6.0f} ms   "
+                  f"first /chat {first_chat * 1000:6.0f} ms   later /chat {later_chat * 1000:5.0f} ms   "
+                  f"PSS {memory}")
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
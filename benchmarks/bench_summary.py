@@ -0,0 +1,105 @@
+"""Per-variant summary, A/B statistics and recent-rows reads at 1M rows: full scan vs indexes and rollup.
+
+    DATABASE_URL=postgresql://localhost/carbon_bench python -m benchmarks.bench_summary --rows 1000000
+
+Use a scratch database: the benchmark bulk-loads synthetic sessions into
+csci_8980_carbon_test (test_variant A/B/C, session_id prefixed 'bench-')
+and deletes them afterwards. The inserts also exercise the rollup and A/B
+statistics triggers.
+"""
+import argparse
+import os
+import time
+
+import db
+from ab_stats import VariantStats
+
+# The pre-rollup summary: a full GROUP BY over every session row
+FULL_SCAN_SUMMARY = """
+    SELECT test_variant, COUNT(*), AVG(co2_grams), SUM(co2_grams), AVG(energy_kwh), SUM(energy_kwh),
+           AVG(total_tokens), SUM(total_tokens), AVG(duration_minutes)
+    FROM csci_8980_carbon_test GROUP BY test_variant ORDER BY test_variant
+"""
+
+LATEST_ROWS = "SELECT * FROM csci_8980_carbon_test ORDER BY created_at DESC LIMIT 100"
+
+SYNTHETIC_ROWS = """
+    INSERT INTO csci_8980_carbon_test (
+        session_id, test_variant, timestamp, start_time, end_time, duration_minutes,
+        co2_grams, energy_kwh, total_tokens, total_requests, created_at
+    )
+    SELECT 'bench-' || g, (ARRAY['A', 'B', 'C'])[1 + g %% 3], now(), now(), now(), random() * 30,
+           c, c * 0.002, (c / 1.47 * 1000)::int, 1 + g %% 10,
+           now() - g * INTERVAL '1 second'
+    FROM (SELECT g, random() * 5 AS c FROM generate_series(1, %s) g) s
+"""
+
+
+def timed(database_url, sql, repeat=5):
+    """Best-of-N wall time in milliseconds"""
+    best = float('inf')
+    with db.get_postgres_connection(database_url) as conn:
+        with conn.cursor() as cur:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cur.execute(sql)
+                cur.fetchall()
+                best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def timed_call(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def rescan_report(database_url):
+    """The A/B report computed by streaming every session row"""
+    stats = VariantStats()
+    for rows in db.iter_carbon_test_rows(database_url, batch_size=10000):
+        stats.add_rows(rows)
+    return stats.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    database_url = os.environ['DATABASE_URL']
+    db.init_db(database_url)
+
+    start = time.perf_counter()
+    with db.get_postgres_connection(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute(SYNTHETIC_ROWS, (args.rows,))
+            cur.execute("ANALYZE csci_8980_carbon_test")
+        conn.commit()
+    print(f"loaded {args.rows} rows (with rollup and A/B statistics triggers) "
+          f"in {time.perf_counter() - start:.1f} s")
+
+    try:
+        print(f"summary, full GROUP BY        {timed(database_url, FULL_SCAN_SUMMARY):10.2f} ms")
+        print(f"summary, rollup               "
+              f"{timed_call(lambda: db.get_carbon_test_summary(database_url)):10.2f} ms")
+        print(f"A/B report, streaming rescan  "
+              f"{timed_call(lambda: rescan_report(database_url), repeat=1):10.2f} ms")
+        print(f"A/B report, running state     "
+              f"{timed_call(lambda: VariantStats.from_states(db.get_ab_stats(database_url)).report()):10.2f} ms")
+        print(f"latest 100 rows, seq scan+sort "
+              f"{timed(database_url, 'SET LOCAL enable_indexscan = off; ' + LATEST_ROWS):9.2f} ms")
+        print(f"latest 100 rows, index         "
+              f"{timed_call(lambda: db.get_carbon_test_data(database_url, limit=100)):9.2f} ms")
+    finally:
+        with db.get_postgres_connection(database_url) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM csci_8980_carbon_test WHERE session_id LIKE %s", ('bench-%',))
+            conn.commit()
+
+
+if __name__ == '__main__':
+    main()
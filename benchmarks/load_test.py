@@ -0,0 +1,99 @@
+"""Concurrent chats per process: Flask sync worker vs the ASGI app.
+
+    python -m benchmarks.load_test --users 200 --latency 1.0
+
+Starts a stub upstream with fixed latency, then serves the app from one
+process each way (gunicorn with a single sync worker, uvicorn with
+asgi:app) and has every simulated user send one /chat at the same time.
+The stub records how many completion calls were in flight at once, which
+is the number of conversations a single process could hold.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.stub_openai import start_stub_server, stub_endpoint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'flask (gunicorn sync)': ['gunicorn', '-w', '1', '-b', '127.0.0.1:{port}', 'server:app'],
+    'asgi (uvicorn)': [sys.executable, '-m', 'uvicorn', '--port', '{port}', '--log-level', 'warning', 'asgi:app'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/test_info", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+async def one_user(base_url, user, timeout):
+    # Separate clients so every user gets their own session cookie; distinct
+    # prompts so no chat is answered from the response cache
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        start = time.perf_counter()
+        response = await client.post('/chat', json={'message': f"Plan a weekend in New York for traveler {user}."})
+        return response.status_code, time.perf_counter() - start
+
+
+async def run_users(base_url, users, timeout):
+    return await asyncio.gather(*(one_user(base_url, user, timeout) for user in range(users)),
+                                return_exceptions=True)
+
+
+def run(label, command, stub, args):
+    port = free_port()
+    env = dict(os.environ, AZURE_OPENAI_ENDPOINT=stub_endpoint(stub),
+               OPENAI_API_KEY='stub-key', FLASK_KEY='load-test', RESPONSE_CACHE_ENABLED='false')
+    process = subprocess.Popen([part.format(port=port) for part in command], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url)
+        stub.max_in_flight = 0
+
+        start = time.perf_counter()
+        results = asyncio.run(run_users(base_url, args.users, args.timeout))
+        elapsed = time.perf_counter() - start
+
+        ok = [r for r in results if not isinstance(r, Exception) and r[0] == 200]
+        print(f"{label:<24} ok {len(ok):>4}/{args.users}   wall {elapsed:6.2f} s   "
+              f"chats/s {len(ok) / elapsed:7.1f}   peak in-flight {stub.max_in_flight}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=1.0, help="stub upstream latency in seconds")
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    stub = start_stub_server(latency=args.latency)
+    for label, command in SERVERS.items():
+        run(label, command, stub, args)
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
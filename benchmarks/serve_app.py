@@ -0,0 +1,23 @@
+"""server.app for benchmark runs: gunicorn benchmarks.serve_app:app
+
+With BENCH_SQLITE_URL=sqlite:///path set, ended sessions are written to
+the SQLite stand-in instead of Postgres (DATABASE_URL should be unset),
+spooling beside the SQLite file so a spool left in the working directory
+is not replayed into the run.
+"""
+import atexit
+import os
+
+import server
+from benchmarks import sqlite_standin
+from ingest import SessionIngestQueue
+
+BENCH_SQLITE_URL = os.getenv('BENCH_SQLITE_URL')
+
+if BENCH_SQLITE_URL:
+    sqlite_standin.create_table(BENCH_SQLITE_URL)
+    spool_path = sqlite_standin.sqlite_path(BENCH_SQLITE_URL) + '.spool'
+    server.ingest_queue = SessionIngestQueue(BENCH_SQLITE_URL, spool_path, writer=sqlite_standin.insert_sessions)
+    atexit.register(server.ingest_queue.close)
+
+app = server.create_app()
@@ -0,0 +1,34 @@
+"""SQLite stand-in for the Postgres session table, for benchmarking without a database server."""
+import sqlite3
+
+from db import CARBON_TEST_COLUMNS, carbon_test_row
+
+SQLITE_PREFIX = 'sqlite:///'
+
+
+def sqlite_path(database_url):
+    return database_url[len(SQLITE_PREFIX):]
+
+
+def create_table(database_url):
+    with sqlite3.connect(sqlite_path(database_url)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS csci_8980_carbon_test "
+            f"(id INTEGER PRIMARY KEY, {', '.join(CARBON_TEST_COLUMNS)})"
+        )
+
+
+def insert_sessions(records, database_url):
+    """Drop-in for db.insert_carbon_test_sessions: one transaction per batch"""
+    with sqlite3.connect(sqlite_path(database_url), timeout=30) as conn:
+        conn.executemany(
+            f"INSERT INTO csci_8980_carbon_test ({', '.join(CARBON_TEST_COLUMNS)}) "
+            f"VALUES ({', '.join(['?'] * len(CARBON_TEST_COLUMNS))})",
+            [carbon_test_row(record) for record in records]
+        )
+
+
+def count_sessions(database_url):
+    with sqlite3.connect(sqlite_path(database_url), timeout=30) as conn:
+        return conn.execute("SELECT COUNT(*) FROM csci_8980_carbon_test").fetchone()[0]
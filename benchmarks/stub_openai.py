@@ -0,0 +1,117 @@
+"""Local stand-in for the Azure OpenAI chat completions endpoint."""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a canned chat completion."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections_opened += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request_body = json.loads(self.rfile.read(length) or b'{}')
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        try:
+            time.sleep(self.server.latency)
+            if request_body.get('stream'):
+                self.send_stream()
+            else:
+                self.send_completion()
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def send_completion(self):
+        body = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'o4-mini',
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': self.server.reply},
+            }],
+            'usage': {
+                'prompt_tokens': self.server.prompt_tokens,
+                'completion_tokens': self.server.completion_tokens,
+                'total_tokens': self.server.prompt_tokens + self.server.completion_tokens,
+            },
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def send_stream(self):
+        """Send the reply as chat.completion.chunk SSE events, usage last."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        base = {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk',
+                'created': int(time.time()), 'model': 'o4-mini'}
+        words = self.server.reply.split(' ')
+        for i, word in enumerate(words):
+            token = word if i == 0 else ' ' + word
+            chunk = dict(base, choices=[{'index': 0, 'finish_reason': None,
+                                         'delta': {'role': 'assistant', 'content': token}}])
+            self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.server.token_delay)
+
+        usage = dict(base, choices=[], usage={
+            'prompt_tokens': self.server.prompt_tokens,
+            'completion_tokens': self.server.completion_tokens,
+            'total_tokens': self.server.prompt_tokens + self.server.completion_tokens,
+        })
+        self.send_chunk(f"data: {json.dumps(usage)}\n\n".encode())
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+
+def start_stub_server(latency=0.0, prompt_tokens=50, completion_tokens=200,
+                      reply="This is a stubbed assistant reply.", token_delay=0.0):
+    """Start the stub server on a free local port in a background thread."""
+    server = StubOpenAIServer(('127.0.0.1', 0), StubOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.prompt_tokens = prompt_tokens
+    server.completion_tokens = completion_tokens
+    server.reply = reply
+    server.token_delay = token_delay
+    server.connections_opened = 0
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_endpoint(server):
+    """Base URL to use as the Azure endpoint for a running stub server."""
+    host, port = server.server_address
+    return f"http://{host}:{port}/"
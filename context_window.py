@@ -0,0 +1,122 @@
+# context_window.py - Keep the prompt sent to the model within a token budget
+import os
+
+from structured_log import get_logger
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+# Prompt budget (system prompt + kept history + new user message)
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '6000'))
+# Roll dropped turns into a short summary instead of discarding them
+PROMPT_SUMMARY_ENABLED = os.getenv('PROMPT_SUMMARY_ENABLED', 'false').lower() == 'true'
+SUMMARY_TOKEN_BUDGET = int(os.getenv('SUMMARY_TOKEN_BUDGET', '300'))
+SUMMARY_SNIPPET_CHARS = 160
+
+log = get_logger('context_window')
+
+# Chat format overhead per message and for priming the reply (OpenAI cookbook figures)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Load the o200k encoding used by o4-mini, or None if it is unavailable"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding('o200k_base')
+            except Exception as e:  # tiktoken downloads the encoding on first use
+                log.warning("Token encoding unavailable, estimating token counts: %s", e)
+    return _encoding
+
+
+def count_tokens(text):
+    """Count tokens in text, estimating ~4 characters per token without tiktoken"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    """Token count for one message, cached on the message so it is only computed once"""
+    if 'tokens' not in message:
+        message['tokens'] = count_tokens(message['content']) + TOKENS_PER_MESSAGE
+    return message['tokens']
+
+
+def summarize_turns(messages):
+    """Compact extractive summary of dropped turns, newest kept first when over budget"""
+    lines = []
+    used = 0
+    for message in reversed(messages):
+        snippet = ' '.join(message['content'].split())[:SUMMARY_SNIPPET_CHARS]
+        line = f"- {message['role']}: {snippet}"
+        line_tokens = count_tokens(line)
+        if used + line_tokens > SUMMARY_TOKEN_BUDGET:
+            break
+        lines.append(line)
+        used += line_tokens
+    if not lines:
+        return None
+    return "Summary of earlier conversation:\n" + '\n'.join(reversed(lines))
+
+
+def build_prompt(conversation, budget=PROMPT_TOKEN_BUDGET):
+    """Messages to send for the next completion, trimmed to the token budget.
+
+    Keeps the system prompt and the most recent messages (the newest user
+    message is always sent). Older messages are dropped, or summarized when
+    PROMPT_SUMMARY_ENABLED is set. Tokens saved are added to the
+    conversation's cumulative_impacts['prompt_tokens_saved'].
+    """
+    messages = conversation['messages']
+    system, history = messages[0], messages[1:]
+
+    full_tokens = TOKENS_PER_REPLY + sum(message_tokens(m) for m in messages)
+    used = TOKENS_PER_REPLY + message_tokens(system)
+    if PROMPT_SUMMARY_ENABLED:
+        budget -= SUMMARY_TOKEN_BUDGET
+
+    # Walk back from the newest message until the budget is spent
+    keep_from = len(history)
+    while keep_from > 0:
+        cost = message_tokens(history[keep_from - 1])
+        if used + cost > budget and keep_from < len(history):
+            break
+        used += cost
+        keep_from -= 1
+
+    # Never start the kept history on an assistant reply
+    while keep_from < len(history) - 1 and history[keep_from]['role'] == 'assistant':
+        used -= message_tokens(history[keep_from])
+        keep_from += 1
+
+    prompt = [{'role': system['role'], 'content': system['content']}]
+    dropped = history[:keep_from]
+    if dropped and PROMPT_SUMMARY_ENABLED:
+        summary = conversation.get('summary')
+        if not summary or summary['through'] != keep_from:
+            text = summarize_turns(dropped)
+            summary = {'through': keep_from, 'text': text,
+                       'tokens': count_tokens(text) + TOKENS_PER_MESSAGE if text else 0}
+            conversation['summary'] = summary
+        if summary['text']:
+            prompt.append({'role': 'system', 'content': summary['text']})
+            used += summary['tokens']
+
+    prompt.extend({'role': m['role'], 'content': m['content']} for m in history[keep_from:])
+
+    impacts = conversation['cumulative_impacts']
+    impacts['prompt_tokens_saved'] = impacts.get('prompt_tokens_saved', 0) + max(0, full_tokens - used)
+    # Estimated size of this prompt, charged against the rate limit before sending
+    conversation['prompt_tokens'] = used
+    return prompt
@@ -0,0 +1,244 @@
+# conversation_store.py - Server-side conversation state keyed by session_id
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import (delete_conversation, load_conversation, pop_conversation, pop_idle_conversation,
+                purge_expired_conversations, replace_conversation, save_conversation)
+
+# Store configuration
+CONVERSATION_STORE = os.getenv('CONVERSATION_STORE', 'memory')  # 'memory' or 'postgres'
+CONVERSATION_TTL_SECONDS = int(os.getenv('CONVERSATION_TTL_SECONDS', str(6 * 60 * 60)))
+CONVERSATION_STORE_MAX_ENTRIES = int(os.getenv('CONVERSATION_STORE_MAX_ENTRIES', '10000'))
+CONVERSATION_STORE_MAX_BYTES = int(os.getenv('CONVERSATION_STORE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# The Postgres store deletes expired rows once every this many writes
+PURGE_EVERY_WRITES = 1000
+
+
+class MemoryStore:
+    """In-process LRU store with TTL expiry and a cap on total serialized bytes.
+
+    Values are kept as serialized JSON, so the byte cap measures what is
+    actually held and callers never share mutable state with the store.
+    Entries also carry the version given to replace() (0 for put()).
+    Entries dropped by expiry or the caps are passed, as (key, value) pairs,
+    to on_evict when it is set, after the store's lock is released.
+    """
+
+    def __init__(self, max_entries=CONVERSATION_STORE_MAX_ENTRIES,
+                 max_bytes=CONVERSATION_STORE_MAX_BYTES, ttl_seconds=CONVERSATION_TTL_SECONDS, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._entries = OrderedDict()  # key -> (expires_at, payload, version)
+        self._evicted = []  # (key, payload) awaiting on_evict
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'writes': 0,
+            'evictions_ttl': 0,
+            'evictions_lru': 0,
+            'evictions_bytes': 0,
+        }
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            expires_at, payload, _ = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return json.loads(payload)
+            self._drop(key, 'evictions_ttl')
+            self._counters['misses'] += 1
+        self._notify()
+        return None
+
+    def put(self, key, value):
+        payload = json.dumps(value, separators=(',', ':')).encode()
+        with self._lock:
+            self._write(key, payload, 0)
+        self._notify()
+
+    def replace(self, key, value, version):
+        """put() a conversation only if the stored one is still at `version`.
+
+        version None means only if nothing live is stored. value['version']
+        is the version stored with it. Returns whether it was written.
+        """
+        payload = json.dumps(value, separators=(',', ':')).encode()
+        with self._lock:
+            entry = self._entries.get(key)
+            stored = entry[2] if entry is not None and entry[0] > time.monotonic() else None
+            if stored != version:
+                return False
+            self._write(key, payload, value['version'])
+        self._notify()
+        return True
+
+    def _write(self, key, payload, version):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._drop(key, 'evictions_ttl')
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, payload, version)
+        self._bytes += len(payload)
+        self._counters['writes'] += 1
+        self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def pop(self, key):
+        """Remove and return a value, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload, _ = entry
+            if expires_at > time.monotonic():
+                self._remove(key)
+                return json.loads(payload)
+            self._drop(key, 'evictions_ttl')
+        self._notify()
+        return None
+
+    def pop_idle(self, key, idle_seconds):
+        """Remove and return a value not written for idle_seconds.
+
+        Returns (value, None) when claimed, (None, seconds until it is idle)
+        when it was written since, and (None, None) when it is gone.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            expires_at, payload, _ = entry
+            idle_in = expires_at - self.ttl_seconds + idle_seconds - time.monotonic()
+            if idle_in > 0:
+                return None, idle_in
+            self._remove(key)
+        return json.loads(payload), None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def _drop(self, key, counter):
+        """Evict an entry, keeping it for on_evict"""
+        if self.on_evict is not None:
+            self._evicted.append((key, self._entries[key][1]))
+        self._remove(key)
+        self._counters[counter] += 1
+
+    def _notify(self):
+        if self.on_evict is None:
+            return
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        if evicted:
+            self.on_evict([(key, json.loads(payload)) for key, payload in evicted])
+
+    def _evict(self):
+        """Drop expired entries from the cold end, then LRU entries until under both caps."""
+        now = time.monotonic()
+        while self._entries:
+            key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at <= now:
+                self._drop(key, 'evictions_ttl')
+            elif len(self._entries) > self.max_entries:
+                self._drop(key, 'evictions_lru')
+            elif self._bytes > self.max_bytes:
+                self._drop(key, 'evictions_bytes')
+            else:
+                break
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                **self._counters,
+            }
+
+
+class PostgresConversationStore:
+    """Conversation store shared by all workers, kept in Postgres via db.py.
+
+    Expired rows are deleted by a purge every PURGE_EVERY_WRITES writes, or
+    when a new conversation takes their session_id; they go to on_evict.
+    """
+
+    def __init__(self, database_url, ttl_seconds=CONVERSATION_TTL_SECONDS, on_evict=None):
+        self.database_url = database_url
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions_ttl': 0}
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+            return self._counters[counter]
+
+    def get(self, session_id):
+        conversation = load_conversation(session_id, self.ttl_seconds, self.database_url)
+        self._count('hits' if conversation is not None else 'misses')
+        return conversation
+
+    def put(self, session_id, conversation):
+        save_conversation(session_id, conversation, self.database_url)
+        if self._count('writes') % PURGE_EVERY_WRITES == 0:
+            self._purge()
+
+    def replace(self, session_id, conversation, version):
+        if version is None:
+            self._purge(session_id)
+        written = replace_conversation(session_id, conversation, version, self.ttl_seconds, self.database_url)
+        if written and self._count('writes') % PURGE_EVERY_WRITES == 0:
+            self._purge()
+        return written
+
+    def _purge(self, session_id=None):
+        purged = purge_expired_conversations(self.ttl_seconds, self.database_url, session_id)
+        with self._lock:
+            self._counters['evictions_ttl'] += len(purged)
+        if purged and self.on_evict is not None:
+            self.on_evict(purged)
+
+    def delete(self, session_id):
+        delete_conversation(session_id, self.database_url)
+
+    def pop(self, session_id):
+        return pop_conversation(session_id, self.ttl_seconds, self.database_url)
+
+    def pop_idle(self, session_id, idle_seconds):
+        return pop_idle_conversation(session_id, idle_seconds, self.database_url)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'postgres', 'ttl_seconds': self.ttl_seconds, **self._counters}
+
+
+def create_conversation_store(database_url=None):
+    """Build the store selected by CONVERSATION_STORE"""
+    if CONVERSATION_STORE == 'postgres':
+        if not database_url:
+            raise ValueError("CONVERSATION_STORE=postgres requires DATABASE_URL")
+        return PostgresConversationStore(database_url)
+    return MemoryStore()
@@ -1,10 +1,106 @@
 import psycopg2
 import psycopg2.extras
-from typing import Dict, Any
+import psycopg2.pool
+from contextlib import contextmanager
+from typing import Dict, Any, List
+import atexit
+import csv
+import io
 import os
+import threading
+import time
 
-# PostgreSQL Schema
-POSTGRES_SCHEMA = """
+import impact
+import metrics
+from structured_log import get_logger
+
+log = get_logger('db')
+
+# Adds (sign '') or subtracts (sign '-') a set of session rows to the per-variant
+# rollup: counts, sums and sums of squares for co2, energy, tokens and duration.
+# Variants are upserted in a fixed order so concurrent statements lock the
+# rollup rows in the same order and cannot deadlock (as in AB_STATS_MERGE)
+ROLLUP_UPSERT = """
+INSERT INTO csci_8980_carbon_variant_rollup AS r (
+    test_variant, session_count, co2_sum, co2_sumsq, energy_sum, energy_sumsq,
+    tokens_sum, tokens_sumsq, duration_count, duration_sum, duration_sumsq
+)
+SELECT test_variant, {sign}COUNT(*),
+    {sign}COALESCE(SUM(co2_grams), 0), {sign}COALESCE(SUM(co2_grams::float8 ^ 2), 0),
+    {sign}COALESCE(SUM(energy_kwh), 0), {sign}COALESCE(SUM(energy_kwh::float8 ^ 2), 0),
+    {sign}COALESCE(SUM(total_tokens), 0), {sign}COALESCE(SUM(total_tokens::float8 ^ 2), 0),
+    {sign}COUNT(duration_minutes),
+    {sign}COALESCE(SUM(duration_minutes), 0), {sign}COALESCE(SUM(duration_minutes::float8 ^ 2), 0)
+FROM {source} GROUP BY test_variant
+ORDER BY test_variant
+ON CONFLICT (test_variant) DO UPDATE SET
+    session_count = r.session_count + EXCLUDED.session_count,
+    co2_sum = r.co2_sum + EXCLUDED.co2_sum,
+    co2_sumsq = r.co2_sumsq + EXCLUDED.co2_sumsq,
+    energy_sum = r.energy_sum + EXCLUDED.energy_sum,
+    energy_sumsq = r.energy_sumsq + EXCLUDED.energy_sumsq,
+    tokens_sum = r.tokens_sum + EXCLUDED.tokens_sum,
+    tokens_sumsq = r.tokens_sumsq + EXCLUDED.tokens_sumsq,
+    duration_count = r.duration_count + EXCLUDED.duration_count,
+    duration_sum = r.duration_sum + EXCLUDED.duration_sum,
+    duration_sumsq = r.duration_sumsq + EXCLUDED.duration_sumsq;
+"""
+
+# Statement-level trigger function keeping the rollup in step with csci_8980_carbon_test
+ROLLUP_APPLY_FUNCTION = """
+CREATE OR REPLACE FUNCTION csci_8980_carbon_rollup_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+""" + ROLLUP_UPSERT.format(sign='-', source='old_rows') + """
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+""" + ROLLUP_UPSERT.format(sign='', source='new_rows') + """
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# One batch of session rows as Welford states per (variant, metric): count,
+# mean and sum of squared deviations from the mean (ab_stats.METRICS)
+AB_STATS_BATCH = """
+SELECT test_variant, v.metric, COUNT(v.value) AS n, AVG(v.value) AS mean,
+    VAR_POP(v.value) * COUNT(v.value) AS m2
+FROM {source}, LATERAL (VALUES
+    ('co2_grams', co2_grams::float8), ('energy_kwh', energy_kwh::float8),
+    ('total_tokens', total_tokens::float8), ('total_requests', total_requests::float8),
+    ('duration_minutes', duration_minutes::float8)
+) AS v(metric, value)
+WHERE v.value IS NOT NULL
+GROUP BY test_variant, v.metric
+"""
+
+# Merges a set of session rows into csci_8980_ab_stats (Chan et al.'s parallel
+# update), in key order so concurrent writers lock rows in the same order
+AB_STATS_MERGE = """
+INSERT INTO csci_8980_ab_stats AS s (test_variant, metric, n, mean, m2)
+""" + AB_STATS_BATCH + """ORDER BY 1, 2
+ON CONFLICT (test_variant, metric) DO UPDATE SET
+    n = s.n + EXCLUDED.n,
+    mean = s.mean + (EXCLUDED.mean - s.mean) * EXCLUDED.n / (s.n + EXCLUDED.n),
+    m2 = s.m2 + EXCLUDED.m2 + (EXCLUDED.mean - s.mean) ^ 2 * s.n * EXCLUDED.n / (s.n + EXCLUDED.n);
+"""
+
+# Takes a set of session rows back out of csci_8980_ab_stats (the merge, inverted)
+AB_STATS_REMOVE = """
+UPDATE csci_8980_ab_stats s SET
+    n = s.n - o.n,
+    mean = CASE WHEN s.n > o.n THEN (s.mean * s.n - o.mean * o.n) / (s.n - o.n) ELSE 0 END,
+    m2 = CASE WHEN s.n > o.n
+        THEN GREATEST(s.m2 - o.m2 - (o.mean - s.mean) ^ 2 * s.n * o.n / (s.n - o.n), 0) ELSE 0 END
+FROM (""" + AB_STATS_BATCH + """) o
+WHERE s.test_variant = o.test_variant AND s.metric = o.metric;
+"""
+
+# Versioned schema migrations, applied in order by init_db(). Append new
+# migrations to the end; never edit one that has already shipped.
+MIGRATIONS = [
+    (1, 'create csci_8980_carbon_test', """
 CREATE TABLE IF NOT EXISTS csci_8980_carbon_test (
     id SERIAL PRIMARY KEY,
     session_id VARCHAR(255) NOT NULL,
@@ -37,123 +133,592 @@ CREATE TABLE IF NOT EXISTS csci_8980_carbon_test (
     water_heater_days NUMERIC(18,17),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
-"""
+"""),
+    # Tables created from the old schema.sql used UUID and NOT NULL columns the
+    # app leaves empty (no start time, zero-emission sessions); align them
+    (2, 'align csci_8980_carbon_test with the app', """
+ALTER TABLE csci_8980_carbon_test
+    ALTER COLUMN session_id TYPE VARCHAR(255) USING session_id::text,
+    ALTER COLUMN start_time DROP NOT NULL,
+    ALTER COLUMN end_time DROP NOT NULL,
+    ALTER COLUMN duration_minutes DROP NOT NULL,
+    ALTER COLUMN miles_driven DROP NOT NULL,
+    ALTER COLUMN gallons_gasoline DROP NOT NULL,
+    ALTER COLUMN gallons_diesel DROP NOT NULL,
+    ALTER COLUMN kwh_electricity DROP NOT NULL,
+    ALTER COLUMN therms_natural_gas DROP NOT NULL,
+    ALTER COLUMN led_bulb_hours DROP NOT NULL,
+    ALTER COLUMN pounds_coal DROP NOT NULL,
+    ALTER COLUMN barrels_oil DROP NOT NULL,
+    ALTER COLUMN tree_seedlings_10_years DROP NOT NULL,
+    ALTER COLUMN acres_forest_1_year DROP NOT NULL,
+    ALTER COLUMN smartphone_charges DROP NOT NULL,
+    ALTER COLUMN laptop_hours DROP NOT NULL,
+    ALTER COLUMN netflix_hours DROP NOT NULL,
+    ALTER COLUMN waste_recycling_tons DROP NOT NULL,
+    ALTER COLUMN bottles_recycled DROP NOT NULL,
+    ALTER COLUMN home_energy_days DROP NOT NULL,
+    ALTER COLUMN water_heater_days DROP NOT NULL;
+"""),
+    (3, 'create csci_8980_conversations', """
+CREATE TABLE IF NOT EXISTS csci_8980_conversations (
+    session_id VARCHAR(255) PRIMARY KEY,
+    data JSONB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS csci_8980_conversations_updated_at_idx
+    ON csci_8980_conversations (updated_at);
+"""),
+    # Per-variant rollup so summaries read O(variants) rows. Statement-level
+    # triggers fold each INSERT/UPDATE/DELETE (a whole COPY batch at once) in
+    # through transition tables.
+    (4, 'indexes and per-variant rollup', """
+LOCK TABLE csci_8980_carbon_test IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE INDEX IF NOT EXISTS csci_8980_carbon_test_created_at_id_idx
+    ON csci_8980_carbon_test (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS csci_8980_carbon_test_session_id_idx
+    ON csci_8980_carbon_test (session_id);
+
+CREATE TABLE IF NOT EXISTS csci_8980_carbon_variant_rollup (
+    test_variant VARCHAR(10) PRIMARY KEY,
+    session_count BIGINT NOT NULL DEFAULT 0,
+    co2_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    co2_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,
+    energy_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    energy_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,
+    tokens_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    tokens_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,
+    duration_count BIGINT NOT NULL DEFAULT 0,
+    duration_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    duration_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+
+""" + ROLLUP_APPLY_FUNCTION + """
+CREATE TRIGGER csci_8980_carbon_rollup_insert
+    AFTER INSERT ON csci_8980_carbon_test REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_carbon_rollup_apply();
+CREATE TRIGGER csci_8980_carbon_rollup_update
+    AFTER UPDATE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_carbon_rollup_apply();
+CREATE TRIGGER csci_8980_carbon_rollup_delete
+    AFTER DELETE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_carbon_rollup_apply();
+""" + ROLLUP_UPSERT.format(sign='', source='csci_8980_carbon_test')),
+    # Store only the base measurements; co2_kg and the EPA equivalencies are
+    # linear in co2_grams/energy_kwh and are derived by csci_8980_carbon_sessions.
+    # CLUSTER rewrites the table so the dropped columns' space is reclaimed.
+    (5, 'compact csci_8980_carbon_test', """
+LOCK TABLE csci_8980_carbon_test IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE csci_8980_carbon_test
+    DROP COLUMN co2_kg,
+    DROP COLUMN miles_driven,
+    DROP COLUMN gallons_gasoline,
+    DROP COLUMN gallons_diesel,
+    DROP COLUMN kwh_electricity,
+    DROP COLUMN therms_natural_gas,
+    DROP COLUMN led_bulb_hours,
+    DROP COLUMN pounds_coal,
+    DROP COLUMN barrels_oil,
+    DROP COLUMN tree_seedlings_10_years,
+    DROP COLUMN acres_forest_1_year,
+    DROP COLUMN smartphone_charges,
+    DROP COLUMN laptop_hours,
+    DROP COLUMN netflix_hours,
+    DROP COLUMN waste_recycling_tons,
+    DROP COLUMN bottles_recycled,
+    DROP COLUMN home_energy_days,
+    DROP COLUMN water_heater_days;
+
+CLUSTER csci_8980_carbon_test USING csci_8980_carbon_test_created_at_id_idx;
+ANALYZE csci_8980_carbon_test;
+"""),
+    # Running mean and variance per variant and metric for /ab_stats, kept
+    # current by statement triggers like the rollup, so confidence intervals
+    # and t-tests never rescan the sessions
+    (6, 'per-variant A/B statistics', """
+LOCK TABLE csci_8980_carbon_test IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS csci_8980_ab_stats (
+    test_variant VARCHAR(10) NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    n BIGINT NOT NULL DEFAULT 0,
+    mean DOUBLE PRECISION NOT NULL DEFAULT 0,
+    m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (test_variant, metric)
+);
+
+CREATE OR REPLACE FUNCTION csci_8980_ab_stats_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+""" + AB_STATS_REMOVE.format(source='old_rows') + """
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+""" + AB_STATS_MERGE.format(source='new_rows') + """
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER csci_8980_ab_stats_insert
+    AFTER INSERT ON csci_8980_carbon_test REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_ab_stats_apply();
+CREATE TRIGGER csci_8980_ab_stats_update
+    AFTER UPDATE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_ab_stats_apply();
+CREATE TRIGGER csci_8980_ab_stats_delete
+    AFTER DELETE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_ab_stats_apply();
+""" + AB_STATS_MERGE.format(source='csci_8980_carbon_test')),
+    # Per-turn impact events bulk-loaded from turn_log.py's segment files. The
+    # table is append-only and filled in time order, so a BRIN index on ts is
+    # enough for time-range scans. Segment names make each load happen once.
+    (7, 'create csci_8980_turn_events', """
+CREATE TABLE IF NOT EXISTS csci_8980_turn_events (
+    ts TIMESTAMPTZ NOT NULL,
+    session_id VARCHAR(255),
+    test_variant VARCHAR(10),
+    mode VARCHAR(16),
+    model VARCHAR(64),
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    total_tokens INTEGER,
+    energy_kwh DOUBLE PRECISION,
+    co2_grams DOUBLE PRECISION,
+    upstream_seconds DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS csci_8980_turn_events_ts_brin
+    ON csci_8980_turn_events USING BRIN (ts);
+
+CREATE TABLE IF NOT EXISTS csci_8980_turn_segments (
+    name VARCHAR(255) PRIMARY KEY,
+    row_count BIGINT NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+"""),
+    # What the response cache saved each session: replies served without an
+    # upstream call, and the tokens, CO2 and energy those calls would have cost.
+    # Constant defaults, so existing rows are not rewritten.
+    (8, 'cache savings on csci_8980_carbon_test', """
+ALTER TABLE csci_8980_carbon_test
+    ADD COLUMN IF NOT EXISTS cache_hits INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS avoided_tokens INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS avoided_co2_grams NUMERIC(12,8) NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS avoided_energy_kwh NUMERIC(12,10) NOT NULL DEFAULT 0;
+"""),
+    # Rebuild the rollup trigger function with its variants upserted in order
+    (9, 'ordered rollup upserts', ROLLUP_APPLY_FUNCTION),
+]
+
+# Key for the advisory lock that serializes migrations across workers
+MIGRATION_LOCK_ID = 8980
+
 
+# Connection pool settings (one pool per worker process)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Connections idle longer than this are checked with SELECT 1 before reuse
+DB_POOL_CHECK_AFTER_IDLE = float(os.getenv('DB_POOL_CHECK_AFTER_IDLE', '30'))
+# Connections older than this are closed and replaced
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))
 
+
+class PostgresPool:
+    """Thread-safe connection pool with health checks and connection recycling."""
+
+    def __init__(self, database_url: str, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            min_size, max_size, database_url, cursor_factory=psycopg2.extras.RealDictCursor
+        )
+        # ThreadedConnectionPool raises when exhausted; the semaphore makes callers wait instead
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._created = {}    # id(conn) -> creation time
+        self._last_used = {}  # id(conn) -> time returned to the pool
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise psycopg2.pool.PoolError(f"no database connection available after {DB_POOL_TIMEOUT}s")
+        try:
+            return self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkout(self):
+        while True:
+            conn = self._pool.getconn()
+            now = time.monotonic()
+            with self._lock:
+                created = self._created.setdefault(id(conn), now)
+                last_used = self._last_used.get(id(conn), now)
+
+            if conn.closed or now - created > DB_POOL_MAX_LIFETIME:
+                self._discard(conn)
+                continue
+            if now - last_used > DB_POOL_CHECK_AFTER_IDLE:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    conn.rollback()
+                except psycopg2.Error:
+                    self._discard(conn)
+                    continue
+            return conn
+
+    def putconn(self, conn, broken: bool = False):
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created.pop(id(conn), None)
+            self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def close(self):
+        self._pool.closeall()
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+# Pools inherited across a fork; kept referenced so their sockets (shared with the
+# parent) are never closed from the child
+_inherited_pools = []
+
+
+def get_pool(database_url: str) -> PostgresPool:
+    """Get this process's pool for database_url, creating it after startup or a fork"""
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _inherited_pools.extend(_pools.values())
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if database_url not in _pools:
+            _pools[database_url] = PostgresPool(database_url)
+        return _pools[database_url]
+
+
+def close_pools():
+    """Close this process's pools"""
+    with _pools_lock:
+        if _pools_pid == os.getpid():
+            for pool in _pools.values():
+                pool.close()
+        _pools.clear()
+
+
+atexit.register(close_pools)
+
+
+@contextmanager
 def get_postgres_connection(database_url: str):
-    """Get PostgreSQL connection"""
-    conn = psycopg2.connect(database_url, cursor_factory=psycopg2.extras.RealDictCursor)
-    return conn
+    """Borrow a pooled PostgreSQL connection for the duration of a with-block.
+
+    Uncommitted work is rolled back when the block exits, and connections
+    that fail with a connection-level error are dropped from the pool.
+    """
+    pool = get_pool(database_url)
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        pool.putconn(conn, broken=broken)
 
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='init_db')
 def init_db(database_url: str = None):
-    """Initialize database - PostgreSQL if URL provided"""
+    """Apply pending schema migrations - PostgreSQL if URL provided
+
+    Runs in one transaction under an advisory lock, so concurrently starting
+    workers wait for each other and each migration is applied exactly once.
+    """
     if database_url:
         # Use PostgreSQL
         try:
             with get_postgres_connection(database_url) as conn:
                 with conn.cursor() as cur:
-                    cur.execute(POSTGRES_SCHEMA)
+                    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+                    cur.execute(
+                        """CREATE TABLE IF NOT EXISTS schema_migrations (
+                            version INTEGER PRIMARY KEY,
+                            name VARCHAR(255) NOT NULL,
+                            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                        )"""
+                    )
+                    cur.execute("SELECT version FROM schema_migrations")
+                    applied = {row['version'] for row in cur.fetchall()}
+
+                    pending = [m for m in MIGRATIONS if m[0] not in applied]
+                    for version, name, sql in pending:
+                        cur.execute(sql)
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name)
+                        )
+                    # Not versioned: the view follows impact.py's current factors
+                    cur.execute(carbon_sessions_view_sql())
                 conn.commit()
-            print("PostgreSQL database initialized successfully")
+            if pending:
+                log.info("Applied database migrations: %s", ', '.join(str(m[0]) for m in pending))
         except Exception as e:
-            print(f"Error initializing PostgreSQL database: {e}")
+            log.error("Error migrating PostgreSQL database: %s", e)
             raise
 
 # Required fields for different tables
 
-def insert_carbon_test_session(data: Dict[str, Any], database_url: str = None):
-    """Insert carbon test session data - PostgreSQL if URL provided"""
-    
+# Equivalency columns derived by the csci_8980_carbon_sessions view
+EPA_EQUIVALENCY_COLUMNS = impact.EPA_COLUMNS
+# Columns written for each carbon test session, in insert order
+CARBON_TEST_COLUMNS = [
+    'session_id', 'test_variant', 'timestamp', 'start_time', 'end_time', 'duration_minutes',
+    'co2_grams', 'energy_kwh', 'total_tokens', 'total_requests',
+    'cache_hits', 'avoided_tokens', 'avoided_co2_grams', 'avoided_energy_kwh'
+]
+
+def carbon_sessions_view_sql() -> str:
+    """CREATE OR REPLACE VIEW csci_8980_carbon_sessions: session rows with co2_kg
+    and the EPA equivalencies computed from impact.EPA_FACTORS (NULL for
+    sessions without emissions, as they were logged before migration 5)"""
+    sources = {
+        'co2': 'co2_grams / {amount}',
+        'energy': 'CASE WHEN energy_kwh > 0 THEN energy_kwh / {amount} ELSE 0 END',
+    }
+    equivalencies = ',\n'.join(
+        f"    CASE WHEN co2_grams > 0 THEN {sources[basis].format(amount=amount)} END AS {column}"
+        for column, basis, amount in impact.EPA_FACTORS
+    )
+    # CREATE OR REPLACE VIEW can only add columns at the end
+    return f"""CREATE OR REPLACE VIEW csci_8980_carbon_sessions AS
+SELECT id, session_id, test_variant, timestamp, start_time, end_time, duration_minutes,
+    co2_grams, co2_grams / 1000 AS co2_kg, energy_kwh, total_tokens, total_requests,
+{equivalencies},
+    created_at, cache_hits, avoided_tokens, avoided_co2_grams, avoided_energy_kwh
+FROM csci_8980_carbon_test"""
+
+class InvalidSessionRecord(ValueError):
+    """A session record that can never become a csci_8980_carbon_test row"""
+
+
+def carbon_test_row(data: Dict[str, Any]) -> tuple:
+    """Flatten a session record into values ordered like CARBON_TEST_COLUMNS"""
+    if not isinstance(data, dict):
+        raise InvalidSessionRecord(f"session record is a {type(data).__name__}, not an object")
     # Extract environmental impact data
     env_impact = data.get('environmental_impact', {})
-    epa_equiv = data.get('epa_equivalencies', {})
-    
+    # Absent from records spooled before migration 8
+    savings = data.get('cache_savings', {})
+    if not isinstance(env_impact, dict) or not isinstance(savings, dict):
+        raise InvalidSessionRecord(f"malformed impact fields in session {data.get('session_id')!r}")
+
+    return (
+        data.get('session_id'),
+        data.get('test_variant'),
+        data.get('timestamp'),
+        data.get('start_time'),
+        data.get('end_time'),
+        data.get('duration_minutes'),
+        env_impact.get('co2_grams', 0),
+        env_impact.get('energy_kwh', 0),
+        env_impact.get('total_tokens', 0),
+        env_impact.get('total_requests', 0),
+        savings.get('cache_hits', 0),
+        savings.get('avoided_tokens', 0),
+        savings.get('avoided_co2_grams', 0),
+        savings.get('avoided_energy_kwh', 0),
+    )
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='insert_carbon_test_session')
+def insert_carbon_test_session(data: Dict[str, Any], database_url: str = None):
+    """Insert carbon test session data - PostgreSQL if URL provided"""
     if database_url:
         # Use PostgreSQL
         try:
             with get_postgres_connection(database_url) as conn:
                 with conn.cursor() as cur:
                     cur.execute(
-                        """INSERT INTO csci_8980_carbon_test (
-                            session_id, test_variant, timestamp, start_time, end_time, duration_minutes,
-                            co2_grams, co2_kg, energy_kwh, total_tokens, total_requests,
-                            miles_driven, gallons_gasoline, gallons_diesel, kwh_electricity, therms_natural_gas,
-                            led_bulb_hours, pounds_coal, barrels_oil, tree_seedlings_10_years, acres_forest_1_year,
-                            smartphone_charges, laptop_hours, netflix_hours, waste_recycling_tons, bottles_recycled,
-                            home_energy_days, water_heater_days
-                        ) VALUES (
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                            %s, %s, %s, %s, %s, %s, %s
-                        )""",
-                        (
-                            data.get('session_id'),
-                            data.get('test_variant'),
-                            data.get('timestamp'),
-                            data.get('start_time'),
-                            data.get('end_time'),
-                            data.get('duration_minutes'),
-                            env_impact.get('co2_grams', 0),
-                            env_impact.get('co2_kg', 0),
-                            env_impact.get('energy_kwh', 0),
-                            env_impact.get('total_tokens', 0),
-                            env_impact.get('total_requests', 0),
-                            epa_equiv.get('miles_driven'),
-                            epa_equiv.get('gallons_gasoline'),
-                            epa_equiv.get('gallons_diesel'),
-                            epa_equiv.get('kwh_electricity'),
-                            epa_equiv.get('therms_natural_gas'),
-                            epa_equiv.get('led_bulb_hours'),
-                            epa_equiv.get('pounds_coal'),
-                            epa_equiv.get('barrels_oil'),
-                            epa_equiv.get('tree_seedlings_10_years'),
-                            epa_equiv.get('acres_forest_1_year'),
-                            epa_equiv.get('smartphone_charges'),
-                            epa_equiv.get('laptop_hours'),
-                            epa_equiv.get('netflix_hours'),
-                            epa_equiv.get('waste_recycling_tons'),
-                            epa_equiv.get('bottles_recycled'),
-                            epa_equiv.get('home_energy_days'),
-                            epa_equiv.get('water_heater_days')
-                        )
+                        f"""INSERT INTO csci_8980_carbon_test ({', '.join(CARBON_TEST_COLUMNS)})
+                        VALUES ({', '.join(['%s'] * len(CARBON_TEST_COLUMNS))})""",
+                        carbon_test_row(data)
+                    )
+                conn.commit()
+        except Exception as e:
+            log.error("Error inserting carbon test data into PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='insert_carbon_test_sessions')
+def insert_carbon_test_sessions(records: List[Dict[str, Any]], database_url: str = None):
+    """Bulk insert carbon test sessions in one COPY"""
+    if database_url and records:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for data in records:
+            # Unquoted empty fields are NULL in COPY's CSV format
+            writer.writerow(['' if value is None else value for value in carbon_test_row(data)])
+        buffer.seek(0)
+
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.copy_expert(
+                        f"COPY csci_8980_carbon_test ({', '.join(CARBON_TEST_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                        buffer
                     )
                 conn.commit()
         except Exception as e:
-            print(f"Error inserting carbon test data into PostgreSQL: {e}")
+            log.error("Error bulk inserting carbon test data into PostgreSQL: %s", e)
             raise
 
+IMPACT_COLUMNS = ['co2_grams', 'energy_kwh']
+
+# Columns of csci_8980_turn_events, in turn log segment order
+TURN_EVENT_COLUMNS = ['ts', 'session_id', 'test_variant', 'mode', 'model', 'input_tokens', 'output_tokens',
+                      'total_tokens', 'energy_kwh', 'co2_grams', 'upstream_seconds']
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='update_carbon_test_impacts')
+def update_carbon_test_impacts(rows: List[tuple], database_url: str = None):
+    """Overwrite impact columns in bulk: COPY (id, *IMPACT_COLUMNS) rows into a
+    temp table and apply them with one UPDATE ... FROM"""
+    if database_url and rows:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['' if value is None else value for value in row])
+        buffer.seek(0)
+
+        columns = ', '.join(IMPACT_COLUMNS)
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f"""CREATE TEMP TABLE carbon_impact_fix ON COMMIT DROP AS
+                        SELECT id, {columns} FROM csci_8980_carbon_test WITH NO DATA"""
+                    )
+                    cur.copy_expert(
+                        f"COPY carbon_impact_fix (id, {columns}) FROM STDIN WITH (FORMAT csv)", buffer
+                    )
+                    cur.execute(
+                        f"""UPDATE csci_8980_carbon_test t
+                        SET {', '.join(f'{column} = f.{column}' for column in IMPACT_COLUMNS)}
+                        FROM carbon_impact_fix f WHERE t.id = f.id"""
+                    )
+                    updated = cur.rowcount
+                conn.commit()
+                return updated
+        except Exception as e:
+            log.error("Error updating carbon test impacts in PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='get_carbon_test_data')
 def get_carbon_test_data(database_url: str = None, limit: int = None):
     """Retrieve carbon test session data from database"""
-    query = "SELECT * FROM csci_8980_carbon_test ORDER BY created_at DESC"
+    query = "SELECT * FROM csci_8980_carbon_sessions ORDER BY created_at DESC, id DESC"
+    params = ()
     if limit:
-        query += f" LIMIT {limit}"
+        query += " LIMIT %s"
+        params = (int(limit),)
     
     if database_url:
         # Use PostgreSQL
         try:
             with get_postgres_connection(database_url) as conn:
                 with conn.cursor() as cur:
-                    cur.execute(query)
+                    cur.execute(query, params)
                     return cur.fetchall()
         except Exception as e:
-            print(f"Error retrieving data from PostgreSQL: {e}")
+            log.error("Error retrieving data from PostgreSQL: %s", e)
             raise
 
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='get_carbon_test_page')
+def get_carbon_test_page(database_url: str = None, limit: int = 50, before: tuple = None):
+    """Get one page of sessions, newest first, using keyset pagination.
+
+    `before` is the (created_at, id) of the last row of the previous page;
+    the index on (created_at DESC, id DESC) makes every page an index range
+    scan no matter how deep it is.
+    """
+    if before:
+        query = """SELECT * FROM csci_8980_carbon_sessions
+            WHERE (created_at, id) < (%s, %s)
+            ORDER BY created_at DESC, id DESC LIMIT %s"""
+        params = (before[0], before[1], int(limit))
+    else:
+        query = "SELECT * FROM csci_8980_carbon_sessions ORDER BY created_at DESC, id DESC LIMIT %s"
+        params = (int(limit),)
+
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    return cur.fetchall()
+        except Exception as e:
+            log.error("Error retrieving page from PostgreSQL: %s", e)
+            raise
+
+def iter_carbon_test_rows(database_url: str = None, batch_size: int = 2000):
+    """Stream every session row, oldest first, in batches of batch_size.
+
+    Reads through a named (server-side) cursor, so memory stays flat
+    regardless of table size. Yields lists of row dicts.
+    """
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor(name='carbon_test_export') as cur:
+                    cur.itersize = batch_size
+                    cur.execute("SELECT * FROM csci_8980_carbon_sessions ORDER BY created_at, id")
+                    while True:
+                        rows = cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield rows
+        except Exception as e:
+            log.error("Error streaming data from PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='get_carbon_test_summary')
 def get_carbon_test_summary(database_url: str = None):
-    """Get summary statistics from carbon test data"""
+    """Get summary statistics from the per-variant rollup (O(variants), not O(rows))"""
     summary_query = """
     SELECT 
         test_variant,
-        COUNT(*) as session_count,
-        AVG(co2_grams) as avg_co2_grams,
-        SUM(co2_grams) as total_co2_grams,
-        AVG(energy_kwh) as avg_energy_kwh,
-        SUM(energy_kwh) as total_energy_kwh,
-        AVG(total_tokens) as avg_tokens,
-        SUM(total_tokens) as total_tokens,
-        AVG(duration_minutes) as avg_duration_minutes
-    FROM csci_8980_carbon_test 
-    GROUP BY test_variant
+        session_count,
+        co2_sum / session_count as avg_co2_grams,
+        co2_sum as total_co2_grams,
+        SQRT(GREATEST((co2_sumsq - co2_sum ^ 2 / session_count) / NULLIF(session_count - 1, 0), 0))
+            as stddev_co2_grams,
+        energy_sum / session_count as avg_energy_kwh,
+        energy_sum as total_energy_kwh,
+        SQRT(GREATEST((energy_sumsq - energy_sum ^ 2 / session_count) / NULLIF(session_count - 1, 0), 0))
+            as stddev_energy_kwh,
+        tokens_sum / session_count as avg_tokens,
+        tokens_sum as total_tokens,
+        SQRT(GREATEST((tokens_sumsq - tokens_sum ^ 2 / session_count) / NULLIF(session_count - 1, 0), 0))
+            as stddev_tokens,
+        duration_sum / NULLIF(duration_count, 0) as avg_duration_minutes,
+        SQRT(GREATEST((duration_sumsq - duration_sum ^ 2 / NULLIF(duration_count, 0))
+            / NULLIF(duration_count - 1, 0), 0)) as stddev_duration_minutes
+    FROM csci_8980_carbon_variant_rollup
+    WHERE session_count > 0
     ORDER BY test_variant
     """
     
@@ -164,5 +729,260 @@ def get_carbon_test_summary(database_url: str = None):
                     cur.execute(summary_query)
                     return cur.fetchall()
         except Exception as e:
-            print(f"Error retrieving summary from PostgreSQL: {e}")
+            log.error("Error retrieving summary from PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='refresh_carbon_test_rollup')
+def refresh_carbon_test_rollup(database_url: str = None):
+    """Rebuild the per-variant rollup from csci_8980_carbon_test (repairs drift)"""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("LOCK TABLE csci_8980_carbon_test IN SHARE MODE")
+                    cur.execute("DELETE FROM csci_8980_carbon_variant_rollup")
+                    cur.execute(ROLLUP_UPSERT.format(sign='', source='csci_8980_carbon_test'))
+                conn.commit()
+        except Exception as e:
+            log.error("Error refreshing rollup in PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='get_ab_stats')
+def get_ab_stats(database_url: str = None):
+    """Get the running (test_variant, metric, n, mean, m2) states behind /ab_stats"""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""SELECT test_variant, metric, n, mean, m2 FROM csci_8980_ab_stats
+                        WHERE n > 0 ORDER BY test_variant, metric""")
+                    return cur.fetchall()
+        except Exception as e:
+            log.error("Error retrieving A/B statistics from PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='refresh_ab_stats')
+def refresh_ab_stats(database_url: str = None):
+    """Rebuild the A/B statistics in one pass over csci_8980_carbon_test (repairs drift)"""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("LOCK TABLE csci_8980_carbon_test IN SHARE MODE")
+                    cur.execute("DELETE FROM csci_8980_ab_stats")
+                    cur.execute(AB_STATS_MERGE.format(source='csci_8980_carbon_test'))
+                conn.commit()
+        except Exception as e:
+            log.error("Error refreshing A/B statistics in PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='get_loaded_turn_segments')
+def get_loaded_turn_segments(database_url: str = None):
+    """Names of the turn log segments already in csci_8980_turn_events"""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT name FROM csci_8980_turn_segments")
+                    return {row['name'] for row in cur.fetchall()}
+        except Exception as e:
+            log.error("Error retrieving loaded turn segments from PostgreSQL: %s", e)
+            raise
+    return set()
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='load_turn_segment')
+def load_turn_segment(name: str, csv_file, row_count: int, database_url: str = None):
+    """COPY one turn log segment (headerless CSV in TURN_EVENT_COLUMNS order) into
+    csci_8980_turn_events, unless a segment of that name was already loaded.
+    Returns the rows loaded."""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """INSERT INTO csci_8980_turn_segments (name, row_count) VALUES (%s, %s)
+                        ON CONFLICT (name) DO NOTHING""",
+                        (name, row_count)
+                    )
+                    if cur.rowcount == 0:
+                        conn.rollback()
+                        return 0
+                    cur.copy_expert(
+                        f"COPY csci_8980_turn_events ({', '.join(TURN_EVENT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                        csv_file
+                    )
+                conn.commit()
+                return row_count
+        except Exception as e:
+            log.error("Error loading turn segment %s into PostgreSQL: %s", name, e)
+            raise
+    return 0
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='load_conversation')
+def load_conversation(session_id: str, ttl_seconds: int, database_url: str = None):
+    """Load a stored conversation unless it has been idle longer than ttl_seconds"""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """SELECT data FROM csci_8980_conversations
+                        WHERE session_id = %s AND updated_at > NOW() - %s * INTERVAL '1 second'""",
+                        (session_id, ttl_seconds)
+                    )
+                    row = cur.fetchone()
+                    return row['data'] if row else None
+        except Exception as e:
+            log.error("Error loading conversation from PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='save_conversation')
+def save_conversation(session_id: str, conversation: Dict[str, Any], database_url: str = None):
+    """Insert or replace a conversation"""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """INSERT INTO csci_8980_conversations (session_id, data, updated_at)
+                        VALUES (%s, %s, NOW())
+                        ON CONFLICT (session_id) DO UPDATE
+                        SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at""",
+                        (session_id, psycopg2.extras.Json(conversation))
+                    )
+                conn.commit()
+        except Exception as e:
+            log.error("Error saving conversation to PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='replace_conversation')
+def replace_conversation(session_id: str, conversation: Dict[str, Any], version, ttl_seconds: int,
+                         database_url: str = None) -> bool:
+    """Write a conversation only if the stored one is still at `version`.
+
+    version None means only if none is stored (purge an expired one first);
+    a stored conversation without a version counts as version 0. The row
+    lock makes this a compare-and-set against pop_idle_conversation and
+    other writers. Returns whether it was written.
+    """
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    if version is None:
+                        cur.execute(
+                            """INSERT INTO csci_8980_conversations (session_id, data, updated_at)
+                            VALUES (%s, %s, NOW()) ON CONFLICT (session_id) DO NOTHING""",
+                            (session_id, psycopg2.extras.Json(conversation))
+                        )
+                    else:
+                        cur.execute(
+                            """UPDATE csci_8980_conversations SET data = %s, updated_at = NOW()
+                            WHERE session_id = %s AND COALESCE((data->>'version')::int, 0) = %s
+                                AND updated_at > NOW() - %s * INTERVAL '1 second'""",
+                            (psycopg2.extras.Json(conversation), session_id, version, ttl_seconds)
+                        )
+                    written = cur.rowcount == 1
+                conn.commit()
+                return written
+        except Exception as e:
+            log.error("Error replacing conversation in PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='delete_conversation')
+def delete_conversation(session_id: str, database_url: str = None):
+    """Delete a conversation"""
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM csci_8980_conversations WHERE session_id = %s", (session_id,))
+                conn.commit()
+        except Exception as e:
+            log.error("Error deleting conversation from PostgreSQL: %s", e)
             raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='pop_conversation')
+def pop_conversation(session_id: str, ttl_seconds: int, database_url: str = None):
+    """Delete and return a conversation, unless it had been idle longer than ttl_seconds.
+
+    An expired conversation is left for purge_expired_conversations to hand back.
+    """
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """DELETE FROM csci_8980_conversations
+                        WHERE session_id = %s AND updated_at > NOW() - %s * INTERVAL '1 second'
+                        RETURNING data""",
+                        (session_id, ttl_seconds)
+                    )
+                    row = cur.fetchone()
+                conn.commit()
+                return row['data'] if row else None
+        except Exception as e:
+            log.error("Error popping conversation from PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='pop_idle_conversation')
+def pop_idle_conversation(session_id: str, idle_seconds: float, database_url: str = None):
+    """Delete and return a conversation not written for idle_seconds.
+
+    Returns (data, None) when claimed, (None, seconds until it is idle) when
+    it was written since, and (None, None) when it is gone. The row lock
+    makes the claim exclusive across workers.
+    """
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """SELECT EXTRACT(EPOCH FROM updated_at + %s * INTERVAL '1 second' - NOW()) AS idle_in
+                        FROM csci_8980_conversations WHERE session_id = %s FOR UPDATE""",
+                        (idle_seconds, session_id)
+                    )
+                    row = cur.fetchone()
+                    if row is None or row['idle_in'] > 0:
+                        conn.rollback()
+                        return None, float(row['idle_in']) if row else None
+                    cur.execute(
+                        "DELETE FROM csci_8980_conversations WHERE session_id = %s RETURNING data",
+                        (session_id,)
+                    )
+                    data = cur.fetchone()['data']
+                conn.commit()
+                return data, None
+        except Exception as e:
+            log.error("Error claiming idle conversation in PostgreSQL: %s", e)
+            raise
+
+@metrics.timed(metrics.DB_SECONDS, metrics.ERRORS, operation='purge_expired_conversations')
+def purge_expired_conversations(ttl_seconds: int, database_url: str = None, session_id: str = None):
+    """Delete conversations idle longer than ttl_seconds (only session_id's, if given).
+
+    Returns the deleted (session_id, data) rows.
+    """
+    if database_url:
+        try:
+            with get_postgres_connection(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """DELETE FROM csci_8980_conversations
+                        WHERE updated_at <= NOW() - %s * INTERVAL '1 second' AND (%s IS NULL OR session_id = %s)
+                        RETURNING session_id, data""",
+                        (ttl_seconds, session_id, session_id)
+                    )
+                    deleted = [(row['session_id'], row['data']) for row in cur.fetchall()]
+                conn.commit()
+                return deleted
+        except Exception as e:
+            log.error("Error purging conversations from PostgreSQL: %s", e)
+            raise
+
+
+if __name__ == "__main__":
+    # Deploy step: python db.py
+    from dotenv import load_dotenv
+    load_dotenv()
+    init_db(os.getenv('DATABASE_URL'))
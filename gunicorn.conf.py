@@ -0,0 +1,20 @@
+# gunicorn.conf.py - Read by gunicorn when started from the repo root: `gunicorn`
+#
+# The master imports the app and runs server.startup() once before forking,
+# so workers share the loaded modules copy-on-write and boot without
+# re-importing anything. Per-process state (OpenAI and database clients,
+# background threads) is created lazily in each worker; see the pid checks
+# in token_manager.py, db.py, ingest.py, live_impact.py and metrics.py.
+import gc
+import sys
+
+wsgi_app = 'server:create_app()'
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Connections opened by migrations in the master must not be shared with workers
+    if 'db' in sys.modules:
+        sys.modules['db'].close_pools()
+    # Keep the collector from writing to inherited objects, which would copy their pages
+    gc.freeze()
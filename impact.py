@@ -0,0 +1,101 @@
+# impact.py - Emissions and EPA equivalency factors, per session or over arrays of sessions
+import numpy as np
+
+# Estimated emissions per 1000 tokens for different models (gCO2eq).
+# These are rough estimates based on research data.
+MODEL_EMISSIONS = {
+    'gpt-4': 2.93,
+    'gpt-4o': 1.47,  # Optimized version, roughly half
+    'gpt-3.5-turbo': 0.65,
+}
+DEFAULT_MODEL = 'gpt-4o'
+# Rough conversion from emissions to energy
+KWH_PER_GRAM_CO2 = 0.002
+
+# EPA's official conversion factors (2023 data): (column, basis, basis amount per unit).
+# Basis 'co2' is grams of CO2, 'energy' is kWh. Also used for the equivalency columns of
+# the csci_8980_carbon_sessions view (db.py), so changes apply to history on the next deploy.
+EPA_FACTORS = [
+    # Transportation
+    ('miles_driven', 'co2', 404),  # g CO2/mile for average passenger vehicle
+    ('gallons_gasoline', 'co2', 8887),  # g CO2/gallon of gasoline
+    ('gallons_diesel', 'co2', 10180),  # g CO2/gallon of diesel
+
+    # Energy
+    ('kwh_electricity', 'co2', 386),  # g CO2/kWh (US average grid)
+    ('therms_natural_gas', 'co2', 5300),  # g CO2/therm of natural gas
+    ('led_bulb_hours', 'energy', 0.009),  # 9W LED bulb
+
+    # Coal and fossil fuels
+    ('pounds_coal', 'co2', 505.75),  # g CO2/pound of coal (1,011,500 g per short ton)
+    ('barrels_oil', 'co2', 431000),  # g CO2/barrel of oil consumed
+
+    # Carbon sequestration
+    ('tree_seedlings_10_years', 'co2', 22000),  # 22 kg CO2 sequestered per tree in 10 years
+    ('acres_forest_1_year', 'co2', 840000),  # 0.84 metric tons CO2/acre/year
+
+    # Technology and daily life
+    ('smartphone_charges', 'co2', 8.22),  # g CO2 per full smartphone charge
+    ('laptop_hours', 'co2', 50),  # Estimated g CO2 per hour of laptop use
+    ('netflix_hours', 'co2', 36),  # g CO2 per hour of Netflix streaming
+
+    # Waste and recycling
+    ('waste_recycling_tons', 'co2', 3300000),  # Paper recycling offset, 3.3 metric tons per ton
+    ('bottles_recycled', 'co2', 25),  # g CO2 saved per recycled plastic bottle
+
+    # Home energy
+    ('home_energy_days', 'energy', 30.1),  # Daily avg home kWh
+    ('water_heater_days', 'energy', 12),  # Water heater daily kWh
+]
+EPA_COLUMNS = [column for column, _, _ in EPA_FACTORS]
+
+# Divisors per column for each basis; the other basis divides by inf and adds zero
+_CO2_DIVISORS = np.array([amount if basis == 'co2' else np.inf for _, basis, amount in EPA_FACTORS])
+_ENERGY_DIVISORS = np.array([amount if basis == 'energy' else np.inf for _, basis, amount in EPA_FACTORS])
+
+
+def emission_factor(model_name):
+    """gCO2eq per 1000 tokens for a model, defaulting to gpt-4o"""
+    return MODEL_EMISSIONS.get(model_name.lower(), MODEL_EMISSIONS[DEFAULT_MODEL])
+
+
+def estimate_impacts(input_tokens, output_tokens, model_name=DEFAULT_MODEL):
+    """Energy, CO2 and token totals for arrays of input/output token counts"""
+    total_tokens = np.asarray(input_tokens, dtype=np.int64) + np.asarray(output_tokens, dtype=np.int64)
+    co2_grams = total_tokens / 1000 * emission_factor(model_name)
+    return {
+        'energy_kwh': co2_grams * KWH_PER_GRAM_CO2,
+        'co2_grams': co2_grams,
+        'total_tokens': total_tokens,
+    }
+
+
+def epa_equivalencies(co2_grams, energy_kwh):
+    """EPA equivalencies for arrays of sessions: an (n, len(EPA_COLUMNS)) array.
+
+    Energy-based columns are 0 for sessions with no recorded energy.
+    """
+    co2_grams = np.asarray(co2_grams, dtype=np.float64)[:, None]
+    energy_kwh = np.maximum(np.asarray(energy_kwh, dtype=np.float64), 0)[:, None]
+    return co2_grams / _CO2_DIVISORS + energy_kwh / _ENERGY_DIVISORS
+
+
+def estimate_impact(model_name, input_tokens, output_tokens):
+    """Impact of a single completion, from the same factors as estimate_impacts()"""
+    input_tokens = input_tokens or 0
+    output_tokens = output_tokens or 0
+    total_tokens = input_tokens + output_tokens
+    co2_grams = total_tokens / 1000 * emission_factor(model_name)
+    return {
+        'energy_kwh': co2_grams * KWH_PER_GRAM_CO2,
+        'co2_grams': co2_grams,
+        'total_tokens': total_tokens,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens
+    }
+
+
+def equivalencies(co2_grams, energy_kwh=0):
+    """EPA equivalencies for a single session, from the same factors as epa_equivalencies()"""
+    values = {'co2': co2_grams, 'energy': max(energy_kwh, 0)}
+    return {column: values[basis] / amount for column, basis, amount in EPA_FACTORS}
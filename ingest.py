@@ -0,0 +1,253 @@
+# ingest.py - Write-behind batched ingestion of carbon test sessions
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+
+import psycopg2
+
+from db import InvalidSessionRecord, insert_carbon_test_sessions
+from structured_log import get_logger
+
+log = get_logger('ingest')
+
+# Ingestion configuration
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '2'))
+INGEST_MAX_QUEUE = int(os.getenv('INGEST_MAX_QUEUE', '100000'))
+INGEST_SHUTDOWN_TIMEOUT = float(os.getenv('INGEST_SHUTDOWN_TIMEOUT', '10'))
+
+# Failures caused by the records themselves (bad values, constraint violations),
+# which no retry can fix; anything else is treated as the database being unavailable
+DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, InvalidSessionRecord)
+
+
+class SessionIngestQueue:
+    """Accepts session records immediately and writes them to Postgres in batches.
+
+    A background thread flushes when INGEST_BATCH_SIZE records are waiting or
+    INGEST_FLUSH_INTERVAL seconds have passed. Batches that cannot be written
+    (or all records, when no database is configured) are appended to a local
+    JSON-lines spool file and replayed after the next successful flush.
+    Workers share the spool: appends hold a flock on it, and one worker at
+    a time replays it, under a flock on a .lock file beside it.
+    A replayed batch that fails on its data is split until the offending
+    records are found; those move to a .rejected file beside the spool.
+    Delivery is at-least-once: a crash during replay can insert a record twice.
+    """
+
+    def __init__(self, database_url, spool_path, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, max_queue=INGEST_MAX_QUEUE,
+                 writer=insert_carbon_test_sessions):
+        self.database_url = database_url
+        # writer(records, database_url) performs the bulk insert
+        self.writer = writer
+        self.spool_path = spool_path
+        self.rejected_path = spool_path + '.rejected'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._stats = {'submitted': 0, 'inserted': 0, 'batches': 0, 'spooled': 0, 'replayed': 0, 'rejected': 0}
+
+    def submit(self, record):
+        """Queue a session record without waiting on the database"""
+        self._ensure_started()
+        self._count('submitted')
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Never block the request; the spool is replayed once the backlog clears
+            self._spool([record])
+
+    def write(self, records):
+        """Insert records in one batch from the calling thread, spooling them if that fails"""
+        self._count('submitted', len(records))
+        self._flush(records)
+
+    def _ensure_started(self):
+        # Started lazily so each forked worker runs its own flusher thread
+        if self._thread_pid != os.getpid():
+            self._thread_pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='session-ingest', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self._replay_spool()
+        except Exception as e:
+            log.error("Error replaying spooled sessions from %s: %s", self.spool_path, e)
+        while not self._stopping.is_set():
+            self._flush_next()
+        # Drain whatever arrived before shutdown
+        while self._flush_next(wait=False):
+            pass
+
+    def _flush_next(self, wait=True):
+        """Collect and flush one batch, returning whether there was one; one failure never stops the flusher"""
+        batch = self._collect(wait)
+        if batch:
+            try:
+                self._flush(batch)
+            except Exception as e:
+                log.error("Error flushing %d sessions: %s", len(batch), e)
+        return bool(batch)
+
+    def _collect(self, wait=True):
+        """Gather up to batch_size records, waiting at most flush_interval for the batch to fill"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if wait and timeout > 0 and not self._stopping.is_set():
+                    batch.append(self._queue.get(timeout=min(timeout, 0.5)))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                if not wait or timeout <= 0 or self._stopping.is_set():
+                    break
+        return batch
+
+    def _flush(self, batch):
+        if not self.database_url:
+            self._spool(batch)
+            return
+        try:
+            self.writer(batch, self.database_url)
+        except Exception as e:
+            log.error("Error flushing %d sessions, spooling to %s: %s", len(batch), self.spool_path, e)
+            self._spool(batch)
+            return
+        self._count('inserted', len(batch))
+        self._count('batches')
+        self._replay_spool()
+
+    def _spool(self, records):
+        """Append records durably to the local spool file"""
+        self._append(self.spool_path, records)
+        self._count('spooled', len(records))
+
+    def _reject(self, records):
+        """Set aside records that can never be inserted, for inspection"""
+        self._append(self.rejected_path, records)
+        self._count('rejected', len(records))
+
+    def _append(self, path, records):
+        data = ''.join(json.dumps(record) + '\n' for record in records)
+        with self._spool_lock:
+            while True:
+                with open(path, 'a') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    # Another worker may have renamed the file for replay while we waited
+                    if not _same_file(f, path):
+                        continue
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    return
+
+    def _replay_spool(self):
+        """Insert spooled records, putting back whatever still fails"""
+        if not self.database_url:
+            return
+        # write() flushes from other threads; one replay at a time
+        if not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            # Other workers replay the same spool; whoever holds the lock file does it
+            fd = os.open(self.spool_path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+                self._replay_spool_file()
+            finally:
+                os.close(fd)
+        finally:
+            self._replay_lock.release()
+
+    def _replay_spool_file(self):
+        replay_path = self.spool_path + '.replay'
+        # A leftover replay file means an earlier replay was interrupted
+        if not os.path.exists(replay_path):
+            try:
+                with open(self.spool_path) as spool:
+                    # Wait out appends in progress; later ones see the rename and reopen
+                    fcntl.flock(spool, fcntl.LOCK_EX)
+                    os.replace(self.spool_path, replay_path)
+            except FileNotFoundError:
+                return
+
+        records = []
+        try:
+            f = open(replay_path)
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A line torn by a crash mid-append; keep its text for inspection
+                    log.error("Rejecting undecodable spool line to %s", self.rejected_path)
+                    self._reject([line.rstrip('\n')])
+
+        # Batches still to write, the next one last
+        pending = [records[start:start + self.batch_size] for start in range(0, len(records), self.batch_size)]
+        pending.reverse()
+        while pending:
+            batch = pending.pop()
+            try:
+                self.writer(batch, self.database_url)
+            except DATA_ERRORS as e:
+                if len(batch) > 1:
+                    # Bisect so the rest of the batch still goes in
+                    middle = len(batch) // 2
+                    pending += [batch[middle:], batch[:middle]]
+                else:
+                    log.error("Rejecting spooled session to %s: %s", self.rejected_path, e)
+                    self._reject(batch)
+                continue
+            except Exception as e:
+                log.error("Error replaying spooled sessions: %s", e)
+                self._spool(batch + [record for rest in reversed(pending) for record in rest])
+                break
+            self._count('replayed', len(batch))
+        try:
+            os.remove(replay_path)
+        except FileNotFoundError:
+            pass
+
+    def _count(self, stat, amount=1):
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            return {'queued': self._queue.qsize(), **self._stats}
+
+    def close(self, timeout=INGEST_SHUTDOWN_TIMEOUT):
+        """Stop the flusher after draining queued records"""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._stopping.set()
+            self._thread.join(timeout)
+
+
+def _same_file(f, path):
+    """Whether open file f is still the file at path"""
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,204 @@
+# live_impact.py - Running impact totals per session and per test variant, served from memory
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+from structured_log import get_logger
+
+log = get_logger('live_impact')
+
+# Directory shared by the workers of one deployment; unset means this process only
+LIVE_IMPACT_DIR = os.getenv('LIVE_IMPACT_DIR')
+LIVE_IMPACT_SYNC_INTERVAL = float(os.getenv('LIVE_IMPACT_SYNC_INTERVAL', '2'))
+LIVE_IMPACT_MAX_SESSIONS = int(os.getenv('LIVE_IMPACT_MAX_SESSIONS', '10000'))
+
+TOTAL_FIELDS = ('turns', 'total_tokens', 'energy_kwh', 'co2_grams', 'ended_sessions')
+
+
+def empty_totals():
+    return dict.fromkeys(TOTAL_FIELDS, 0)
+
+
+def add_totals(into, other):
+    """Add one set of totals into another"""
+    for field in TOTAL_FIELDS:
+        into[field] += other.get(field, 0)
+    return into
+
+
+class _ShardOwner:
+    """Kept in one thread's locals, so it is freed when that thread exits"""
+
+
+class LiveImpactAggregator:
+    """Per-session and per-variant running totals of tokens, energy and CO2.
+
+    Each thread adds to its own shard of variant totals without a lock;
+    readers sum the shards, and a thread's shard is folded into the retired
+    totals when the thread exits. Session totals sit in one LRU dict behind
+    a short lock, since a session's turns may run on any thread. With a
+    shared directory, a background thread writes this worker's totals to its
+    own file every sync_interval seconds and reads the other workers' files,
+    so global totals cover the whole deployment (up to one interval stale).
+    Session totals are local to the worker that served the session's turns.
+    """
+
+    def __init__(self, shared_dir=LIVE_IMPACT_DIR, sync_interval=LIVE_IMPACT_SYNC_INTERVAL,
+                 max_sessions=LIVE_IMPACT_MAX_SESSIONS):
+        self.shared_dir = shared_dir
+        self.sync_interval = sync_interval
+        self.max_sessions = max_sessions
+        self._reset_lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # State is per process: a forked worker starts from zero with its own file and thread
+        if self._pid != os.getpid():
+            with self._reset_lock:
+                if self._pid != os.getpid():
+                    self._local = threading.local()
+                    self._shards = {}   # id(shard) -> shard, for threads still running
+                    self._retired = {}  # variant -> totals from threads that exited
+                    self._shards_lock = threading.Lock()
+                    self._sessions = OrderedDict()
+                    self._sessions_lock = threading.Lock()
+                    self._others = {}
+                    self._worker_files = 1
+                    self._stopping = threading.Event()
+                    self._worker_file = None
+                    if self.shared_dir:
+                        os.makedirs(self.shared_dir, exist_ok=True)
+                        self._worker_file = os.path.join(
+                            self.shared_dir, f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+                        )
+                        threading.Thread(target=self._run, name='live-impact-sync', daemon=True).start()
+                    self._pid = os.getpid()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard, os.getpid())
+        return shard
+
+    def _retire(self, shard, pid):
+        """Fold an exited thread's shard into the retired totals"""
+        # Locals dropped after a fork belong to the parent's threads and totals
+        if pid != os.getpid():
+            return
+        with self._shards_lock:
+            if self._shards.pop(id(shard), None) is shard:
+                for variant, totals in shard.items():
+                    add_totals(self._retired.setdefault(variant, empty_totals()), totals)
+
+    def record(self, session_id, test_variant, impact):
+        """Add one completion's impact to its session and variant"""
+        self._ensure_started()
+        with self._sessions_lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = {
+                    'test_variant': test_variant, 'turns': 0, 'total_tokens': 0, 'energy_kwh': 0, 'co2_grams': 0
+                }
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            session['turns'] += 1
+            session['total_tokens'] += impact['total_tokens']
+            session['energy_kwh'] += impact['energy_kwh']
+            session['co2_grams'] += impact['co2_grams']
+
+        totals = self._variant_totals(test_variant)
+        totals['turns'] += 1
+        totals['total_tokens'] += impact['total_tokens']
+        totals['energy_kwh'] += impact['energy_kwh']
+        totals['co2_grams'] += impact['co2_grams']
+
+    def end_session(self, session_id, test_variant):
+        """Count an ended session and forget its totals (its variant totals are kept)"""
+        self._ensure_started()
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
+        self._variant_totals(test_variant)['ended_sessions'] += 1
+
+    def _variant_totals(self, test_variant):
+        # Only the calling thread writes its shard
+        shard = self._shard()
+        totals = shard.get(test_variant)
+        if totals is None:
+            totals = shard[test_variant] = empty_totals()
+        return totals
+
+    def session_totals(self, session_id):
+        """Running totals for a session served by this worker, or None"""
+        self._ensure_started()
+        with self._sessions_lock:
+            session = self._sessions.get(session_id)
+            return dict(session) if session else None
+
+    def local_totals(self):
+        """This worker's totals per variant"""
+        self._ensure_started()
+        with self._shards_lock:
+            # Under the lock, so a shard is never counted both live and retired
+            variants = {variant: dict(totals) for variant, totals in self._retired.items()}
+            for shard in self._shards.values():
+                for variant, totals in list(shard.items()):
+                    add_totals(variants.setdefault(variant, empty_totals()), totals)
+        return variants
+
+    def global_totals(self):
+        """Totals per variant and overall, across workers when a shared directory is set"""
+        variants = self.local_totals()
+        for variant, totals in self._others.items():
+            add_totals(variants.setdefault(variant, empty_totals()), totals)
+        overall = empty_totals()
+        for totals in variants.values():
+            add_totals(overall, totals)
+        return {'variants': dict(sorted(variants.items())), 'overall': overall, 'worker_files': self._worker_files}
+
+    def _run(self):
+        while not self._stopping.wait(self.sync_interval):
+            self._sync()
+
+    def _sync(self):
+        """Publish this worker's totals and merge everyone else's"""
+        try:
+            temp_path = self._worker_file + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'updated': time.time(), 'variants': self.local_totals()}, f)
+            os.replace(temp_path, self._worker_file)
+
+            others = {}
+            worker_files = 1
+            for name in os.listdir(self.shared_dir):
+                path = os.path.join(self.shared_dir, name)
+                if not name.endswith('.json') or path == self._worker_file:
+                    continue
+                try:
+                    with open(path) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                worker_files += 1
+                for variant, totals in data['variants'].items():
+                    add_totals(others.setdefault(variant, empty_totals()), totals)
+            self._others = others
+            self._worker_files = worker_files
+        except OSError as e:
+            log.error("Error syncing live impact totals: %s", e)
+
+    def close(self):
+        """Publish final totals; files of exited workers keep counting toward the global totals"""
+        if self._pid == os.getpid() and self._worker_file:
+            self._stopping.set()
+            self._sync()
+
@@ -0,0 +1,294 @@
+# metrics.py - Low-overhead counters, gauges and histograms with Prometheus text output
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from structured_log import get_logger
+
+log = get_logger('metrics')
+
+# Directory shared by the workers of one deployment; unset means /metrics covers this process only
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_SYNC_INTERVAL = float(os.getenv('METRICS_SYNC_INTERVAL', '5'))
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow completions
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+
+class Metric:
+    """A named metric with optional labels, keeping one value per label combination."""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if not labels:
+            return ()
+        return tuple([str(labels.get(label, '')) for label in self.labels])
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), _copy(value)] for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the with-block as in progress"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts including +Inf, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Observe the wall time of the with-block"""
+        return _Timer(self, labels)
+
+
+class _Timer:
+    # A plain class rather than @contextmanager: this runs on every request
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def timed(histogram, errors=None, **labels):
+    """Decorator: observe each call's duration, and count exceptions in `errors`"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+# Per-worker file sharing, mirroring live_impact.py: each worker publishes its
+# snapshot and /metrics sums every worker's latest snapshot
+_sync_pid = None
+_sync_lock = threading.Lock()
+_worker_file = None
+_stopping = threading.Event()
+
+
+def start():
+    """Start publishing this worker's metrics to METRICS_DIR (no-op when unset or already running)"""
+    global _sync_pid, _worker_file
+    if not METRICS_DIR or _sync_pid == os.getpid():
+        return
+    with _sync_lock:
+        if _sync_pid != os.getpid():
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            _worker_file = os.path.join(METRICS_DIR, f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+            _stopping.clear()
+            threading.Thread(target=_run, name='metrics-sync', daemon=True).start()
+            _sync_pid = os.getpid()
+
+
+def _run():
+    while not _stopping.wait(METRICS_SYNC_INTERVAL):
+        _publish()
+
+
+def _publish():
+    try:
+        temp_path = _worker_file + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({metric.name: metric.snapshot() for metric in _registry}, f)
+        os.replace(temp_path, _worker_file)
+    except OSError as e:
+        log.error("Error publishing metrics: %s", e)
+
+
+def stop():
+    """Publish final values (called at exit)"""
+    if _sync_pid == os.getpid():
+        _stopping.set()
+        _publish()
+
+
+def _after_fork():
+    # A forked worker counts from zero; the parent's values are its own
+    global _sync_pid
+    _sync_pid = None
+    for metric in _registry:
+        metric._lock = threading.Lock()
+        metric.reset()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _merged():
+    """Snapshots per metric name, summed across worker files when METRICS_DIR is set"""
+    merged = {metric.name: {tuple(k): v for k, v in metric.snapshot()} for metric in _registry}
+    if not (METRICS_DIR and _sync_pid == os.getpid()):
+        return merged
+
+    kinds = {metric.name: metric.kind for metric in _registry}
+    stale_before = time.time() - 3 * METRICS_SYNC_INTERVAL
+    for name in os.listdir(METRICS_DIR):
+        path = os.path.join(METRICS_DIR, name)
+        if not name.endswith('.json') or path == _worker_file:
+            continue
+        try:
+            stale = os.path.getmtime(path) < stale_before
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric_name, values in data.items():
+            # Gauges from workers that stopped publishing no longer describe anything
+            if metric_name not in merged or (stale and kinds[metric_name] == 'gauge'):
+                continue
+            target = merged[metric_name]
+            for key, value in values:
+                key = tuple(key)
+                target[key] = _add(target[key], value) if key in target else value
+    return merged
+
+
+def _add(a, b):
+    if isinstance(a, list):
+        return [_add(x, y) for x, y in zip(a, b)]
+    return a + b
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    merged = _merged()
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, value in sorted(merged[metric.name].items()):
+            if metric.kind != 'histogram':
+                lines.append(f"{metric.name}{_format_labels(metric.labels, key)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = [('le', _format_value(float(bound)))]
+                lines.append(f"{metric.name}_bucket{_format_labels(metric.labels, key, le)} {cumulative}")
+            lines.append(f"{metric.name}_sum{_format_labels(metric.labels, key)} {_format_value(float(total))}")
+            lines.append(f"{metric.name}_count{_format_labels(metric.labels, key)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics shared across modules
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status', ('route', 'status'))
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'HTTP request latency by route', ('route',))
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being served')
+UPSTREAM_SECONDS = Histogram('openai_request_seconds', 'Upstream completion latency', ('mode',))
+UPSTREAM_IN_FLIGHT = Gauge('openai_requests_in_flight', 'Upstream completions in progress')
+PROMPT_TOKENS = Counter('prompt_tokens_total', 'Prompt tokens sent upstream')
+COMPLETION_TOKENS = Counter('completion_tokens_total', 'Completion tokens received')
+COMPLETION_TOKENS_PER_SECOND = Histogram(
+    'completion_tokens_per_second', 'Completion tokens per second of upstream time',
+    buckets=(5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 1000)
+)
+IMPACT_SECONDS = Histogram('impact_estimate_seconds', 'estimate_environmental_impact latency')
+CONVERSATION_SAVE_SECONDS = Histogram('conversation_save_seconds', 'Conversation state serialization and store write')
+DB_SECONDS = Histogram('db_operation_seconds', 'db.py operation latency', ('operation',))
+ERRORS = Counter('errors_total', 'Errors by operation', ('operation',))
+RATE_LIMIT_WAITING = Gauge('openai_admission_waiting', 'Completions waiting for rate limit budget')
+RATE_LIMIT_WAIT_SECONDS = Histogram('openai_admission_wait_seconds', 'Time completions waited for rate limit budget')
+RATE_LIMIT_SHED = Counter('openai_admission_shed_total', 'Completions refused by the rate limiter', ('reason',))
+UPSTREAM_RETRIES = Counter('openai_retries_total', 'Completion retries by reason', ('reason',))
+SESSIONS_REAPED = Counter('sessions_reaped_total', 'Idle sessions ended and logged by the reaper')
+REAPER_SWEEP_SECONDS = Histogram('session_reaper_sweep_seconds', 'Idle session sweep latency')
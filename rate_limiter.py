@@ -0,0 +1,261 @@
+# rate_limiter.py - Admission control and retries for Azure OpenAI completions
+import asyncio
+import email.utils
+import fcntl
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import metrics
+from structured_log import get_logger
+from token_manager import MAX_RETRIES, import_openai
+
+log = get_logger('rate_limiter')
+
+# The deployment's quota in Azure; 0 leaves that budget unlimited
+OPENAI_TPM_LIMIT = int(os.getenv('OPENAI_TPM_LIMIT', '0'))
+OPENAI_RPM_LIMIT = int(os.getenv('OPENAI_RPM_LIMIT', '0'))
+# Longest a request waits for budget (or for a retry) before it is refused with 429
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '10'))
+# Requests allowed to wait at once in each process; more are refused immediately
+RATE_LIMIT_MAX_WAITERS = int(os.getenv('RATE_LIMIT_MAX_WAITERS', '50'))
+# Bucket state shared by every worker on the host
+RATE_LIMIT_STATE_FILE = os.getenv('RATE_LIMIT_STATE_FILE',
+                                  os.path.join(tempfile.gettempdir(), 'openai-rate-limit.json'))
+RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', '8'))
+
+
+class RateLimited(Exception):
+    """The completion was refused; the client should retry after retry_after seconds."""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(f"Upstream rate limit ({reason}), retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class UpstreamLimiter:
+    """Tokens-per-minute and requests-per-minute buckets shared by all workers.
+
+    Each bucket holds one minute of quota and refills continuously. A request
+    is charged its estimated tokens up front, as Azure does (prompt plus
+    max_completion_tokens), and the balance may go negative: the request then
+    waits until the debt is repaid, and later requests queue behind it in
+    arrival order across workers. A 429 from Azure pauses every worker until
+    its Retry-After has passed. State lives in a small flock-guarded file.
+    """
+
+    def __init__(self, tpm=OPENAI_TPM_LIMIT, rpm=OPENAI_RPM_LIMIT, state_path=RATE_LIMIT_STATE_FILE,
+                 max_wait=RATE_LIMIT_MAX_WAIT, max_waiters=RATE_LIMIT_MAX_WAITERS):
+        self.capacity = {'tokens': tpm, 'requests': rpm}
+        self.state_path = state_path
+        self.max_wait = max_wait
+        self.max_waiters = max_waiters
+        self._waiters = 0
+        self._waiters_lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return any(capacity > 0 for capacity in self.capacity.values())
+
+    def _read(self):
+        """The shared state under a shared lock, without writing it"""
+        try:
+            fd = os.open(self.state_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return {}
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            raw = os.pread(fd, 4096, 0)
+            try:
+                return json.loads(raw) if raw else {}
+            except ValueError:
+                return {}
+        finally:
+            os.close(fd)
+
+    def _update(self, change):
+        """Apply change(state, now) to the shared state under an exclusive lock"""
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 4096, 0)
+            try:
+                state = json.loads(raw) if raw else {}
+            except ValueError:
+                state = {}
+            now = time.time()
+            result = change(state, now)
+            data = json.dumps(state).encode()
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, data, 0)
+            return result
+        finally:
+            os.close(fd)
+
+    def _reserve(self, tokens):
+        """Charge one request of `tokens` and return how long it must wait before sending"""
+        def change(state, now):
+            elapsed = max(0.0, now - state.get('updated', now))
+            state['updated'] = now
+            wait = max(0.0, state.get('paused_until', 0) - now)
+            costs = {'tokens': tokens, 'requests': 1}
+            balances = {}
+            for name, capacity in self.capacity.items():
+                if capacity <= 0:
+                    continue
+                rate = capacity / 60
+                balance = min(capacity, state.get(name, capacity) + elapsed * rate)
+                # A request larger than the whole bucket is treated as filling it
+                cost = min(costs[name], capacity)
+                balances[name] = balance - cost
+                wait = max(wait, (cost - balance) / rate)
+                state[name] = balance
+            admitted = wait <= self.max_wait
+            if admitted:
+                state.update(balances)
+            return admitted, wait
+        if self.limited:
+            admitted, wait = self._update(change)
+        else:
+            # Nothing to charge without a budget; only a pause after a 429 can hold the request
+            wait = max(0.0, self._read().get('paused_until', 0) - time.time())
+            admitted = wait <= self.max_wait
+        if not admitted:
+            metrics.RATE_LIMIT_SHED.inc(reason='wait')
+            raise RateLimited(wait, 'wait')
+        return wait
+
+    def _admit(self, tokens):
+        if self._waiters >= self.max_waiters:
+            metrics.RATE_LIMIT_SHED.inc(reason='queue_full')
+            raise RateLimited(1.0, 'queue_full')
+        wait = self._reserve(tokens)
+        metrics.RATE_LIMIT_WAIT_SECONDS.observe(wait)
+        if wait:
+            with self._waiters_lock:
+                self._waiters += 1
+            metrics.RATE_LIMIT_WAITING.inc()
+        return wait
+
+    def _done_waiting(self):
+        with self._waiters_lock:
+            self._waiters -= 1
+        metrics.RATE_LIMIT_WAITING.dec()
+
+    def acquire(self, tokens):
+        """Block until a completion of `tokens` fits the budget, or raise RateLimited"""
+        wait = self._admit(tokens)
+        if wait:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done_waiting()
+
+    async def acquire_async(self, tokens):
+        """acquire() for the ASGI app; the state file is locked off the event loop"""
+        wait = await asyncio.to_thread(self._admit, tokens)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done_waiting()
+
+    def pause(self, seconds):
+        """Hold every worker's requests for `seconds` (after a 429 from Azure)"""
+        def change(state, now):
+            state['paused_until'] = max(state.get('paused_until', 0), now + seconds)
+        self._update(change)
+
+
+def retry_after_seconds(error):
+    """Delay requested by an OpenAI error's Retry-After headers, if any"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            value = headers['retry-after']
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def retry_reason(error):
+    """Why a failed completion is worth retrying, or None if it isn't"""
+    openai = import_openai()
+    if isinstance(error, openai.RateLimitError):
+        return 'rate_limit'
+    if isinstance(error, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(error, openai.APIConnectionError):
+        return 'connection'
+    if isinstance(error, openai.InternalServerError):
+        return 'server_error'
+    return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter, or Retry-After plus a little jitter so workers spread out"""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _next_delay(limiter, error, attempt, max_retries):
+    """Seconds to wait before retrying `error`, raising when it should not be retried"""
+    reason = retry_reason(error)
+    if reason is None:
+        raise error
+    delay = backoff_delay(attempt, retry_after_seconds(error))
+    if reason == 'rate_limit':
+        # The quota is shared, so every worker holds off, not just this request
+        limiter.pause(delay)
+    if attempt >= max_retries or delay > limiter.max_wait:
+        if reason == 'rate_limit':
+            raise RateLimited(delay, 'upstream') from error
+        raise error
+    metrics.UPSTREAM_RETRIES.inc(reason=reason)
+    log.warning("Retrying completion after %s in %.2fs: %s", reason, delay, error)
+    return delay
+
+
+def call_with_retries(limiter, tokens, call, max_retries=MAX_RETRIES, admitted=False):
+    """Run call() once admitted by the limiter, retrying transient failures.
+
+    Pass admitted=True when the caller already acquired budget for the first attempt.
+    """
+    attempt = 0
+    while True:
+        if attempt or not admitted:
+            limiter.acquire(tokens)
+        try:
+            return call()
+        except Exception as e:
+            time.sleep(_next_delay(limiter, e, attempt, max_retries))
+            attempt += 1
+
+
+async def call_with_retries_async(limiter, tokens, call, max_retries=MAX_RETRIES, admitted=False):
+    """call_with_retries() for coroutine functions"""
+    attempt = 0
+    while True:
+        if attempt or not admitted:
+            await limiter.acquire_async(tokens)
+        try:
+            return await call()
+        except Exception as e:
+            # _next_delay may pause() the limiter, which locks the state file
+            await asyncio.sleep(await asyncio.to_thread(_next_delay, limiter, e, attempt, max_retries))
+            attempt += 1
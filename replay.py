@@ -0,0 +1,311 @@
+"""Replay scripted conversations through the chat pipeline, without a browser.
+
+    python replay.py scripts.jsonl --results replay_results.jsonl --concurrency 8
+    python replay.py scripts.jsonl --azure-batch batch_input.jsonl [--submit]
+    python replay.py --import-batch batch_output.jsonl --results replay_results.jsonl
+
+Each input line is one conversation: {"id": ..., "messages": [...], "variant": "B"}.
+`messages` holds the user turns, as strings or {"role": "user", "content": ...}
+(other roles are ignored), and `variant` is optional. A line with a single
+"message", "prompt" or "body" is a one-turn conversation; its id may also be
+given as "request_id" or "custom_id", and defaults to the line number.
+
+Each conversation runs as its own session through server.chat_turn() and
+server.close_session(). That is the same pipeline as /chat and /end_session:
+rate-limited completion, impact estimate, variant assignment and the batched
+session insert. The input is read as a stream by a bounded thread pool. Each
+finished conversation appends one line to the results file. That file is also
+the checkpoint: a rerun skips ids already recorded as ok. A conversation cut
+off mid-run is replayed from its first turn.
+
+--azure-batch writes single-turn conversations in the Azure OpenAI Batch API
+input format; --submit also uploads it and creates the batch. Multi-turn
+conversations need each reply before the next turn, so they are skipped.
+--import-batch reads the batch output file and records a session per
+completion, as the live replay does.
+
+The response cache is off unless RESPONSE_CACHE_ENABLED=true is set in the
+environment, so every turn is a real completion and measures real impacts.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+
+# Read by response_cache when server is imported (before .env, which doesn't override it)
+os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'false')
+
+import server
+from rate_limiter import RateLimited
+from structured_log import get_logger
+
+log = get_logger('replay')
+
+# Conversations read ahead of the pool, per worker thread
+READ_AHEAD = 2
+
+
+def completed_ids(path):
+    """Ids recorded as ok in a results file"""
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                if result.get('status') == 'ok':
+                    done.add(str(result['id']))
+    return done
+
+
+class ResultsFile:
+    """Append-only JSON-lines results, one line per conversation; also the checkpoint"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = completed_ids(path)
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def write(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result, default=str) + '\n')
+            # Flushed per line so a killed run loses at most the conversations in flight
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def user_messages(record):
+    if isinstance(record.get('messages'), list):
+        return [m if isinstance(m, str) else m.get('content', '') for m in record['messages']
+                if isinstance(m, str) or m.get('role', 'user') == 'user']
+    for field in ('message', 'prompt', 'body'):
+        if isinstance(record.get(field), str):
+            return [record[field]]
+    return []
+
+
+def read_scripts(path):
+    """Yield (id, user messages, variant or None) for each conversation in a JSONL file"""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                log.warning("Skipping line %d of %s: %s", line_number, path, e)
+                continue
+            script_id = next((record[k] for k in ('id', 'request_id', 'custom_id') if k in record), line_number)
+            messages = [m for m in user_messages(record) if m]
+            if not messages:
+                log.warning("Skipping line %d of %s: no user messages", line_number, path)
+                continue
+            variant = record.get('variant') or record.get('test_variant')
+            if variant is not None and variant not in server.TEST_VARIANTS:
+                log.warning("Line %d of %s: unknown variant %r, assigning one", line_number, path, variant)
+                variant = None
+            yield str(script_id), messages, variant
+
+
+def session_result(script_id, session_id, test_variant, cumulative_impacts, **extra):
+    return {
+        'id': script_id,
+        'status': 'ok',
+        'session_id': session_id,
+        'test_variant': test_variant,
+        'total_tokens': cumulative_impacts['total_tokens'],
+        'co2_grams': cumulative_impacts['co2_grams'],
+        'energy_kwh': cumulative_impacts['energy_kwh'],
+        'cache_hits': cumulative_impacts.get('cache_hits', 0),
+        **extra
+    }
+
+
+def replay_conversation(script_id, messages, variant=None, keep_replies=True):
+    """Run one scripted conversation as a session, returning its result record"""
+    started = time.perf_counter()
+    user_session = {'test_variant': variant or server.assign_test_variant()}
+    replies = []
+    session_id = None
+    try:
+        for message in messages:
+            while True:
+                try:
+                    session_id, reply = server.chat_turn(user_session, message, mode='replay')
+                    break
+                except RateLimited as e:
+                    # Offline, waiting out the limit beats giving up
+                    time.sleep(e.retry_after)
+            replies.append(reply)
+    except Exception as e:
+        # Nothing is logged for a conversation that did not finish; a rerun replays it
+        if session_id:
+            server.conversation_store.delete(session_id)
+        log.error("Replay of %s failed: %s", script_id, e)
+        return {'id': script_id, 'status': 'error', 'error': str(e), 'turns': len(replies)}
+
+    test_variant = user_session['test_variant']
+    cumulative_impacts, _ = server.close_session(session_id, test_variant, user_session.get('session_start_time'))
+    extra = {'turns': len(replies), 'seconds': round(time.perf_counter() - started, 3)}
+    if keep_replies:
+        extra['replies'] = replies
+    return session_result(script_id, session_id, test_variant, cumulative_impacts, **extra)
+
+
+def replay(scripts, results, concurrency=8, keep_replies=True):
+    """Replay conversations on a bounded pool, returning result counts by status"""
+    counts = {'ok': 0, 'error': 0, 'skipped': 0}
+    pending = set()
+
+    def collect(done):
+        for future in done:
+            result = future.result()
+            results.write(result)
+            counts[result['status']] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='replay') as pool:
+        try:
+            for script_id, messages, variant in scripts:
+                if script_id in results.done:
+                    counts['skipped'] += 1
+                    continue
+                # Bound the read-ahead so the input is never loaded whole
+                if len(pending) >= concurrency * READ_AHEAD:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(replay_conversation, script_id, messages, variant, keep_replies))
+            collect(wait(pending).done)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=True, cancel_futures=True)
+            collect(f for f in pending if f.done() and not f.cancelled())
+            raise
+    return counts
+
+
+def write_azure_batch(scripts, path, skip_ids=()):
+    """Write single-turn conversations as Azure OpenAI Batch API input, returning (written, skipped)"""
+    written = skipped = 0
+    with open(path, 'w') as f:
+        for script_id, messages, variant in scripts:
+            if len(messages) != 1 or script_id in skip_ids:
+                skipped += 1
+                continue
+            conversation = server.get_conversation(None)
+            conversation['messages'].append({'role': 'user', 'content': messages[0]})
+            f.write(json.dumps({
+                # The variant travels with the request so the import can record it
+                'custom_id': f"{script_id}|{variant or server.assign_test_variant()}",
+                'method': 'POST',
+                'url': '/chat/completions',
+                'body': {
+                    'model': server.deployment,
+                    'messages': server.build_prompt(conversation),
+                    'max_completion_tokens': server.MAX_COMPLETION_TOKENS
+                }
+            }) + '\n')
+            written += 1
+    return written, skipped
+
+
+def submit_azure_batch(path):
+    """Upload a batch input file and start the batch, returning its id"""
+    client = server.get_openai_client()
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id, endpoint='/chat/completions',
+                                  completion_window='24h')
+    return batch.id
+
+
+def import_azure_batch(path, results, keep_replies=True):
+    """Record a session for each completion in an Azure Batch output file, returning counts by status"""
+    counts = {'ok': 0, 'error': 0, 'skipped': 0}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            output = json.loads(line)
+            script_id, _, test_variant = output['custom_id'].rpartition('|')
+            if test_variant not in server.TEST_VARIANTS:
+                script_id, test_variant = output['custom_id'], server.assign_test_variant()
+            if script_id in results.done:
+                counts['skipped'] += 1
+                continue
+            response = output.get('response') or {}
+            if output.get('error') or response.get('status_code') != 200:
+                error = output.get('error') or response.get('body', {}).get('error')
+                results.write({'id': script_id, 'status': 'error', 'error': error})
+                counts['error'] += 1
+                continue
+
+            body = response['body']
+            usage = SimpleNamespace(**body['usage'])
+            reply = body['choices'][0]['message']['content'] or "No response"
+            session_id = str(uuid.uuid4())
+            conversation = server.get_conversation(None)
+            turn_impact = server.add_turn_impact(conversation['cumulative_impacts'], usage)
+            server.turn_log.record(session_id, test_variant, 'batch', turn_impact, model=body.get('model'))
+            server.save_conversation(session_id, conversation)
+            cumulative_impacts, _ = server.close_session(session_id, test_variant)
+
+            extra = {'turns': 1, 'replies': [reply]} if keep_replies else {'turns': 1}
+            results.write(session_result(script_id, session_id, test_variant, cumulative_impacts, **extra))
+            counts['ok'] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scripts', nargs='?', help='JSONL conversation scripts')
+    parser.add_argument('--results', default='replay_results.jsonl',
+                        help='JSONL results, appended to; ids recorded as ok are skipped')
+    parser.add_argument('--concurrency', type=int, default=8, help='conversations replayed at once')
+    parser.add_argument('--omit-replies', action='store_true', help="don't store assistant replies in the results")
+    parser.add_argument('--azure-batch', metavar='PATH', help='write Azure Batch API input instead of replaying')
+    parser.add_argument('--submit', action='store_true', help='upload the --azure-batch file and create the batch')
+    parser.add_argument('--import-batch', metavar='PATH', help='record sessions from an Azure Batch output file')
+    args = parser.parse_args()
+
+    if not (args.scripts or args.import_batch):
+        parser.error('give a scripts file, or --import-batch')
+    if args.submit and not args.azure_batch:
+        parser.error('--submit needs --azure-batch')
+
+    server.startup()
+    started = time.perf_counter()
+    if args.azure_batch:
+        written, skipped = write_azure_batch(read_scripts(args.scripts), args.azure_batch,
+                                             completed_ids(args.results))
+        print(f"Wrote {written} requests to {args.azure_batch} ({skipped} multi-turn or already replayed skipped)")
+        if args.submit:
+            print(f"Created batch {submit_azure_batch(args.azure_batch)}")
+        return
+
+    results = ResultsFile(args.results)
+    try:
+        if args.import_batch:
+            counts = import_azure_batch(args.import_batch, results, not args.omit_replies)
+        else:
+            counts = replay(read_scripts(args.scripts), results, args.concurrency, not args.omit_replies)
+    finally:
+        results.close()
+        # Write the queued session records before exiting
+        server.ingest_queue.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{counts['ok']} conversations recorded, {counts['error']} failed, {counts['skipped']} already done "
+          f"in {elapsed:.1f}s ({counts['ok'] / elapsed:.1f}/s); results in {args.results}")
+    print(f"Session ingest: {server.ingest_queue.stats()}")
+
+
+if __name__ == "__main__":
+    main()
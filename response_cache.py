@@ -0,0 +1,161 @@
+# response_cache.py - Cache completions for repeated prompts
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from conversation_store import MemoryStore
+
+# Cache configuration
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', str(24 * 60 * 60)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '5000'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# Optional SQLite file so cached responses survive restarts and are shared by workers
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH')
+RESPONSE_CACHE_DISK_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# The disk tier is pruned to its byte limit once every this many writes
+PRUNE_EVERY_WRITES = 500
+
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive form of a message used for cache keys"""
+    return ' '.join(text.split()).casefold()
+
+
+def cache_key(prompt, deployment, max_completion_tokens):
+    """Key for a completion: the normalized prompt messages plus the model settings"""
+    material = json.dumps({
+        'deployment': deployment,
+        'max_completion_tokens': max_completion_tokens,
+        'messages': [[m['role'], normalize_text(m['content'])] for m in prompt],
+    }, separators=(',', ':'))
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class SQLiteResponseStore:
+    """Persistent cache tier in a local SQLite file."""
+
+    def __init__(self, path, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, max_bytes=RESPONSE_CACHE_DISK_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+
+    def _connection(self):
+        # One connection per process; connections must not cross a fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        payload = json.dumps(value, separators=(',', ':')).encode()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, payload, time.time() + self.ttl_seconds)
+                )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY_WRITES == 0:
+                self._prune(conn)
+
+    def _prune(self, conn):
+        """Delete expired rows, then the soonest-to-expire rows until under max_bytes"""
+        with conn:
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM response_cache").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                doomed = []
+                rows = conn.execute("SELECT key, LENGTH(value) FROM response_cache ORDER BY expires_at")
+                for key, size in rows:
+                    if excess <= 0:
+                        break
+                    doomed.append((key,))
+                    excess -= size
+                conn.executemany("DELETE FROM response_cache WHERE key = ?", doomed)
+
+
+class ResponseCache:
+    """Two-tier completion cache: in-process LRU in front of an optional SQLite file."""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'disk_hits': 0}
+        self._hit_seconds = 0.0
+        self._miss_seconds = 0.0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+        with self._lock:
+            self._counters['hits' if value is not None else 'misses'] += 1
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def record_latency(self, hit, seconds):
+        """Record how long a turn waited for its reply, from the cache or upstream"""
+        with self._lock:
+            if hit:
+                self._hit_seconds += seconds
+            else:
+                self._miss_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self._counters['hits'], self._counters['misses']
+            lookups = hits + misses
+            return {
+                'enabled': True,
+                'hit_rate': hits / lookups if lookups else 0,
+                'avg_hit_latency_ms': self._hit_seconds / hits * 1000 if hits else None,
+                'avg_miss_latency_ms': self._miss_seconds / misses * 1000 if misses else None,
+                'persistent': self.disk is not None,
+                'memory': self.memory.stats(),
+                **self._counters,
+            }
+
+
+def create_response_cache():
+    """Build the cache configured by the RESPONSE_CACHE_* settings, or None if disabled"""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    memory = MemoryStore(max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                         ttl_seconds=RESPONSE_CACHE_TTL_SECONDS)
+    disk = SQLiteResponseStore(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+    return ResponseCache(memory, disk)
@@ -1,32 +1,232 @@
+-- Reference schema after all migrations in db.py (MIGRATIONS); apply with `python db.py`.
+-- Kept for reference; db.py is the source of truth.
+
+-- Base measurements only; co2_kg and EPA equivalencies come from csci_8980_carbon_sessions
 CREATE TABLE csci_8980_carbon_test (
     id SERIAL PRIMARY KEY,
-    session_id UUID NOT NULL,
+    session_id VARCHAR(255) NOT NULL,
     test_variant VARCHAR(10) NOT NULL,
     timestamp TIMESTAMP NOT NULL,
-    start_time TIMESTAMP NOT NULL,
-    end_time TIMESTAMP NOT NULL,
-    duration_minutes NUMERIC(6,2) NOT NULL,
+    start_time TIMESTAMP,
+    end_time TIMESTAMP,
+    duration_minutes NUMERIC(6,2),
     co2_grams NUMERIC(12,8) NOT NULL,
-    co2_kg NUMERIC(12,10) NOT NULL,
     energy_kwh NUMERIC(12,10) NOT NULL,
     total_tokens INTEGER NOT NULL,
     total_requests INTEGER NOT NULL,
-    miles_driven NUMERIC(12,8) NOT NULL,
-    gallons_gasoline NUMERIC(18,17) NOT NULL,
-    gallons_diesel NUMERIC(18,17) NOT NULL,
-    kwh_electricity NUMERIC(18,17) NOT NULL,
-    therms_natural_gas NUMERIC(18,17) NOT NULL,
-    led_bulb_hours NUMERIC(12,8) NOT NULL,
-    pounds_coal NUMERIC(18,17) NOT NULL,
-    barrels_oil NUMERIC(18,17) NOT NULL,
-    tree_seedlings_10_years NUMERIC(18,17) NOT NULL,
-    acres_forest_1_year NUMERIC(18,17) NOT NULL,
-    smartphone_charges NUMERIC(18,17) NOT NULL,
-    laptop_hours NUMERIC(12,8) NOT NULL,
-    netflix_hours NUMERIC(12,8) NOT NULL,
-    waste_recycling_tons NUMERIC(18,17) NOT NULL,
-    bottles_recycled NUMERIC(12,8) NOT NULL,
-    home_energy_days NUMERIC(18,17) NOT NULL,
-    water_heater_days NUMERIC(18,17) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Replies served from the response cache and what their upstream calls would have cost
+    cache_hits INTEGER NOT NULL DEFAULT 0,
+    avoided_tokens INTEGER NOT NULL DEFAULT 0,
+    avoided_co2_grams NUMERIC(12,8) NOT NULL DEFAULT 0,
+    avoided_energy_kwh NUMERIC(12,10) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE csci_8980_conversations (
+    session_id VARCHAR(255) PRIMARY KEY,
+    data JSONB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX csci_8980_conversations_updated_at_idx
+    ON csci_8980_conversations (updated_at);
+
+CREATE TABLE schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX csci_8980_carbon_test_created_at_id_idx ON csci_8980_carbon_test (created_at DESC, id DESC);
+CREATE INDEX csci_8980_carbon_test_session_id_idx ON csci_8980_carbon_test (session_id);
+
+-- Maintained by statement-level triggers on csci_8980_carbon_test (see migrations 4 and 9)
+CREATE TABLE csci_8980_carbon_variant_rollup (
+    test_variant VARCHAR(10) PRIMARY KEY,
+    session_count BIGINT NOT NULL DEFAULT 0,
+    co2_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    co2_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,
+    energy_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    energy_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,
+    tokens_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    tokens_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,
+    duration_count BIGINT NOT NULL DEFAULT 0,
+    duration_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    duration_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+
+CREATE FUNCTION csci_8980_carbon_rollup_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO csci_8980_carbon_variant_rollup AS r (
+            test_variant, session_count, co2_sum, co2_sumsq, energy_sum, energy_sumsq,
+            tokens_sum, tokens_sumsq, duration_count, duration_sum, duration_sumsq
+        )
+        SELECT test_variant, -COUNT(*),
+            -COALESCE(SUM(co2_grams), 0), -COALESCE(SUM(co2_grams::float8 ^ 2), 0),
+            -COALESCE(SUM(energy_kwh), 0), -COALESCE(SUM(energy_kwh::float8 ^ 2), 0),
+            -COALESCE(SUM(total_tokens), 0), -COALESCE(SUM(total_tokens::float8 ^ 2), 0),
+            -COUNT(duration_minutes),
+            -COALESCE(SUM(duration_minutes), 0), -COALESCE(SUM(duration_minutes::float8 ^ 2), 0)
+        FROM old_rows GROUP BY test_variant
+        ORDER BY test_variant
+        ON CONFLICT (test_variant) DO UPDATE SET
+            session_count = r.session_count + EXCLUDED.session_count,
+            co2_sum = r.co2_sum + EXCLUDED.co2_sum,
+            co2_sumsq = r.co2_sumsq + EXCLUDED.co2_sumsq,
+            energy_sum = r.energy_sum + EXCLUDED.energy_sum,
+            energy_sumsq = r.energy_sumsq + EXCLUDED.energy_sumsq,
+            tokens_sum = r.tokens_sum + EXCLUDED.tokens_sum,
+            tokens_sumsq = r.tokens_sumsq + EXCLUDED.tokens_sumsq,
+            duration_count = r.duration_count + EXCLUDED.duration_count,
+            duration_sum = r.duration_sum + EXCLUDED.duration_sum,
+            duration_sumsq = r.duration_sumsq + EXCLUDED.duration_sumsq;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO csci_8980_carbon_variant_rollup AS r (
+            test_variant, session_count, co2_sum, co2_sumsq, energy_sum, energy_sumsq,
+            tokens_sum, tokens_sumsq, duration_count, duration_sum, duration_sumsq
+        )
+        SELECT test_variant, COUNT(*),
+            COALESCE(SUM(co2_grams), 0), COALESCE(SUM(co2_grams::float8 ^ 2), 0),
+            COALESCE(SUM(energy_kwh), 0), COALESCE(SUM(energy_kwh::float8 ^ 2), 0),
+            COALESCE(SUM(total_tokens), 0), COALESCE(SUM(total_tokens::float8 ^ 2), 0),
+            COUNT(duration_minutes),
+            COALESCE(SUM(duration_minutes), 0), COALESCE(SUM(duration_minutes::float8 ^ 2), 0)
+        FROM new_rows GROUP BY test_variant
+        ORDER BY test_variant
+        ON CONFLICT (test_variant) DO UPDATE SET
+            session_count = r.session_count + EXCLUDED.session_count,
+            co2_sum = r.co2_sum + EXCLUDED.co2_sum,
+            co2_sumsq = r.co2_sumsq + EXCLUDED.co2_sumsq,
+            energy_sum = r.energy_sum + EXCLUDED.energy_sum,
+            energy_sumsq = r.energy_sumsq + EXCLUDED.energy_sumsq,
+            tokens_sum = r.tokens_sum + EXCLUDED.tokens_sum,
+            tokens_sumsq = r.tokens_sumsq + EXCLUDED.tokens_sumsq,
+            duration_count = r.duration_count + EXCLUDED.duration_count,
+            duration_sum = r.duration_sum + EXCLUDED.duration_sum,
+            duration_sumsq = r.duration_sumsq + EXCLUDED.duration_sumsq;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER csci_8980_carbon_rollup_insert
+    AFTER INSERT ON csci_8980_carbon_test REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_carbon_rollup_apply();
+CREATE TRIGGER csci_8980_carbon_rollup_update
+    AFTER UPDATE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_carbon_rollup_apply();
+CREATE TRIGGER csci_8980_carbon_rollup_delete
+    AFTER DELETE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_carbon_rollup_apply();
+
+-- Welford state (count, mean, sum of squared deviations) per variant and metric
+-- for /ab_stats, maintained by statement-level triggers (see migration 6)
+CREATE TABLE csci_8980_ab_stats (
+    test_variant VARCHAR(10) NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    n BIGINT NOT NULL DEFAULT 0,
+    mean DOUBLE PRECISION NOT NULL DEFAULT 0,
+    m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (test_variant, metric)
+);
+
+CREATE FUNCTION csci_8980_ab_stats_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE csci_8980_ab_stats s SET
+            n = s.n - o.n,
+            mean = CASE WHEN s.n > o.n THEN (s.mean * s.n - o.mean * o.n) / (s.n - o.n) ELSE 0 END,
+            m2 = CASE WHEN s.n > o.n
+                THEN GREATEST(s.m2 - o.m2 - (o.mean - s.mean) ^ 2 * s.n * o.n / (s.n - o.n), 0) ELSE 0 END
+        FROM (
+        SELECT test_variant, v.metric, COUNT(v.value) AS n, AVG(v.value) AS mean,
+            VAR_POP(v.value) * COUNT(v.value) AS m2
+        FROM old_rows, LATERAL (VALUES
+            ('co2_grams', co2_grams::float8), ('energy_kwh', energy_kwh::float8),
+            ('total_tokens', total_tokens::float8), ('total_requests', total_requests::float8),
+            ('duration_minutes', duration_minutes::float8)
+        ) AS v(metric, value)
+        WHERE v.value IS NOT NULL
+        GROUP BY test_variant, v.metric
+        ) o
+        WHERE s.test_variant = o.test_variant AND s.metric = o.metric;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO csci_8980_ab_stats AS s (test_variant, metric, n, mean, m2)
+        SELECT test_variant, v.metric, COUNT(v.value) AS n, AVG(v.value) AS mean,
+            VAR_POP(v.value) * COUNT(v.value) AS m2
+        FROM new_rows, LATERAL (VALUES
+            ('co2_grams', co2_grams::float8), ('energy_kwh', energy_kwh::float8),
+            ('total_tokens', total_tokens::float8), ('total_requests', total_requests::float8),
+            ('duration_minutes', duration_minutes::float8)
+        ) AS v(metric, value)
+        WHERE v.value IS NOT NULL
+        GROUP BY test_variant, v.metric
+        ORDER BY 1, 2
+        ON CONFLICT (test_variant, metric) DO UPDATE SET
+            n = s.n + EXCLUDED.n,
+            mean = s.mean + (EXCLUDED.mean - s.mean) * EXCLUDED.n / (s.n + EXCLUDED.n),
+            m2 = s.m2 + EXCLUDED.m2 + (EXCLUDED.mean - s.mean) ^ 2 * s.n * EXCLUDED.n / (s.n + EXCLUDED.n);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER csci_8980_ab_stats_insert
+    AFTER INSERT ON csci_8980_carbon_test REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_ab_stats_apply();
+CREATE TRIGGER csci_8980_ab_stats_update
+    AFTER UPDATE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_ab_stats_apply();
+CREATE TRIGGER csci_8980_ab_stats_delete
+    AFTER DELETE ON csci_8980_carbon_test REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION csci_8980_ab_stats_apply();
+
+-- Per-turn impact events loaded from turn_log.py segments (see migration 7);
+-- append-only in time order, so a BRIN index on ts serves time-range scans
+CREATE TABLE csci_8980_turn_events (
+    ts TIMESTAMPTZ NOT NULL,
+    session_id VARCHAR(255),
+    test_variant VARCHAR(10),
+    mode VARCHAR(16),
+    model VARCHAR(64),
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    total_tokens INTEGER,
+    energy_kwh DOUBLE PRECISION,
+    co2_grams DOUBLE PRECISION,
+    upstream_seconds DOUBLE PRECISION
+);
+CREATE INDEX csci_8980_turn_events_ts_brin ON csci_8980_turn_events USING BRIN (ts);
+
+-- Segment files already loaded into csci_8980_turn_events, so each loads once
+CREATE TABLE csci_8980_turn_segments (
+    name VARCHAR(255) PRIMARY KEY,
+    row_count BIGINT NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Recreated by init_db() from the factors in impact.py (db.carbon_sessions_view_sql)
+CREATE VIEW csci_8980_carbon_sessions AS
+SELECT id, session_id, test_variant, timestamp, start_time, end_time, duration_minutes,
+    co2_grams, co2_grams / 1000 AS co2_kg, energy_kwh, total_tokens, total_requests,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 404 END AS miles_driven,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 8887 END AS gallons_gasoline,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 10180 END AS gallons_diesel,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 386 END AS kwh_electricity,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 5300 END AS therms_natural_gas,
+    CASE WHEN co2_grams > 0 THEN CASE WHEN energy_kwh > 0 THEN energy_kwh / 0.009 ELSE 0 END END AS led_bulb_hours,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 505.75 END AS pounds_coal,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 431000 END AS barrels_oil,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 22000 END AS tree_seedlings_10_years,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 840000 END AS acres_forest_1_year,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 8.22 END AS smartphone_charges,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 50 END AS laptop_hours,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 36 END AS netflix_hours,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 3300000 END AS waste_recycling_tons,
+    CASE WHEN co2_grams > 0 THEN co2_grams / 25 END AS bottles_recycled,
+    CASE WHEN co2_grams > 0 THEN CASE WHEN energy_kwh > 0 THEN energy_kwh / 30.1 ELSE 0 END END AS home_energy_days,
+    CASE WHEN co2_grams > 0 THEN CASE WHEN energy_kwh > 0 THEN energy_kwh / 12 ELSE 0 END END AS water_heater_days,
+    created_at, cache_hits, avoided_tokens, avoided_co2_grams, avoided_energy_kwh
+FROM csci_8980_carbon_test;
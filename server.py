@@ -1,25 +1,41 @@
 
-from flask import Flask, render_template, request, jsonify, session
-from token_manager import get_openai_client
+# Settings below are read from the environment at import, so load .env first
+from dotenv import load_dotenv
+load_dotenv()
+
+from flask import Flask, Response, g, render_template, request, jsonify, session, stream_with_context
+from token_manager import get_openai_client, import_openai
+import atexit
+import csv
+import io
+import json
+import math
+import threading
+import time
 import uuid
 import random
 from datetime import datetime
-from ecologits import EcoLogits
-from db import insert_carbon_test_session, init_db
-from dotenv import load_dotenv
+from decimal import Decimal
+from db import get_ab_stats, get_carbon_test_page, init_db, iter_carbon_test_rows
+from ab_stats import VariantStats
+from ingest import SessionIngestQueue
+from live_impact import LiveImpactAggregator
+from rate_limiter import RateLimited, UpstreamLimiter, call_with_retries
+import impact
+import metrics
+from structured_log import get_logger
+from conversation_store import create_conversation_store
+from context_window import build_prompt
+from response_cache import cache_key, create_response_cache
+from session_reaper import SessionReaper
+from turn_log import TurnLog
 import os
-from openai import AzureOpenAI
-import requests
-
-load_dotenv()
 
+log = get_logger('server')
 
-endpoint = "https://aimaker-openai.openai.azure.com/"
 model_name = "o4-mini"
 deployment = "o4-mini"
-
-subscription_key = os.getenv('OPENAI_API_KEY')
-api_version = "2024-12-01-preview"
+MAX_COMPLETION_TOKENS = 3000
 
 
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -27,15 +43,109 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_KEY')
 
-# Initialize OpenAI client
-openai_client = get_openai_client()
-
 # Store active trackers for each session
 active_trackers = {}
 
+# Message history and running impacts, keyed by session_id (the cookie only carries the ID)
+conversation_store = create_conversation_store(DATABASE_URL)
+# Conditional writes tried before a save gives up on a contended session
+SAVE_CONVERSATION_ATTEMPTS = 3
+
+# Completions for repeated prompts (None when RESPONSE_CACHE_ENABLED=false)
+response_cache = create_response_cache()
+
 # Data logging configuration
 DATA_LOG_FILE = 'user_sessions_data.json'
 
+RUN_MIGRATIONS_ON_STARTUP = os.getenv('RUN_MIGRATIONS_ON_STARTUP', 'true').lower() == 'true'
+# EcoLogits instruments the OpenAI SDK; the app's own estimates come from impact.py
+ECOLOGITS_ENABLED = os.getenv('ECOLOGITS_ENABLED', 'true').lower() == 'true'
+
+_started = False
+_startup_lock = threading.Lock()
+
+def startup():
+    """One-time initialization kept out of module import: migrations, EcoLogits, the OpenAI SDK.
+
+    create_app() runs it eagerly, which under gunicorn's preload_app happens
+    once in the master so forked workers inherit the result copy-on-write.
+    Otherwise each process runs it on the first request it serves.
+    """
+    global _started
+    with _startup_lock:
+        if _started:
+            return
+        if RUN_MIGRATIONS_ON_STARTUP:
+            try:
+                init_db(DATABASE_URL)
+            except Exception as e:
+                log.error("Database migrations failed: %s", e)
+        if ECOLOGITS_ENABLED:
+            try:
+                from ecologits import EcoLogits
+                EcoLogits.init()
+                log.info("EcoLogits initialized successfully")
+            except Exception as e:
+                log.warning("EcoLogits initialization failed: %s", e)
+        import_openai()
+        _started = True
+
+def create_app():
+    """App factory for gunicorn ('server:create_app()', see gunicorn.conf.py)"""
+    startup()
+    return app
+
+# Session records are written behind the request; DATA_LOG_FILE spools them while the DB is unavailable
+ingest_queue = SessionIngestQueue(DATABASE_URL, DATA_LOG_FILE)
+atexit.register(ingest_queue.close)
+
+# Running impact totals for /current_impact and /epa_equivalencies
+live_impacts = LiveImpactAggregator()
+atexit.register(live_impacts.close)
+
+# Per-turn impact events in columnar segment files (off unless TURN_LOG_DIR is set)
+turn_log = TurnLog(database_url=DATABASE_URL)
+atexit.register(turn_log.close)
+
+# Admission control for completions against the deployment's TPM/RPM quota
+upstream_limiter = UpstreamLimiter()
+
+atexit.register(metrics.stop)
+
+@app.before_request
+def start_request_metrics():
+    metrics.start()
+    metrics.HTTP_IN_FLIGHT.inc()
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def ensure_startup():
+    # Counted in the first request's latency, which is what the client sees
+    if not _started:
+        startup()
+
+def finish_request_metrics(route, started, status):
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+    metrics.HTTP_REQUESTS.inc(route=route, status=status)
+    metrics.HTTP_IN_FLIGHT.dec()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        # A response is finished when the server closes it, after streaming the last chunk
+        response.call_on_close(lambda: finish_request_metrics(route, started, response.status_code))
+    return response
+
+@app.teardown_request
+def record_failed_request_metrics(exc):
+    # Requests that raised never reach after_request
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        finish_request_metrics(route, started, 500)
+
 # A/B/C Test Variants
 TEST_VARIANTS = {
     'A': 'no_emissions',      # No emissions shown
@@ -45,50 +155,61 @@ TEST_VARIANTS = {
 
 
 def save_session_data(session_data):
-    """Save session data to JSON file"""
+    """Queue session data for a batched database write"""
     try:
-        insert_carbon_test_session(session_data, DATABASE_URL)
+        ingest_queue.submit(session_data)
     except Exception as e:
-        print(f"Error saving session data: {e}")
+        log.error("Error saving session data: %s", e)
+
+def session_record(session_id, test_variant, cumulative_impacts, start_time=None, end_time=None):
+    """The logged record for an ended session; end_time (ISO format) defaults to now"""
+    end_time = end_time or datetime.now().isoformat()
+    session_data = {
+        'session_id': session_id,
+        'test_variant': test_variant,
+        'timestamp': datetime.now().isoformat(),
+        'start_time': start_time,
+        'end_time': end_time,
+        'duration_minutes': None,  # Will calculate if start_time available
+        'environmental_impact': {
+            'co2_grams': cumulative_impacts.get('co2_grams', 0),
+            'co2_kg': cumulative_impacts.get('co2_grams', 0) / 1000,
+            'energy_kwh': cumulative_impacts.get('energy_kwh', 0),
+            'total_tokens': cumulative_impacts.get('total_tokens', 0),
+            'total_requests': cumulative_impacts.get('requests', 0)
+        },
+        'cache_savings': {
+            'cache_hits': cumulative_impacts.get('cache_hits', 0),
+            'avoided_tokens': cumulative_impacts.get('avoided_tokens', 0),
+            'avoided_co2_grams': cumulative_impacts.get('avoided_co2_grams', 0),
+            'avoided_energy_kwh': cumulative_impacts.get('avoided_energy_kwh', 0)
+        },
+        'epa_equivalencies': calculate_epa_equivalencies(
+            cumulative_impacts.get('co2_grams', 0),
+            cumulative_impacts.get('energy_kwh', 0)
+        ) if cumulative_impacts.get('co2_grams', 0) > 0 else {}
+    }
+
+    # Calculate session duration if start time is available
+    if start_time:
+        try:
+            start_dt = datetime.fromisoformat(start_time)
+            end_dt = datetime.fromisoformat(end_time)
+            duration = (end_dt - start_dt).total_seconds() / 60
+            session_data['duration_minutes'] = round(duration, 2)
+        except:
+            pass
+    return session_data
 
 def log_session_end(session_id, test_variant, cumulative_impacts, start_time=None):
     """Log session data when session ends"""
     try:
-        session_data = {
-            'session_id': session_id,
-            'test_variant': test_variant,
-            'timestamp': datetime.now().isoformat(),
-            'start_time': start_time,
-            'end_time': datetime.now().isoformat(),
-            'duration_minutes': None,  # Will calculate if start_time available
-            'environmental_impact': {
-                'co2_grams': cumulative_impacts.get('co2_grams', 0),
-                'co2_kg': cumulative_impacts.get('co2_grams', 0) / 1000,
-                'energy_kwh': cumulative_impacts.get('energy_kwh', 0),
-                'total_tokens': cumulative_impacts.get('total_tokens', 0),
-                'total_requests': cumulative_impacts.get('requests', 0)
-            },
-            'epa_equivalencies': calculate_epa_equivalencies(
-                cumulative_impacts.get('co2_grams', 0),
-                cumulative_impacts.get('energy_kwh', 0)
-            ) if cumulative_impacts.get('co2_grams', 0) > 0 else {}
-        }
-        
-        # Calculate session duration if start time is available
-        if start_time:
-            try:
-                start_dt = datetime.fromisoformat(start_time)
-                end_dt = datetime.now()
-                duration = (end_dt - start_dt).total_seconds() / 60
-                session_data['duration_minutes'] = round(duration, 2)
-            except:
-                pass
-        
+        session_data = session_record(session_id, test_variant, cumulative_impacts, start_time)
         save_session_data(session_data)
         return session_data
         
     except Exception as e:
-        print(f"Error logging session end: {e}")
+        log.error("Error logging session end: %s", e)
         return None
 
 def assign_test_variant():
@@ -96,49 +217,12 @@ def assign_test_variant():
     variants = ['A', 'B', 'C']
     weights = [30, 30, 40]  # A, B, C percentages
     variant = random.choices(variants, weights=weights, k=1)[0]
-    print(variant)
+    log.debug("Assigned test variant %s", variant, extra={'fields': {'test_variant': variant}})
     return variant
 
 def calculate_epa_equivalencies(co2_grams, energy_kwh=0):
     """Calculate EPA greenhouse gas equivalencies for given CO2 emissions"""
-    co2_kg = co2_grams / 1000
-    co2_metric_tons = co2_kg / 1000
-    
-    # EPA's official conversion factors (2023 data)
-    equivalencies = {
-        # Transportation
-        'miles_driven': co2_grams / 404,  # g CO2/mile for average passenger vehicle
-        'gallons_gasoline': co2_grams / 8887,  # g CO2/gallon of gasoline
-        'gallons_diesel': co2_grams / 10180,  # g CO2/gallon of diesel
-        
-        # Energy
-        'kwh_electricity': co2_grams / 386,  # g CO2/kWh (US average grid)
-        'therms_natural_gas': co2_grams / 5300,  # g CO2/therm of natural gas
-        'led_bulb_hours': (energy_kwh / 0.009) if energy_kwh > 0 else 0,  # 9W LED bulb
-        
-        # Coal and fossil fuels
-        'pounds_coal': (co2_grams / 1011500) * 2000,  # lbs (from short ton conversion)
-        'barrels_oil': co2_grams / 431000,  # g CO2/barrel of oil consumed
-        
-        # Carbon sequestration
-        'tree_seedlings_10_years': co2_kg / 22,  # kg CO2 sequestered per tree in 10 years
-        'acres_forest_1_year': co2_metric_tons / 0.84,  # metric tons CO2/acre/year
-        
-        # Technology and daily life
-        'smartphone_charges': co2_grams / 8.22,  # g CO2 per full smartphone charge
-        'laptop_hours': co2_grams / 50,  # Estimated g CO2 per hour of laptop use
-        'netflix_hours': co2_grams / 36,  # g CO2 per hour of Netflix streaming
-        
-        # Waste and recycling
-        'waste_recycling_tons': co2_metric_tons / 3.3,  # Paper recycling offset
-        'bottles_recycled': co2_grams / 25,  # g CO2 saved per recycled plastic bottle
-        
-        # Home energy
-        'home_energy_days': (energy_kwh / 30.1) if energy_kwh > 0 else 0,  # Daily avg home kWh
-        'water_heater_days': (energy_kwh / 12) if energy_kwh > 0 else 0,  # Water heater daily kWh
-    }
-    
-    return equivalencies
+    return impact.equivalencies(co2_grams, energy_kwh)
 
 def get_emissions_context(cumulative_impacts):
     """Generate contextual information about CO2 emissions using EPA conversion factors"""
@@ -185,9 +269,211 @@ def get_emissions_context(cumulative_impacts):
 @app.route("/")
 def index():
     session['test_variant'] = assign_test_variant()
-    init_db(DATABASE_URL)
     return render_template('index.html', test_variant=session['test_variant'])
 
+SYSTEM_PROMPT = "You are a helpful assistant. Answer the user's questions to the best of your ability."
+
+def start_conversation(user_session):
+    """Get the session ID, creating the conversation state on first use"""
+    session_id = user_session.get('session_id')
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        user_session['session_id'] = session_id
+        user_session['session_start_time'] = datetime.now().isoformat()
+        # Assign test variant if not already assigned
+        if 'test_variant' not in user_session:
+            user_session['test_variant'] = assign_test_variant()
+    return session_id
+
+def add_turn_impact(cumulative_impacts, usage):
+    """Estimate the impact of one completion and add it to the running totals"""
+    input_tokens = usage.prompt_tokens if usage else 0
+    output_tokens = usage.completion_tokens if usage else 0
+
+    # Estimate environmental impact
+    impact = estimate_environmental_impact(
+        model_name="gpt-4o",
+        input_tokens=input_tokens,
+        output_tokens=output_tokens
+    )
+
+    # Log the environmental impact
+    log.debug("Turn impact", extra={'fields': {
+        'energy_kwh': impact['energy_kwh'], 'co2_grams': impact['co2_grams'], 'total_tokens': impact['total_tokens']
+    }})
+
+    cumulative_impacts['energy_kwh'] += impact['energy_kwh']
+    cumulative_impacts['co2_grams'] += impact['co2_grams']
+    cumulative_impacts['total_tokens'] += impact['total_tokens']
+    cumulative_impacts['requests'] += 1
+    return impact
+
+def record_turn(session_id, test_variant, mode, turn_impact, upstream_seconds=None):
+    """Add a completion to the live totals and the per-turn event log"""
+    live_impacts.record(session_id, test_variant, turn_impact)
+    turn_log.record(session_id, test_variant, mode, turn_impact, upstream_seconds, deployment)
+
+def new_cumulative_impacts():
+    """Empty running totals for a session"""
+    return {
+        'energy_kwh': 0,
+        'co2_grams': 0,
+        'total_tokens': 0,
+        'requests': 0
+    }
+
+def get_cached_reply(prompt, cumulative_impacts):
+    """Look up a cached reply for the prompt, returning (cache key, reply or None).
+
+    A hit skips the upstream call, so its tokens and CO2 are recorded as
+    avoided rather than added to the session's emissions.
+    """
+    if response_cache is None:
+        return None, None
+    started = time.perf_counter()
+    key = cache_key(prompt, deployment, MAX_COMPLETION_TOKENS)
+    cached = response_cache.get(key)
+    if cached is None:
+        return key, None
+
+    avoided = estimate_environmental_impact(
+        model_name="gpt-4o",
+        input_tokens=cached['input_tokens'],
+        output_tokens=cached['output_tokens']
+    )
+    cumulative_impacts['cache_hits'] = cumulative_impacts.get('cache_hits', 0) + 1
+    cumulative_impacts['avoided_tokens'] = cumulative_impacts.get('avoided_tokens', 0) + avoided['total_tokens']
+    cumulative_impacts['avoided_co2_grams'] = cumulative_impacts.get('avoided_co2_grams', 0) + avoided['co2_grams']
+    cumulative_impacts['avoided_energy_kwh'] = cumulative_impacts.get('avoided_energy_kwh', 0) + avoided['energy_kwh']
+    response_cache.record_latency(True, time.perf_counter() - started)
+    return key, cached['reply']
+
+def cache_reply(key, reply, usage, upstream_seconds):
+    """Store a fresh completion under its cache key"""
+    if response_cache is None or key is None:
+        return
+    response_cache.record_latency(False, upstream_seconds)
+    if reply:
+        response_cache.put(key, {
+            'reply': reply,
+            'input_tokens': usage.prompt_tokens if usage else 0,
+            'output_tokens': usage.completion_tokens if usage else 0
+        })
+
+def save_conversation(session_id, conversation):
+    """Write a session's conversation back to the store.
+
+    The write only lands if the stored conversation is still the version
+    get_conversation() loaded. If the session was ended (and logged) during
+    the turn, this turn's impacts start a new conversation instead of being
+    logged twice; if another turn saved it meanwhile, the impacts are added.
+    """
+    loaded = conversation.pop('loaded_impacts', None) or new_cumulative_impacts()
+    conversation['last_active'] = datetime.now().isoformat()
+    with metrics.CONVERSATION_SAVE_SECONDS.time():
+        for _ in range(SAVE_CONVERSATION_ATTEMPTS):
+            expected = conversation.get('version')
+            conversation['version'] = (expected or 0) + 1
+            if conversation_store.replace(session_id, conversation, expected):
+                session_reaper.touch(session_id)
+                return
+            # Rebase this turn's impacts onto what is stored now
+            base = conversation_store.get(session_id)
+            if base is None:
+                base = get_conversation(None, conversation.get('test_variant'))
+                base['version'] = None
+            impacts = conversation['cumulative_impacts']
+            base_impacts = base['cumulative_impacts']
+            conversation['cumulative_impacts'] = {
+                key: base_impacts.get(key, 0) + value - loaded.get(key, 0)
+                for key, value in impacts.items()
+            }
+            conversation['version'] = base.get('version', 0)
+            conversation['start_time'] = base['start_time']
+            loaded = base_impacts
+    log.warning("Gave up saving conversation %s after %d attempts", session_id, SAVE_CONVERSATION_ATTEMPTS)
+
+def observe_completion(mode, seconds, usage):
+    """Record an upstream completion's latency and token throughput"""
+    metrics.UPSTREAM_SECONDS.observe(seconds, mode=mode)
+    if usage:
+        metrics.PROMPT_TOKENS.inc(usage.prompt_tokens)
+        metrics.COMPLETION_TOKENS.inc(usage.completion_tokens)
+        if seconds > 0:
+            metrics.COMPLETION_TOKENS_PER_SECOND.observe(usage.completion_tokens / seconds)
+
+def get_conversation(session_id, test_variant=None):
+    """Load a session's conversation, starting a new one if it is missing or expired.
+
+    A new conversation records its variant and start time, so the idle
+    reaper can log the session without the user's cookie.
+    """
+    conversation = conversation_store.get(session_id) if session_id else None
+    if conversation is None:
+        conversation = {
+            'messages': [{
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            }],
+            'cumulative_impacts': new_cumulative_impacts(),
+            'test_variant': test_variant,
+            'start_time': datetime.now().isoformat(),
+            'version': None
+        }
+    else:
+        conversation.setdefault('version', 0)
+    # What save_conversation() rebases from if the stored copy changes meanwhile
+    conversation['loaded_impacts'] = dict(conversation['cumulative_impacts'])
+    return conversation
+
+def chat_turn(user_session, user_message, mode='chat'):
+    """Run one turn of a session's conversation, returning (session_id, assistant reply).
+
+    Shared by /chat and replay.py: cached or upstream completion (through the
+    rate limiter), impact accounting and the conversation store write.
+    """
+    # Get or create session ID
+    session_id = start_conversation(user_session)
+
+    # Get existing messages or initialize
+    conversation = get_conversation(session_id, user_session.get('test_variant'))
+    messages = conversation['messages']
+
+    # Add user message
+    messages.append({"role": "user", "content": user_message})
+
+    prompt = build_prompt(conversation)
+    key, assistant_reply = get_cached_reply(prompt, conversation['cumulative_impacts'])
+
+    if assistant_reply is None:
+        client = get_openai_client()
+        tokens = admission_tokens(conversation)
+        upstream_limiter.acquire(tokens)
+
+        started = time.perf_counter()
+        with metrics.UPSTREAM_IN_FLIGHT.track():
+            chat_response = call_with_retries(upstream_limiter, tokens, lambda: client.chat.completions.create(
+                messages=prompt,
+                max_completion_tokens=MAX_COMPLETION_TOKENS,
+                model=deployment
+            ), admitted=True)
+        upstream_seconds = time.perf_counter() - started
+        observe_completion(mode, upstream_seconds, chat_response.usage)
+
+        # Extract assistant's reply
+        assistant_reply = chat_response.choices[0].message.content
+        cache_reply(key, assistant_reply, chat_response.usage, upstream_seconds)
+        assistant_reply = assistant_reply or "No response"
+
+        # Add to the session's cumulative impacts
+        turn_impact = add_turn_impact(conversation['cumulative_impacts'], chat_response.usage)
+        record_turn(session_id, user_session.get('test_variant', 'A'), mode, turn_impact, upstream_seconds)
+
+    # Add assistant reply to messages
+    messages.append({"role": "assistant", "content": assistant_reply})
+    save_conversation(session_id, conversation)
+    return session_id, assistant_reply
+
 @app.route("/chat", methods=['POST'])
 def chat():
     try:
@@ -197,74 +483,7 @@ def chat():
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
         
-        # Get or create session ID
-        session_id = session.get('session_id')
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session['session_id'] = session_id
-            session['session_start_time'] = datetime.now().isoformat()
-            session['messages'] = [{
-                "role": "system",
-                "content": "You are a helpful assistant. Answer the user's questions to the best of your ability."
-            }]
-            # Assign test variant if not already assigned
-            if 'test_variant' not in session:
-                session['test_variant'] = assign_test_variant()
-                
-        # Get existing messages or initialize
-        messages = session.get('messages', [])
-        
-        # Add user message
-        messages.append({"role": "user", "content": user_message})
-        
-        client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=endpoint,
-        api_key=subscription_key,
-        )
-
-        chat_response = client.chat.completions.create(
-        messages=messages,
-        max_completion_tokens=3000,
-        model=deployment
-        )
-        
-        # Extract assistant's reply
-        assistant_reply = chat_response.choices[0].message.content or "No response"
-        
-        # Extract token usage if available
-        usage = chat_response.usage
-        input_tokens = usage.prompt_tokens if usage else 0
-        output_tokens = usage.completion_tokens if usage else 0
-        
-        # Estimate environmental impact
-        impact = estimate_environmental_impact(
-            model_name="gpt-4o",
-            input_tokens=input_tokens,
-            output_tokens=output_tokens
-        )
-        
-        # Log the environmental impact
-        print(f"Environmental Impact - Energy: {impact['energy_kwh']:.6f} kWh, "
-              f"CO2: {impact['co2_grams']:.4f} g, Tokens: {impact['total_tokens']}")
-        
-        # Store cumulative impacts in session
-        if 'cumulative_impacts' not in session:
-            session['cumulative_impacts'] = {
-                'energy_kwh': 0,
-                'co2_grams': 0,
-                'total_tokens': 0,
-                'requests': 0
-            }
-        
-        session['cumulative_impacts']['energy_kwh'] += impact['energy_kwh']
-        session['cumulative_impacts']['co2_grams'] += impact['co2_grams']
-        session['cumulative_impacts']['total_tokens'] += impact['total_tokens']
-        session['cumulative_impacts']['requests'] += 1
-        
-        # Add assistant reply to messages
-        messages.append({"role": "assistant", "content": assistant_reply})
-        session['messages'] = messages
+        session_id, assistant_reply = chat_turn(session, user_message)
         
         return jsonify({
             'response': assistant_reply,
@@ -272,22 +491,200 @@ def chat():
             'test_variant': session.get('test_variant', 'A')
         })
         
-    except requests.exceptions.RequestException as e:
-        return jsonify({'error': f'API request failed: {str(e)}'}), 500
+    except RateLimited as e:
+        log.warning("Chat refused: %s", e)
+        return rate_limited_response(e)
     except Exception as e:
+        metrics.ERRORS.inc(operation='chat')
+        log.error("Chat failed: %s", e)
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
+def admission_tokens(conversation):
+    """Tokens a completion is charged against the TPM budget: the prompt plus the completion limit, as Azure counts it"""
+    return conversation.get('prompt_tokens', 0) + MAX_COMPLETION_TOKENS
+
+def rate_limited_body(e):
+    return {'error': 'The assistant is busy, please try again shortly.', 'retry_after': max(1, math.ceil(e.retry_after))}
+
+def rate_limited_response(e):
+    """429 telling the client when to try again"""
+    body = rate_limited_body(e)
+    return jsonify(body), 429, {'Retry-After': str(body['retry_after'])}
+
+def sse_event(payload):
+    """Format a payload as one Server-Sent Events message"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+@app.route("/chat/stream", methods=['POST'])
+def chat_stream():
+    """Stream the assistant's reply as Server-Sent Events while it is generated"""
+    data = request.get_json()
+    user_message = data.get('message', '')
+
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    session_id = start_conversation(session)
+    test_variant = session.get('test_variant', 'A')
+    conversation = get_conversation(session_id, test_variant)
+    messages = conversation['messages']
+    messages.append({"role": "user", "content": user_message})
+
+    prompt = build_prompt(conversation)
+    key, cached_reply = get_cached_reply(prompt, conversation['cumulative_impacts'])
+    tokens = admission_tokens(conversation)
+    if cached_reply is None:
+        # Wait for budget before the response starts, while a refusal can still be a 429
+        try:
+            upstream_limiter.acquire(tokens)
+        except RateLimited as e:
+            log.warning("Streaming chat refused: %s", e)
+            return rate_limited_response(e)
+
+    def generate():
+        try:
+            if cached_reply is not None:
+                yield sse_event({'type': 'token', 'content': cached_reply})
+                messages.append({"role": "assistant", "content": cached_reply})
+                save_conversation(session_id, conversation)
+                yield sse_event({'type': 'done', 'session_id': session_id, 'test_variant': test_variant})
+                return
+
+            started = time.perf_counter()
+            reply_parts = []
+            usage = None
+            with metrics.UPSTREAM_IN_FLIGHT.track():
+                stream = call_with_retries(upstream_limiter, tokens, lambda: get_openai_client().chat.completions.create(
+                    messages=prompt,
+                    max_completion_tokens=MAX_COMPLETION_TOKENS,
+                    model=deployment,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ), admitted=True)
+
+                for chunk in stream:
+                    # Usage arrives on the final chunk, which has no choices
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        reply_parts.append(token)
+                        yield sse_event({'type': 'token', 'content': token})
+            upstream_seconds = time.perf_counter() - started
+            observe_completion('stream', upstream_seconds, usage)
+
+            cache_reply(key, ''.join(reply_parts), usage, upstream_seconds)
+            assistant_reply = ''.join(reply_parts) or "No response"
+            turn_impact = add_turn_impact(conversation['cumulative_impacts'], usage)
+            record_turn(session_id, test_variant, 'stream', turn_impact, upstream_seconds)
+            messages.append({"role": "assistant", "content": assistant_reply})
+            save_conversation(session_id, conversation)
+
+            yield sse_event({
+                'type': 'done',
+                'session_id': session_id,
+                'test_variant': test_variant
+            })
+        except RateLimited as e:
+            log.warning("Streaming chat refused: %s", e)
+            yield sse_event(dict(rate_limited_body(e), type='error'))
+        except Exception as e:
+            metrics.ERRORS.inc(operation='chat_stream')
+            log.error("Streaming chat failed: %s", e)
+            yield sse_event({'type': 'error', 'error': f'An error occurred: {str(e)}'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def close_session(session_id, test_variant, start_time=None):
+    """Record an ended session and drop its conversation.
+
+    Shared by /end_session and replay.py. Returns (cumulative impacts, logged session record or None).
+    """
+    # Taking the conversation out of the store claims the session, so the idle reaper can't log it too
+    conversation = conversation_store.pop(session_id) if session_id else None
+    cumulative_impacts = (conversation or get_conversation(None))['cumulative_impacts']
+
+    # Log session data (there is nothing to record if no chat was started, or the reaper ended it)
+    logged_data = None
+    if conversation is not None:
+        logged_data = log_session_end(session_id, test_variant, cumulative_impacts,
+                                      conversation.get('start_time', start_time))
+
+    # Log the test variant and emissions for analysis
+    log.info("Session ended", extra={'fields': {
+        'session_id': session_id,
+        'test_variant': test_variant,
+        'energy_kwh': cumulative_impacts['energy_kwh'],
+        'co2_grams': cumulative_impacts['co2_grams'],
+        'total_tokens': cumulative_impacts['total_tokens'],
+        'requests': cumulative_impacts['requests'],
+        'prompt_tokens_saved': cumulative_impacts.get('prompt_tokens_saved', 0),
+        'cache_hits': cumulative_impacts.get('cache_hits', 0),
+        'avoided_tokens': cumulative_impacts.get('avoided_tokens', 0),
+        'avoided_co2_grams': cumulative_impacts.get('avoided_co2_grams', 0),
+        'duration_minutes': logged_data.get('duration_minutes') if logged_data else None
+    }})
+
+    if session_id:
+        session_reaper.forget(session_id)
+        live_impacts.end_session(session_id, test_variant)
+    return cumulative_impacts, logged_data
+
+def ended_session_records(ended):
+    """Session records for (session_id, conversation) pairs taken out of the store, as of their last turn"""
+    records = []
+    for session_id, conversation in ended:
+        test_variant = conversation.get('test_variant') or 'A'
+        records.append(session_record(session_id, test_variant, conversation['cumulative_impacts'],
+                                      conversation.get('start_time'), conversation.get('last_active')))
+        live_impacts.end_session(session_id, test_variant)
+    return records
+
+def finalize_idle_sessions(expired):
+    """Log sessions the reaper found idle in one bulk insert"""
+    records = ended_session_records(expired)
+    ingest_queue.write(records)
+    log.info("Ended idle sessions", extra={'fields': {
+        'sessions': len(records),
+        'co2_grams': sum(r['environmental_impact']['co2_grams'] for r in records)
+    }})
+
+def end_evicted_sessions(evicted):
+    """Log sessions the conversation store dropped (TTL or size caps) before they were ended.
+
+    Called on the request thread that caused the eviction, so records are
+    queued rather than written.
+    """
+    try:
+        records = ended_session_records(evicted)
+        for record in records:
+            save_session_data(record)
+        for session_id, _ in evicted:
+            session_reaper.forget(session_id)
+        log.info("Ended evicted sessions", extra={'fields': {
+            'sessions': len(records),
+            'co2_grams': sum(r['environmental_impact']['co2_grams'] for r in records)
+        }})
+    except Exception as e:
+        log.error("Error logging evicted sessions: %s", e)
+
+# Ends sessions whose browser never called /end_session (SESSION_IDLE_TIMEOUT=0 disables)
+session_reaper = SessionReaper(conversation_store, finalize_idle_sessions)
+atexit.register(session_reaper.close)
+conversation_store.on_evict = end_evicted_sessions
+
 @app.route("/end_session", methods=['POST'])
 def end_session():
     try:
         session_id = session.get('session_id')
         test_variant = session.get('test_variant', 'A')
-        cumulative_impacts = session.get('cumulative_impacts', {
-            'energy_kwh': 0,
-            'co2_grams': 0,
-            'total_tokens': 0,
-            'requests': 0
-        })
+        cumulative_impacts, _ = close_session(session_id, test_variant, session.get('session_start_time'))
         
         co2_grams = cumulative_impacts['co2_grams']
         energy_kwh = cumulative_impacts['energy_kwh']
@@ -311,19 +708,6 @@ def end_session():
         if test_variant == 'C' and co2_grams > 0:
             response_data['emissions']['context'] = get_emissions_context(cumulative_impacts)
         
-        # Log session data to JSON file
-        session_start_time = session.get('session_start_time')
-        logged_data = log_session_end(session_id, test_variant, cumulative_impacts, session_start_time)
-        
-        # Log the test variant and emissions for analysis (console)
-        print(f"Session {session_id}: Variant {test_variant}")
-        print(f"  Energy consumption: {energy_kwh:.6f} kWh")
-        print(f"  GHG emissions: {co2_grams:.4f} g CO2eq")
-        print(f"  Total tokens: {cumulative_impacts['total_tokens']}")
-        print(f"  Total requests: {cumulative_impacts['requests']}")
-        if logged_data and logged_data.get('duration_minutes'):
-            print(f"  Session duration: {logged_data['duration_minutes']} minutes")
-        
         # Clear session but keep test variant for potential new session
         session_variant = session.get('test_variant')
         session.clear()
@@ -332,8 +716,151 @@ def end_session():
         return jsonify(response_data)
             
     except Exception as e:
+        metrics.ERRORS.inc(operation='end_session')
+        log.error("Error ending session: %s", e)
         return jsonify({'error': f'Error ending session: {str(e)}'}), 500
 
+@app.route("/conversation_stats")
+def conversation_stats():
+    """Get conversation store size and eviction counters, and the idle reaper's"""
+    return jsonify({**conversation_store.stats(), 'reaper': session_reaper.stats()})
+
+@app.route("/cache_stats")
+def cache_stats():
+    """Get response cache hit rate and latency"""
+    if response_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(response_cache.stats())
+
+@app.route("/ingest_stats")
+def ingest_stats():
+    """Get session ingestion queue and turn log counters"""
+    return jsonify({**ingest_queue.stats(), 'turn_log': turn_log.stats()})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics for this worker (or all workers, with METRICS_DIR)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/current_impact")
+def current_impact():
+    """Get running totals for this session and across all sessions, from memory"""
+    session_id = session.get('session_id')
+    return jsonify({
+        'session_id': session_id,
+        'test_variant': session.get('test_variant'),
+        'session': live_impacts.session_totals(session_id) if session_id else None,
+        'global': live_impacts.global_totals()
+    })
+
+@app.route("/epa_equivalencies")
+def epa_equivalencies():
+    """Get EPA equivalencies for the running totals, overall and per variant"""
+    totals = live_impacts.global_totals()
+    def with_equivalencies(impact_totals):
+        return {
+            'co2_grams': impact_totals['co2_grams'],
+            'energy_kwh': impact_totals['energy_kwh'],
+            'equivalencies': calculate_epa_equivalencies(impact_totals['co2_grams'], impact_totals['energy_kwh'])
+        }
+    return jsonify({
+        'overall': with_equivalencies(totals['overall']),
+        'variants': {variant: with_equivalencies(t) for variant, t in totals['variants'].items()}
+    })
+
+def json_default(value):
+    """JSON encoding for database values (timestamps and NUMERIC columns)"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+@app.route("/view_data")
+def view_data():
+    """Get one page of logged sessions, newest first.
+
+    Pass the returned `next_cursor` as `?cursor=` to get the following page.
+    """
+    if not DATABASE_URL:
+        return jsonify({'error': 'No database configured'}), 503
+    try:
+        limit = int(request.args.get('limit', 50))
+        if limit < 1:
+            raise ValueError(limit)
+        limit = min(limit, 1000)
+        before = None
+        if request.args.get('cursor'):
+            created_at, row_id = request.args['cursor'].rsplit('_', 1)
+            before = (datetime.fromisoformat(created_at), int(row_id))
+
+        rows = get_carbon_test_page(DATABASE_URL, limit=limit, before=before)
+        next_cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_cursor = f"{last['created_at'].isoformat()}_{last['id']}"
+
+        return Response(
+            json.dumps({'rows': rows, 'next_cursor': next_cursor}, default=json_default),
+            mimetype='application/json'
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Error loading data: {str(e)}'}), 500
+
+@app.route("/export_data")
+def export_data():
+    """Stream every logged session as CSV (default) or NDJSON with constant memory"""
+    if not DATABASE_URL:
+        return jsonify({'error': 'No database configured'}), 503
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = None
+        for rows in iter_carbon_test_rows(DATABASE_URL):
+            if writer is None:
+                writer = csv.DictWriter(buffer, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def generate_ndjson():
+        for rows in iter_carbon_test_rows(DATABASE_URL):
+            yield ''.join(json.dumps(row, default=json_default) + '\n' for row in rows)
+
+    filename = f"carbon_test_{datetime.now().strftime('%Y%m%d')}.{export_format}"
+    return Response(
+        generate_csv() if export_format == 'csv' else generate_ndjson(),
+        mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route("/ab_stats")
+def ab_stats():
+    """Get per-variant means with confidence intervals and pairwise Welch t-tests.
+
+    Reads the running statistics kept per variant and metric, never the
+    session rows. `?confidence=` sets the level (default 0.95).
+    """
+    if not DATABASE_URL:
+        return jsonify({'error': 'No database configured'}), 503
+    try:
+        confidence = float(request.args.get('confidence', 0.95))
+        if not 0 < confidence < 1:
+            raise ValueError(confidence)
+    except ValueError:
+        return jsonify({'error': 'confidence must be between 0 and 1'}), 400
+    try:
+        return jsonify(VariantStats.from_states(get_ab_stats(DATABASE_URL)).report(confidence))
+    except Exception as e:
+        return jsonify({'error': f'Error loading statistics: {str(e)}'}), 500
+
 @app.route("/test_info")
 def test_info():
     """Get current test variant information"""
@@ -342,43 +869,15 @@ def test_info():
         'test_variant': variant,
         'variant_description': TEST_VARIANTS.get(variant)
     })
- 
-# Initialize EcoLogits (if we can use it)
-try:
-    EcoLogits.init()
-    print("EcoLogits initialized successfully")
-except Exception as e:
-    print(f"EcoLogits initialization failed: {e}")
 
 # Manual environmental impact estimation for Target API
+@metrics.timed(metrics.IMPACT_SECONDS)
 def estimate_environmental_impact(model_name, input_tokens, output_tokens):
     """
     Estimate environmental impact based on model usage
-    These are rough estimates based on research data
+    Factors live in impact.py, shared with the batch backfill
     """
-    # Base estimates per 1000 tokens for different models (in gCO2eq)
-    model_emissions = {
-        'gpt-4': 2.93,  # gCO2eq per 1000 tokens
-        'gpt-4o': 1.47,  # Optimized version, roughly half
-        'gpt-3.5-turbo': 0.65,
-        'default': 1.47  # Use GPT-4o as default
-    }
-    
-    # Get emissions factor for the model
-    emissions_factor = model_emissions.get(model_name.lower(), model_emissions['default'])
-    
-    # Calculate total tokens and emissions
-    total_tokens = (input_tokens or 0) + (output_tokens or 0)
-    estimated_co2_grams = (total_tokens / 1000) * emissions_factor
-    estimated_energy_kwh = estimated_co2_grams * 0.002  # Rough conversion
-    
-    return {
-        'energy_kwh': estimated_energy_kwh,
-        'co2_grams': estimated_co2_grams,
-        'total_tokens': total_tokens,
-        'input_tokens': input_tokens or 0,
-        'output_tokens': output_tokens or 0
-    }
+    return impact.estimate_impact(model_name, input_tokens, output_tokens)
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
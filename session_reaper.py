@@ -0,0 +1,138 @@
+# session_reaper.py - Finalizes sessions whose browser never called /end_session
+import heapq
+import os
+import threading
+import time
+
+import metrics
+from structured_log import get_logger
+
+log = get_logger('session_reaper')
+
+# A session with no turn for this long is ended and logged; 0 disables the reaper
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', str(30 * 60)))
+SESSION_REAPER_INTERVAL = float(os.getenv('SESSION_REAPER_INTERVAL', '60'))
+
+
+class SessionReaper:
+    """Ends sessions idle longer than idle_seconds, in one batch per sweep.
+
+    touch() records a turn. Each tracked session has a single entry in a heap
+    ordered by the deadline it had when queued; later turns only move the
+    deadline in a dict. A sweep pops just the entries that are due and
+    requeues those whose session was touched since, so its cost follows the
+    number of sessions expiring, not the number active. Due sessions are
+    claimed with the conversation store's pop_idle(), which checks idleness
+    against the store itself: a session that moved on to another worker's
+    Postgres-backed store is requeued, and one ended by /end_session or by
+    another worker's reaper is dropped. The claimed (session_id, conversation)
+    pairs go to finalize() in one call per sweep.
+    """
+
+    def __init__(self, store, finalize, idle_seconds=SESSION_IDLE_TIMEOUT, interval=SESSION_REAPER_INTERVAL):
+        self.store = store
+        self.finalize = finalize
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._reset_lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def enabled(self):
+        return self.idle_seconds > 0
+
+    def _ensure_started(self):
+        # Sessions are tracked per process: a forked worker starts empty with its own sweeper
+        if self._pid != os.getpid():
+            with self._reset_lock:
+                if self._pid != os.getpid():
+                    self._deadlines = {}  # session_id -> monotonic deadline
+                    self._heap = []       # (deadline when queued, session_id), one entry per session
+                    self._queued = set()
+                    self._stopping = threading.Event()
+                    threading.Thread(target=self._run, name='session-reaper', daemon=True).start()
+                    self._pid = os.getpid()
+
+    def touch(self, session_id):
+        """Record activity on a session, pushing back its idle deadline"""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        self._track(session_id, time.monotonic() + self.idle_seconds)
+
+    def _track(self, session_id, deadline):
+        with self._lock:
+            self._deadlines[session_id] = deadline
+            if session_id not in self._queued:
+                self._queued.add(session_id)
+                heapq.heappush(self._heap, (deadline, session_id))
+
+    def forget(self, session_id):
+        """Stop tracking a session that was ended; its heap entry is skipped when it comes due"""
+        if self.enabled and self._pid == os.getpid():
+            with self._lock:
+                self._deadlines.pop(session_id, None)
+
+    def _due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, session_id = heapq.heappop(self._heap)
+                deadline = self._deadlines.get(session_id)
+                if deadline is None:
+                    self._queued.discard(session_id)
+                elif deadline > now:
+                    heapq.heappush(self._heap, (deadline, session_id))
+                else:
+                    del self._deadlines[session_id]
+                    self._queued.discard(session_id)
+                    due.append(session_id)
+        return due
+
+    def sweep(self):
+        """End every session idle past the timeout, returning how many were finalized"""
+        if not self.enabled:
+            return 0
+        self._ensure_started()
+        started = time.perf_counter()
+        expired = []
+        for session_id in self._due(time.monotonic()):
+            try:
+                conversation, idle_in = self.store.pop_idle(session_id, self.idle_seconds)
+            except Exception as e:
+                log.error("Error claiming idle session %s: %s", session_id, e)
+                self._track(session_id, time.monotonic() + self.interval)
+                continue
+            if conversation is not None:
+                expired.append((session_id, conversation))
+            elif idle_in is not None:
+                # Active since (on another worker, or just now); check again when it could be idle
+                self._track(session_id, time.monotonic() + idle_in)
+        if expired:
+            try:
+                self.finalize(expired)
+            except Exception as e:
+                log.error("Error finalizing %d idle sessions: %s", len(expired), e)
+            metrics.SESSIONS_REAPED.inc(len(expired))
+        metrics.REAPER_SWEEP_SECONDS.observe(time.perf_counter() - started)
+        return len(expired)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                log.error("Idle session sweep failed: %s", e)
+
+    def stats(self):
+        if not self.enabled or self._pid != os.getpid():
+            return {'enabled': self.enabled, 'tracked': 0, 'queued': 0, 'idle_seconds': self.idle_seconds}
+        with self._lock:
+            return {'enabled': True, 'tracked': len(self._deadlines), 'queued': len(self._heap),
+                    'idle_seconds': self.idle_seconds}
+
+    def close(self):
+        """Stop the sweeper; sessions still open are left for the next process's store"""
+        if self._pid == os.getpid():
+            self._stopping.set()
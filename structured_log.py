@@ -0,0 +1,80 @@
+# structured_log.py - JSON-lines logging written to stdout by a background thread
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+ROOT_LOGGER = 'carbon'
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra={'fields': {...}}`"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for a listener thread so callers never wait on stdout.
+
+    The listener is started lazily in each process, so workers forked from a
+    preloaded parent get their own thread and queue.
+    """
+
+    def __init__(self):
+        super().__init__(queue.SimpleQueue())
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Records queued before a fork belong to the parent
+                self.queue = queue.SimpleQueue()
+                output = logging.StreamHandler(sys.stdout)
+                output.setFormatter(JsonFormatter())
+                self._listener = logging.handlers.QueueListener(self.queue, output)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def stop(self):
+        """Write out queued records and stop the listener"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+_handler = None
+
+
+def get_logger(name):
+    """Logger for a module, e.g. get_logger('server') -> carbon.server"""
+    global _handler
+    if _handler is None:
+        _handler = BackgroundQueueHandler()
+        root = logging.getLogger(ROOT_LOGGER)
+        root.addHandler(_handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        atexit.register(_handler.stop)
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -1,15 +1,121 @@
-# openai_client.py - Simple OpenAI client configuration
+# token_manager.py - Process-wide Azure OpenAI client configuration
+import atexit
+import importlib.util
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import threading
 
-load_dotenv()
+import httpx
+
+# Azure OpenAI deployment settings
+AZURE_ENDPOINT = os.getenv('AZURE_OPENAI_ENDPOINT', "https://aimaker-openai.openai.azure.com/")
+API_VERSION = os.getenv('AZURE_OPENAI_API_VERSION', "2024-12-01-preview")
+
+# Connection pool settings (shared by every request handled in this worker)
+POOL_MAX_CONNECTIONS = int(os.getenv('OPENAI_POOL_MAX_CONNECTIONS', '100'))
+POOL_MAX_KEEPALIVE = int(os.getenv('OPENAI_POOL_MAX_KEEPALIVE', '20'))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_POOL_KEEPALIVE_EXPIRY', '60'))
+CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '120'))
+# Retries are made by rate_limiter.call_with_retries, so they wait for the shared budget;
+# the SDK's own retries are turned off
+MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+_async_client = None
+
+
+def _pool_settings():
+    """Connection limits and timeouts shared by the sync and async clients."""
+    return dict(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+def import_openai():
+    """Import the OpenAI SDK, which takes about half a second.
+
+    Deferred from module import so workers boot quickly; server.startup()
+    calls it ahead of the first completion (in the gunicorn master when
+    the app is preloaded, so workers share the loaded modules).
+    """
+    import openai
+    return openai
+
+
+def _build_http_client():
+    """Build the keep-alive httpx client backing the OpenAI client."""
+    return httpx.Client(**_pool_settings())
 
-# Initialize OpenAI client
-client = OpenAI(
-    api_key=os.getenv('OPENAI_API_KEY')
-)
 
 def get_openai_client():
-    """Get the configured OpenAI client."""
-    return client
\ No newline at end of file
+    """Get the process-wide Azure OpenAI client, creating it on first use.
+
+    The client is rebuilt after a fork so gunicorn workers never share
+    sockets inherited from the master process.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = import_openai().AzureOpenAI(
+                api_version=API_VERSION,
+                azure_endpoint=AZURE_ENDPOINT,
+                api_key=os.getenv('OPENAI_API_KEY'),
+                max_retries=0,
+                http_client=_build_http_client(),
+            )
+            _client_pid = pid
+    return _client
+
+
+def close_openai_client():
+    """Close the pooled client and its open connections."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def get_async_openai_client():
+    """Get the process-wide async Azure OpenAI client for the ASGI app.
+
+    Must be called from the event loop that will use it.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = import_openai().AsyncAzureOpenAI(
+            api_version=API_VERSION,
+            azure_endpoint=AZURE_ENDPOINT,
+            api_key=os.getenv('OPENAI_API_KEY'),
+            max_retries=0,
+            http_client=httpx.AsyncClient(**_pool_settings()),
+        )
+    return _async_client
+
+
+async def close_async_openai_client():
+    """Close the async client; called from the ASGI app's shutdown."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+atexit.register(close_openai_client)
@@ -0,0 +1,347 @@
+"""Append-only log of per-turn impact events, in rotated columnar segment files.
+
+    python turn_log.py --summary   # per-variant totals, scanned from the segments
+    python turn_log.py --load      # COPY finished segments into csci_8980_turn_events
+
+Every upstream completion becomes one event: time, session, variant, mode,
+model, input/output/total tokens, energy, CO2 and upstream latency. Events
+are queued without blocking the request and written by a background thread,
+TURN_LOG_BATCH_SIZE rows at a time (one Parquet row group or Arrow record
+batch), to a compressed segment file per worker. A segment is rotated after
+TURN_LOG_SEGMENT_ROWS rows or TURN_LOG_SEGMENT_SECONDS seconds. It is
+written as .tmp and renamed when complete, so readers only see whole files.
+Events not yet in a finished segment are lost if the worker is killed.
+
+With TURN_LOG_LOAD_TO_DB=true, each finished segment is also bulk-loaded
+into Postgres with COPY. --load catches up on segments that were not.
+Each segment is loaded once: its name is recorded in the same transaction.
+
+Needs pyarrow (`pip install pyarrow`); without it the turn log stays off.
+"""
+import argparse
+import glob
+import io
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from db import TURN_EVENT_COLUMNS, get_loaded_turn_segments, load_turn_segment
+from structured_log import get_logger
+
+log = get_logger('turn_log')
+
+# Directory for segment files; unset disables the turn log
+TURN_LOG_DIR = os.getenv('TURN_LOG_DIR')
+TURN_LOG_FORMAT = os.getenv('TURN_LOG_FORMAT', 'parquet')  # 'parquet' or 'arrow' (IPC file)
+TURN_LOG_COMPRESSION = os.getenv('TURN_LOG_COMPRESSION', 'zstd')
+TURN_LOG_BATCH_SIZE = int(os.getenv('TURN_LOG_BATCH_SIZE', '10000'))
+TURN_LOG_SEGMENT_ROWS = int(os.getenv('TURN_LOG_SEGMENT_ROWS', '1000000'))
+TURN_LOG_SEGMENT_SECONDS = float(os.getenv('TURN_LOG_SEGMENT_SECONDS', '900'))
+TURN_LOG_MAX_QUEUE = int(os.getenv('TURN_LOG_MAX_QUEUE', '100000'))
+TURN_LOG_LOAD_TO_DB = os.getenv('TURN_LOG_LOAD_TO_DB', 'false').lower() == 'true'
+
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+# Column order of the events, the segment files and csci_8980_turn_events
+COLUMNS = tuple(TURN_EVENT_COLUMNS)
+
+
+def import_pyarrow():
+    """Import pyarrow and the submodules used here, or None when it is not installed.
+
+    Deferred from module import (it takes about 100 ms) so servers without
+    TURN_LOG_DIR never load it, like token_manager.import_openai().
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv
+        import pyarrow.dataset
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:  # The turn log is optional
+        return None
+    return pa
+
+
+def event_schema():
+    pa = import_pyarrow()
+    return pa.schema([
+        ('ts', pa.timestamp('us', tz='UTC')),
+        ('session_id', pa.string()),
+        ('test_variant', pa.string()),
+        ('mode', pa.string()),
+        ('model', pa.string()),
+        ('input_tokens', pa.int32()),
+        ('output_tokens', pa.int32()),
+        ('total_tokens', pa.int32()),
+        ('energy_kwh', pa.float64()),
+        ('co2_grams', pa.float64()),
+        ('upstream_seconds', pa.float64()),
+    ])
+
+
+def to_batch(events, schema):
+    """A record batch from event tuples in COLUMNS order"""
+    pa = import_pyarrow()
+    columns = list(zip(*events))
+    columns[0] = [int(ts * 1_000_000) for ts in columns[0]]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+    )
+
+
+class SegmentWriter:
+    """One segment file being written; close() renames it into place"""
+
+    def __init__(self, directory, file_format, compression, schema):
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        name = f"turns-{stamp}-{os.getpid()}-{uuid.uuid4().hex[:6]}.{EXTENSIONS[file_format]}"
+        self.path = os.path.join(directory, name)
+        self.tmp_path = self.path + '.tmp'
+        self.rows = 0
+        pa = import_pyarrow()
+        if file_format == 'parquet':
+            self._writer = pa.parquet.ParquetWriter(self.tmp_path, schema, compression=compression)
+        else:
+            # IPC buffers support only LZ4 and Zstandard
+            options = pa.ipc.IpcWriteOptions(
+                compression=compression if compression in ('lz4', 'zstd') else None
+            )
+            self._writer = pa.ipc.new_file(self.tmp_path, schema, options=options)
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        self._writer.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        """Close the writer and delete the unfinished file"""
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class TurnLog:
+    """Accepts turn events immediately and appends them to segment files in batches."""
+
+    def __init__(self, directory=TURN_LOG_DIR, database_url=None, file_format=TURN_LOG_FORMAT,
+                 compression=TURN_LOG_COMPRESSION, batch_size=TURN_LOG_BATCH_SIZE,
+                 segment_rows=TURN_LOG_SEGMENT_ROWS, segment_seconds=TURN_LOG_SEGMENT_SECONDS,
+                 max_queue=TURN_LOG_MAX_QUEUE, load_to_db=TURN_LOG_LOAD_TO_DB):
+        if file_format not in EXTENSIONS:
+            raise ValueError(f"TURN_LOG_FORMAT must be one of {', '.join(EXTENSIONS)}")
+        if directory and import_pyarrow() is None:
+            log.warning("TURN_LOG_DIR is set but pyarrow is not installed; turn events are not logged")
+            directory = None
+        self.directory = directory
+        self.database_url = database_url
+        self.file_format = file_format
+        self.compression = compression
+        self.batch_size = batch_size
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.load_to_db = load_to_db and bool(database_url)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'recorded': 0, 'dropped': 0, 'written': 0, 'segments': 0, 'loaded_segments': 0}
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def record(self, session_id, test_variant, mode, impact, upstream_seconds=None, model=None):
+        """Queue one completion's impact (an estimate_impact() result) without waiting on disk"""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        event = (time.time(), session_id, test_variant, mode, model, impact['input_tokens'],
+                 impact['output_tokens'], impact['total_tokens'], impact['energy_kwh'], impact['co2_grams'],
+                 upstream_seconds)
+        try:
+            self._queue.put_nowait(event)
+            self._count('recorded')
+        except queue.Full:
+            # Never block the request on the log
+            self._count('dropped')
+
+    def _ensure_started(self):
+        # Started lazily so each forked worker writes its own segments
+        if self._thread_pid != os.getpid():
+            self._thread_pid = os.getpid()
+            self._stopping.clear()
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='turn-log', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        schema = event_schema()
+        segment = None
+        pending = []
+        first_event = None  # when the current segment's first event arrived
+        while True:
+            stopping = self._stopping.is_set()
+            try:
+                pending.append(self._queue.get_nowait() if stopping else self._queue.get(timeout=0.5))
+                first_event = first_event or time.monotonic()
+            except queue.Empty:
+                pass
+            drained = stopping and self._queue.empty()
+            expired = first_event is not None and time.monotonic() - first_event >= self.segment_seconds
+            try:
+                if len(pending) >= self.batch_size or (pending and (expired or drained)):
+                    segment = segment or SegmentWriter(self.directory, self.file_format, self.compression, schema)
+                    segment.write(to_batch(pending, schema))
+                    self._count('written', len(pending))
+                    pending = []
+                if segment is not None and (expired or drained or segment.rows >= self.segment_rows):
+                    self._finish(segment)
+                    segment, first_event = None, None
+            except Exception as e:
+                log.error("Error writing turn log segment in %s: %s", self.directory, e)
+                # Events already in the unfinished segment are lost with it
+                lost = len(pending) + (segment.rows if segment is not None else 0)
+                if segment is not None:
+                    try:
+                        segment.abort()
+                    except OSError as abort_error:
+                        log.error("Error removing %s: %s", segment.tmp_path, abort_error)
+                self._count('dropped', lost)
+                segment, pending, first_event = None, [], None
+            if drained:
+                break
+
+    def _finish(self, segment):
+        path = segment.close()
+        self._count('segments')
+        if self.load_to_db:
+            try:
+                load_segment(path, self.database_url)
+                self._count('loaded_segments')
+            except Exception as e:
+                log.error("Error loading turn log segment %s: %s", path, e)
+
+    def _count(self, stat, amount=1):
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            return {'enabled': self.enabled, 'queued': self._queue.qsize(), **self._stats}
+
+    def close(self, timeout=10):
+        """Write queued events and finish the open segment"""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._stopping.set()
+            self._thread.join(timeout)
+
+
+def segment_paths(directory):
+    """Finished segment files, oldest first"""
+    paths = []
+    for extension in EXTENSIONS.values():
+        paths += glob.glob(os.path.join(directory, f"turns-*.{extension}"))
+    return sorted(paths, key=os.path.basename)
+
+
+def read_segment(path):
+    pa = import_pyarrow()
+    if path.endswith('.parquet'):
+        return pa.parquet.read_table(path)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def load_segment(path, database_url):
+    """COPY one segment into csci_8980_turn_events, returning rows loaded (0 if it already was)"""
+    pa = import_pyarrow()
+    table = read_segment(path)
+    buffer = io.BytesIO()
+    # Nulls are written unquoted and empty, which COPY reads as NULL
+    pa.csv.write_csv(table.select(list(COLUMNS)), buffer, pa.csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    return load_turn_segment(os.path.basename(path), io.TextIOWrapper(buffer, encoding='utf-8'),
+                             table.num_rows, database_url)
+
+
+def load_segments(directory, database_url):
+    """Load every finished segment not yet in Postgres, returning (segments, rows) loaded"""
+    loaded = get_loaded_turn_segments(database_url)
+    segments = rows = 0
+    for path in segment_paths(directory):
+        if os.path.basename(path) not in loaded:
+            rows += load_segment(path, database_url)
+            segments += 1
+    return segments, rows
+
+
+def summarize(directory):
+    """Turns, tokens, energy and CO2 per variant, read from the segments' columns only"""
+    paths = segment_paths(directory)
+    if not paths:
+        return None
+    pa = import_pyarrow()
+    tables = []
+    for file_format, extension in EXTENSIONS.items():
+        files = [p for p in paths if p.endswith('.' + extension)]
+        if files:
+            dataset = pa.dataset.dataset(files, format='ipc' if file_format == 'arrow' else 'parquet')
+            tables.append(dataset.to_table(columns=['test_variant', 'total_tokens', 'energy_kwh', 'co2_grams']))
+    table = pa.concat_tables(tables)
+    return table.group_by('test_variant').aggregate([
+        ('total_tokens', 'count'), ('total_tokens', 'sum'), ('energy_kwh', 'sum'), ('co2_grams', 'sum'),
+        ('co2_grams', 'mean'),
+    ]).sort_by('test_variant')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default=TURN_LOG_DIR, help='segment directory (default TURN_LOG_DIR)')
+    parser.add_argument('--summary', action='store_true', help='print per-variant totals from the segments')
+    parser.add_argument('--load', action='store_true', help='COPY segments not yet loaded into Postgres')
+    args = parser.parse_args()
+
+    if import_pyarrow() is None:
+        parser.error('pyarrow is not installed')
+    if not args.dir:
+        parser.error('give --dir or set TURN_LOG_DIR')
+    if not (args.summary or args.load):
+        parser.error('give --summary and/or --load')
+
+    if args.load:
+        from dotenv import load_dotenv
+        load_dotenv()
+        database_url = os.getenv('DATABASE_URL')
+        if not database_url:
+            parser.error('DATABASE_URL is not set')
+        started = time.perf_counter()
+        segments, rows = load_segments(args.dir, database_url)
+        print(f"Loaded {segments} segments ({rows} turns) in {time.perf_counter() - started:.1f}s")
+
+    if args.summary:
+        started = time.perf_counter()
+        summary = summarize(args.dir)
+        if summary is None:
+            print(f"No segments in {args.dir}")
+            return
+        for row in summary.to_pylist():
+            print(f"{row['test_variant']}: {row['total_tokens_count']} turns, {row['total_tokens_sum']} tokens, "
+                  f"{row['energy_kwh_sum']:.6f} kWh, {row['co2_grams_sum']:.3f} g CO2 "
+                  f"({row['co2_grams_mean']:.4f} g/turn)")
+        print(f"Scanned {len(segment_paths(args.dir))} segments in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()